@@ -0,0 +1,65 @@
+"""
+Timings for flatten_dict and unflatten_dict on large and on deep configs.
+python -m benchmarks.bench_flatten
+"""
+import sys
+import timeit
+
+from quickargs.quickargs import flatten_dict, unflatten_dict
+
+
+def wide_config(leaves, fanout=10):
+    """
+    :return: (nested, flat) config with the given number of leaves, every dict has (at most) fanout entries
+    """
+    nested = {}
+    flat = {}
+    for i in range(leaves):
+        key_hierarchy = []
+        rest = i
+        while True:
+            key_hierarchy.append("k{}".format(rest % fanout))
+            rest //= fanout
+            if rest == 0:
+                break
+        key_hierarchy.append("leaf")
+        flat[tuple(key_hierarchy)] = i
+
+        sub_dict = nested
+        for key in key_hierarchy[:-1]:
+            sub_dict = sub_dict.setdefault(key, {})
+        sub_dict["leaf"] = i
+    return nested, flat
+
+
+def deep_config(depth):
+    """
+    :return: (nested, flat) config that is depth levels deep, with one leaf on every level
+    """
+    nested = sub_dict = {}
+    flat = {}
+    for i in range(depth):
+        sub_dict["leaf"] = i
+        sub_dict["sub"] = {}
+        sub_dict = sub_dict["sub"]
+        flat[("sub",) * i + ("leaf",)] = i
+    return nested, flat
+
+
+def report(name, function, argument, repeat=5):
+    try:
+        seconds = min(timeit.repeat(lambda: function(argument), number=1, repeat=repeat))
+        print("{:<40} {:>10.2f} ms".format(name, seconds * 1000))
+    except RuntimeError:  # RecursionError
+        print("{:<40} {:>13}".format(name, "RecursionError"))
+
+
+def main():
+    configs = [("100k leaves", wide_config(100000)), ("1000 deep", deep_config(1000))]
+    for name, (nested, flat) in configs:
+        report("flatten_dict, {}".format(name), flatten_dict, nested)
+        report("unflatten_dict, {}".format(name), unflatten_dict, flat)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
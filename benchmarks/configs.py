@@ -0,0 +1,74 @@
+"""
+Generators for the configs and command lines that are used in the benchmarks.
+"""
+from datetime import date
+
+# type mixes for generated configs, values are generated based on the index of the key
+value_generators = {
+    "str": [lambda i: "value{}".format(i)],
+    "mixed": [lambda i: "value{}".format(i), lambda i: i, lambda i: i * 0.5, lambda i: i % 2 == 0,
+              lambda i: None, lambda i: [i, i + 1], lambda i: (i, "a"), lambda i: date(2016, 12, 1 + i % 28)],
+}
+
+# command line values that can be used to override a value of the given type
+override_values = {str: "new_value", int: "42", float: "4.2", bool: "False", type(None): "None", list: "[1, 2, 3]",
+                   tuple: "[a, b]", date: "2017-01-01"}
+
+
+def key_hierarchy(i, depth, fanout):
+    """
+    :return: key hierarchy of the i-th leaf, leaves are spread evenly over the sub-dicts
+    """
+    groups = ["group{}".format((i // fanout ** level) % fanout) for level in range(depth - 1)]
+    return groups + ["key{}".format(i)]
+
+
+def generate_flat_config(keys, depth=1, types="mixed"):
+    """
+    :param keys: number of leaves in the config
+    :param depth: nesting depth of the leaves
+    :param types: name of the type mix, see value_generators
+    :return: config as flattened by flatten_dict, i.e. with tuples of keys as keys
+    """
+    fanout = max(2, int(round(keys ** (1.0 / depth))))
+    generators = value_generators[types]
+    return {tuple(key_hierarchy(i, depth, fanout)): generators[i % len(generators)](i) for i in range(keys)}
+
+
+def generate_config(keys, depth=1, types="mixed"):
+    """
+    Same as generate_flat_config but returns a nested config as it would be returned by yaml.load
+    """
+    nested = {}
+    for hierarchy, value in generate_flat_config(keys, depth, types).items():
+        sub_dict = nested
+        for key in hierarchy[:-1]:
+            sub_dict = sub_dict.setdefault(key, {})
+        sub_dict[hierarchy[-1]] = value
+    return nested
+
+
+def generate_deep_config(depth):
+    """
+    :return: config that is depth levels deep, with one leaf on every level
+    """
+    nested = sub_dict = {}
+    for i in range(depth):
+        sub_dict["leaf"] = i
+        sub_dict["sub"] = {}
+        sub_dict = sub_dict["sub"]
+    return nested
+
+
+def generate_argv(flat_config, overrides):
+    """
+    :param flat_config: config as returned by generate_flat_config
+    :param overrides: number of values to override, spread evenly over the config
+    :return: list of command line arguments
+    """
+    keys = sorted(flat_config)
+    step = max(1, len(keys) // max(1, overrides))
+    argv = []
+    for key in keys[::step][:overrides]:
+        argv.append("--{}={}".format(".".join(key), override_values[type(flat_config[key])]))
+    return argv
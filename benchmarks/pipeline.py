@@ -0,0 +1,280 @@
+"""
+asv benchmarks for the stages of loading a config and merging it with the command line.
+Every stage has a time_ benchmark, a peakmem_ benchmark (peak memory of the process) and a track_ benchmark that
+reports the peak memory allocated by the stage alone.
+"""
+import sys
+import time
+import threading
+import tracemalloc
+
+import yaml
+
+from quickargs import YAMLArgsLoader, YAMLArgsCLoader
+from quickargs.quickargs import merge_yaml_with_args, compile_config, compiled_schemas, init_type_parser, \
+    yaml_parse_value, parsed_values, flatten_dict, unflatten_dict
+
+from quickargs.shared import SharedConfig
+from quickargs.sweep import merge_many
+
+from .configs import generate_config, generate_flat_config, generate_deep_config, generate_argv
+
+
+def peak_kb(function, *args):
+    """
+    :return: peak memory in kb that was allocated while running the function
+    """
+    tracemalloc.start()
+    try:
+        function(*args)
+        return tracemalloc.get_traced_memory()[1] / 1024.0
+    finally:
+        tracemalloc.stop()
+
+
+class Flatten(object):
+    params = ([10, 1000, 100000], [1, 4, 16])
+    param_names = ["keys", "depth"]
+    timeout = 300
+
+    def setup(self, keys, depth):
+        self.config = generate_config(keys, depth)
+        self.flat_config = generate_flat_config(keys, depth)
+
+    def time_flatten_dict(self, keys, depth):
+        flatten_dict(self.config)
+
+    def time_unflatten_dict(self, keys, depth):
+        unflatten_dict(self.flat_config)
+
+    def peakmem_flatten_dict(self, keys, depth):
+        flatten_dict(self.config)
+
+    def peakmem_unflatten_dict(self, keys, depth):
+        unflatten_dict(self.flat_config)
+
+    def track_flatten_dict_kb(self, keys, depth):
+        return peak_kb(flatten_dict, self.config)
+
+    def track_unflatten_dict_kb(self, keys, depth):
+        return peak_kb(unflatten_dict, self.flat_config)
+
+    track_flatten_dict_kb.unit = "kb"
+    track_unflatten_dict_kb.unit = "kb"
+
+
+class FlattenDeep(object):
+    params = [100, 1000, 5000]
+    param_names = ["depth"]
+
+    def setup(self, depth):
+        self.config = generate_deep_config(depth)
+        self.flat_config = flatten_dict(self.config)
+
+    def time_flatten_dict(self, depth):
+        flatten_dict(self.config)
+
+    def time_unflatten_dict(self, depth):
+        unflatten_dict(self.flat_config)
+
+
+class Merge(object):
+    params = ([10, 1000, 100000], [1, 4], ["str", "mixed"])
+    param_names = ["keys", "depth", "types"]
+    timeout = 600
+    number = 1
+    repeat = 3
+
+    def setup(self, keys, depth, types):
+        self.config = generate_config(keys, depth, types)
+        self.argv = generate_argv(generate_flat_config(keys, depth, types), 10)
+        self.compiled = compile_config(self.config)
+
+    def merge_cold(self):
+        compiled_schemas.clear()
+        merge_yaml_with_args(self.config, self.argv)
+
+    def time_merge_cold(self, keys, depth, types):
+        self.merge_cold()
+
+    def time_merge_warm(self, keys, depth, types):
+        merge_yaml_with_args(self.config, self.argv)
+
+    def time_compile_config(self, keys, depth, types):
+        compiled_schemas.clear()
+        compile_config(self.config)
+
+    def time_parse(self, keys, depth, types):
+        self.compiled.parse(self.argv)
+
+    def time_parse_fast_engine(self, keys, depth, types):
+        self.compiled.parse(self.argv, engine="fast")
+
+    def peakmem_merge_cold(self, keys, depth, types):
+        self.merge_cold()
+
+    def track_merge_cold_kb(self, keys, depth, types):
+        return peak_kb(self.merge_cold)
+
+    def track_parse_kb(self, keys, depth, types):
+        return peak_kb(self.compiled.parse, self.argv)
+
+    track_merge_cold_kb.unit = "kb"
+    track_parse_kb.unit = "kb"
+
+
+class Overrides(object):
+    params = ([0, 10, 100, 1000], ["str", "mixed"])
+    param_names = ["overrides", "types"]
+
+    def setup(self, overrides, types):
+        self.config = generate_config(1000, 2, types)
+        self.argv = generate_argv(generate_flat_config(1000, 2, types), overrides)
+        self.compiled = compile_config(self.config)
+
+    def time_parse(self, overrides, types):
+        self.compiled.parse(self.argv)
+
+    def time_parse_fast_engine(self, overrides, types):
+        self.compiled.parse(self.argv, engine="fast")
+
+    def track_parse_kb(self, overrides, types):
+        return peak_kb(self.compiled.parse, self.argv)
+
+    track_parse_kb.unit = "kb"
+
+
+class MergeMany(object):
+    """
+    10k trials of a sweep, parsed in worker processes. Only the parsing is spread over the workers, override_dict
+    still runs serially in the parent process, so scaling flattens out once merging dominates. Scaling can only be
+    seen on a machine with at least as many cores as workers.
+    """
+    params = ([1, 2, 4, 8], ["fast", "argparse"])
+    param_names = ["workers", "engine"]
+    trials = 10000
+    timeout = 600
+    number = 1
+    repeat = 3
+
+    def setup(self, workers, engine):
+        flat_config = generate_flat_config(1000, 2, "mixed")
+        self.config = generate_config(1000, 2, "mixed")
+        argv = generate_argv(flat_config, 10)
+        # every trial gets a value of its own for an int key, like a sweep over a seed
+        int_key = sorted(key for key, value in flat_config.items() if type(value) is int)[0]
+        self.argvs = [argv + ["--{}={}".format(".".join(int_key), trial)] for trial in range(self.trials)]
+
+    def time_merge_many(self, workers, engine):
+        merge_many(self.config, self.argvs, engine=engine, workers=workers)
+
+    def track_trials_per_second(self, workers, engine):
+        start = time.time()
+        merge_many(self.config, self.argvs, engine=engine, workers=workers)
+        return self.trials / (time.time() - start)
+
+    track_trials_per_second.unit = "trials/s"
+
+
+class Threads(object):
+    """
+    Many threads parsing their own arguments for the same shared config, e.g. per-tenant overrides in a server
+    """
+    params = ([1, 2, 4, 8], ["fast", "argparse"])
+    param_names = ["threads", "engine"]
+    requests = 2000
+
+    def setup(self, threads, engine):
+        flat_config = generate_flat_config(1000, 2, "mixed")
+        self.shared = SharedConfig(generate_config(1000, 2, "mixed"), engine=engine)
+        self.argv = generate_argv(flat_config, 10)
+
+    def run(self, threads):
+        def handle():
+            for _ in range(self.requests // threads):
+                self.shared.parse(self.argv)
+
+        workers = [threading.Thread(target=handle) for _ in range(threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+    def time_parse(self, threads, engine):
+        self.run(threads)
+
+    def track_requests_per_second(self, threads, engine):
+        start = time.time()
+        self.run(threads)
+        return self.requests / (time.time() - start)
+
+    track_requests_per_second.unit = "requests/s"
+
+
+class Load(object):
+    params = ([10, 1000, 10000], ["YAMLArgsLoader", "YAMLArgsCLoader"])
+    param_names = ["keys", "loader"]
+    timeout = 300
+
+    def setup(self, keys, loader):
+        self.document = yaml.dump(generate_config(keys, 2), default_flow_style=False)
+        self.loader = {"YAMLArgsLoader": YAMLArgsLoader, "YAMLArgsCLoader": YAMLArgsCLoader}[loader]
+        self.argv = ["--group0.key0=42"]
+
+    def load(self):
+        # the loaders take the command line from sys.argv
+        original = sys.argv[1:]
+        sys.argv[1:] = self.argv
+        try:
+            yaml.load(self.document, Loader=self.loader)
+        finally:
+            sys.argv[1:] = original
+
+    def time_load(self, keys, loader):
+        self.load()
+
+    def peakmem_load(self, keys, loader):
+        self.load()
+
+
+class TypeParser(object):
+    params = ["str", "mixed"]
+    param_names = ["types"]
+
+    def setup(self, types):
+        self.values = list(generate_flat_config(1000, 1, types).values())
+
+    def time_init_type_parser(self, types):
+        for value in self.values:
+            init_type_parser(value)
+
+
+class ParseValue(object):
+    params = [("!!bool", "False"), ("!!python/none", "None"), ("!!timestamp", "2017-01-01 10:00:00"),
+              ("!!python/list", "[0.1, 0.2, 0.3]"), ("!!python/list", "[[1, 2], [3, 4]]"),
+              ("!!python/tuple", "[a, b]"), ("!!python/name", "yaml.load"), ("!!python/module", "yaml.composer")]
+    param_names = ["tag_and_value"]
+
+    def setup(self, tag_and_value):
+        # parsed values are cached, disable the cache to measure the parsing itself
+        self.maxsize = parsed_values.maxsize
+        parsed_values.clear()
+        parsed_values.maxsize = 0
+
+    def teardown(self, tag_and_value):
+        parsed_values.maxsize = self.maxsize
+
+    def time_yaml_parse_value(self, tag_and_value):
+        yaml_parse_value(*tag_and_value)
+
+
+class ParseValueCached(object):
+    params = ParseValue.params
+    param_names = ParseValue.param_names
+
+    def setup(self, tag_and_value):
+        parsed_values.clear()
+        yaml_parse_value(*tag_and_value)
+
+    def time_yaml_parse_value(self, tag_and_value):
+        yaml_parse_value(*tag_and_value)
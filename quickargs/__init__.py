@@ -1 +1,37 @@
-from .quickargs import YAMLArgsLoader
\ No newline at end of file
+import sys
+import importlib
+
+__version__ = "0.1"
+
+# name -> submodule that defines it. submodules are only imported when one of their names is used, this way
+# "import quickargs" stays cheap and yaml / argparse are only imported when they are needed
+exports = {
+    "YAMLArgsLoader": "quickargs", "YAMLArgsCLoader": "quickargs", "SafeYAMLArgsLoader": "quickargs",
+    "compile_config": "quickargs",
+    "load_cached": "quickargs", "register_type_parser": "quickargs", "register_yaml_object": "quickargs",
+    "MergeStats": "stats",
+    "merge_many": "sweep", "merge_sweep": "sweep", "expand_sweep": "sweep",
+    "load_lazy": "lazy",
+    "ConfigWatcher": "watch",
+    "SharedConfig": "shared",
+    "FrozenConfig": "frozen",
+}
+
+# async syntax, python 3.5+
+if sys.version_info >= (3, 5):
+    exports["load_config"] = "aio"
+
+
+def __getattr__(name):
+    # only called for names that are not defined (yet), python 3.7+
+    if name in exports:
+        value = getattr(importlib.import_module("." + exports[name], __name__), name)
+        globals()[name] = value
+        return value
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+
+
+if sys.version_info < (3, 7):
+    # no module __getattr__, import everything right away
+    for name in exports:
+        __getattr__(name)
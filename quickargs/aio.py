@@ -0,0 +1,70 @@
+import os
+import sys
+import asyncio
+import functools
+
+from .cache import DiskCache
+from .quickargs import compile_file
+
+
+async def load_config(path, argv=None, engine="argparse", allowed_modules=None, exit_on_error=False, executor=None):
+    """
+    Load a config file and merge it with the command line arguments without blocking the event loop. The file is read,
+    loaded and merged in an executor. Concurrent calls for the same file share a single load, only the (cheap) merging
+    is done once per call. Compiled configs are cached on disk if enabled through QUICKARGS_CACHE, see DiskCache.
+    Python 3.5+ only.
+    :param path: path of the config file
+    :param argv: command line arguments, if argv is None, sys.argv will be used
+    :param engine: "argparse" or "fast", see CompiledConfig.match_arguments for the differences
+    :param allowed_modules: None or modules for safe loading and parsing, see compile_config
+    :param exit_on_error: if False (unlike everywhere else), invalid arguments raise InvalidCommandLineException
+                          instead of exiting, an event loop should not be stopped by a config. So does -h / --help,
+                          the help message is the message of the exception
+    :param executor: concurrent.futures executor to run in, the default executor of the event loop if None
+    :return: dictionary with merged arguments, just like merge_yaml_with_args
+    """
+    loop = get_running_loop()
+    if argv is None:
+        argv = sys.argv[1:]
+    if allowed_modules is not None:
+        allowed_modules = tuple(allowed_modules)
+
+    key = (loop, os.path.realpath(path), allowed_modules)
+    loading = pending_loads.get(key)
+    if loading is None:
+        loading = asyncio.ensure_future(load_compiled(loop, path, allowed_modules, executor))
+        pending_loads[key] = loading
+        loading.add_done_callback(functools.partial(forget_load, key))
+
+    # a caller that is cancelled must not cancel the load for all the others
+    compiled = await asyncio.shield(loading)
+    parse = functools.partial(compiled.parse, argv, engine=engine, exit_on_error=exit_on_error)
+    return await loop.run_in_executor(executor, parse)
+
+
+async def load_compiled(loop, path, allowed_modules, executor):
+    """
+    :return: CompiledConfig of the config file, see compile_file
+    """
+    content = await loop.run_in_executor(executor, read_file, path)
+    compile_content = functools.partial(compile_file, content, allowed_modules=allowed_modules,
+                                        disk_cache=DiskCache.from_environment())
+    return await loop.run_in_executor(executor, compile_content)
+
+
+def read_file(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def forget_load(key, loading):
+    # the next call loads the file again, it might have changed in the meantime
+    if pending_loads.get(key) is loading:
+        del pending_loads[key]
+
+
+# (event loop, path, allowed modules) -> future of the CompiledConfig, for the loads that are still running
+pending_loads = {}
+
+# get_running_loop is python 3.7+, get_event_loop returns the running loop inside coroutines as well
+get_running_loop = getattr(asyncio, "get_running_loop", asyncio.get_event_loop)
@@ -0,0 +1,217 @@
+import os
+import sys
+import pickle
+import hashlib
+import importlib
+import threading
+from collections import OrderedDict
+from types import ModuleType
+
+from . import __version__
+
+
+class DiskCache(object):
+    """
+    Stores compiled configs on disk. Entries are keyed by the content of the config file, the loader class, the
+    quickargs version and the cache format, so a changed config file or a quickargs update never hits an outdated
+    entry.
+    Enable the cache by setting the QUICKARGS_CACHE environment variable:
+    QUICKARGS_CACHE=1 uses $XDG_CACHE_HOME/quickargs (or ~/.cache/quickargs), any other value is used as cache directory
+    """
+    def __init__(self, directory):
+        self.directory = directory
+
+    @classmethod
+    def from_environment(cls, enabled_by_default=False):
+        """
+        :param enabled_by_default: if True, an unset QUICKARGS_CACHE environment variable counts as QUICKARGS_CACHE=1
+        :return: DiskCache as configured by the QUICKARGS_CACHE environment variable or None if caching is disabled
+        """
+        setting = os.environ.get("QUICKARGS_CACHE", "")
+        if setting == "" and enabled_by_default:
+            setting = "1"
+        if setting in ["", "0"]:
+            return None
+        if setting == "1":
+            cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+            return cls(os.path.join(cache_home, "quickargs"))
+        return cls(setting)
+
+    def key(self, content, loader_class):
+        """
+        :param content: content of the config file, str or bytes
+        :param loader_class: yaml loader class that is used for loading the config file, or any other name for the way
+                             the config file is loaded
+        :return: cache key
+        """
+        if not isinstance(content, bytes):
+            content = content.encode("utf-8")
+        if not isinstance(loader_class, str):
+            loader_class = "{}.{}".format(loader_class.__module__, loader_class.__name__)
+        header = "{}\n{}\n{}\n{}\n".format(__version__, cache_format, loader_class, sys.version_info[:2])
+        return hashlib.sha256(header.encode("utf-8") + content).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, "{}.pickle".format(key))
+
+    def load(self, key):
+        """
+        :param key: cache key as returned by DiskCache.key
+        :return: cached object or None if there is no (valid) entry for the key
+        """
+        try:
+            with open(self.path(key), "rb") as f:
+                stored_key, obj = ModuleUnpickler(f).load()
+        # missing, corrupt or unreadable entries are treated as cache misses, they are rebuilt by the caller
+        except Exception:
+            return None
+        if stored_key != key:
+            return None
+        return obj
+
+    def store(self, key, obj):
+        """
+        Store an object in the cache. Writing is atomic, concurrent readers never see half-written entries.
+        Objects that can not be pickled and problems writing the cache directory are silently ignored.
+        :param key: cache key as returned by DiskCache.key
+        :param obj: object to cache
+        """
+        # tempfile takes a while to import, and it is only needed for filling the cache
+        import tempfile
+
+        temp_name = None
+        try:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+            with tempfile.NamedTemporaryFile("wb", dir=self.directory, suffix=".tmp", delete=False) as f:
+                temp_name = f.name
+                ModulePickler(f, pickle.HIGHEST_PROTOCOL).dump((key, obj))
+            replace_file(temp_name, self.path(key))
+        except Exception:
+            if temp_name is not None and os.path.exists(temp_name):
+                os.remove(temp_name)
+
+
+# version of the pickled objects, increase it whenever the attributes of a cached class change (e.g. CompiledConfig or
+# ConfigSchema), so that entries of older versions are not loaded
+cache_format = 2
+
+
+# os.replace is not available in python2, os.rename is atomic as well on posix systems
+replace_file = getattr(os, "replace", os.rename)
+
+
+class ModulePickler(pickle.Pickler):
+    """
+    Modules can not be pickled, store them by name instead (configs can contain !!python/module values)
+    """
+    def persistent_id(self, obj):
+        if isinstance(obj, ModuleType):
+            return "module:" + obj.__name__
+        return None
+
+
+class ModuleUnpickler(pickle.Unpickler):
+    def persistent_load(self, pid):
+        if not pid.startswith("module:"):
+            raise pickle.UnpicklingError("unknown persistent id {}".format(pid))
+        return importlib.import_module(pid[len("module:"):])
+
+
+class LRUCache(object):
+    """
+    Dictionary with a maximum number of entries, when it is full the least recently used entry is dropped.
+    Counts hits and misses, e.g. to find out whether the cache is large enough.
+    """
+    def __init__(self, maxsize):
+        """
+        :param maxsize: maximum number of entries, 0 disables the cache
+        """
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        # popping and inserting again moves the entry to the end, python2 has no OrderedDict.move_to_end
+        value = self.entries.pop(key, missing)
+        if value is missing:
+            self.misses += 1
+            return default
+        self.entries[key] = value
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        if self.maxsize <= 0:
+            return
+        self.entries[key] = value
+        while len(self.entries) > self.maxsize:
+            try:
+                self.entries.popitem(last=False)
+            except KeyError:  # emptied by another thread in the meantime
+                break
+
+    def clear(self):
+        self.entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __repr__(self):
+        return "LRUCache(maxsize={}, size={}, hits={}, misses={})".format(self.maxsize, len(self), self.hits,
+                                                                         self.misses)
+
+
+# marker for keys that are not in an LRUCache
+missing = object()
+
+
+class BuildOnceCache(object):
+    """
+    Thread-safe dictionary whose values are built on first use. Every value is built only once: threads that need a
+    value that is being built wait for it, threads that need other values don't. Looking up a value that was already
+    built takes no lock at all.
+    """
+    def __init__(self):
+        self.values = {}
+        self.lock = threading.Lock()  # guards key_locks
+        self.key_locks = {}  # key -> lock held while its value is built
+        self.builds = 0
+
+    def get(self, key, build):
+        """
+        :param key: hashable key
+        :param build: function without arguments that builds the value for the key, not called if it is already built
+        :return: value for the key
+        """
+        value = self.values.get(key, missing)
+        if value is not missing:
+            return value
+
+        with self.lock:
+            key_lock = self.key_locks.setdefault(key, threading.Lock())
+        try:
+            with key_lock:
+                # another thread might have built it while this thread was waiting
+                value = self.values.get(key, missing)
+                if value is missing:
+                    value = build()
+                    self.values[key] = value
+                    self.builds += 1
+                return value
+        finally:
+            with self.lock:
+                if self.key_locks.get(key) is key_lock:
+                    del self.key_locks[key]
+
+    def clear(self):
+        self.values.clear()
+
+    def __len__(self):
+        return len(self.values)
+
+    def __contains__(self, key):
+        return key in self.values
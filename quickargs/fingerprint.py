@@ -0,0 +1,161 @@
+import sys
+import types
+import hashlib
+from datetime import date, time, datetime
+
+try:
+    from collections.abc import Mapping
+except ImportError:  # python2
+    from collections import Mapping
+
+from .frozen import FrozenList
+
+if sys.version_info[0] < 3:
+    integer_types = (int, long)
+    text_type = unicode
+else:
+    integer_types = (int,)
+    text_type = str
+
+
+def config_hash(config):
+    """
+    Hash of a nested config: the sum of the hashes of its leaves (see leaf_hash), so that single leaves can be replaced
+    without hashing the whole config again, see override_hash
+    :param config: nested dict (or any mapping)
+    :return: integer below 2 ** fingerprint_bits
+    """
+    total = 0
+    # same walk as flatten_dict, but empty dicts are leaves as well
+    stack = [((), iter(config.items()))]
+    while stack:
+        key_hierarchy, items = stack[-1]
+        for key, value in items:
+            if isinstance(value, Mapping) and value:
+                stack.append((key_hierarchy + (key,), iter(value.items())))
+                break
+            total += leaf_hash(key_hierarchy + (key,), value)
+        else:
+            stack.pop()
+    return total % fingerprint_modulus
+
+
+def override_hash(defaults_hash, config, overrides):
+    """
+    :param defaults_hash: config_hash of config
+    :param config: nested config
+    :param overrides: flat dictionary of new values for existing leaves, keys are tuples of keys as in flatten_dict
+    :return: config_hash of config with the overrides applied, at the cost of hashing the overridden leaves only
+    """
+    total = defaults_hash
+    for path, value in overrides.items():
+        default = config
+        for key in path:
+            default = default[key]
+        total += leaf_hash(path, value) - leaf_hash(path, default)
+    return total % fingerprint_modulus
+
+
+def fingerprint_hex(total):
+    """
+    :return: config hash as a hex string of fixed length
+    """
+    return "{:0{}x}".format(total, fingerprint_bits // 4)
+
+
+def leaf_hash(path, value):
+    """
+    :return: hash of a value at a key path. It only depends on the encoded value (see encode), so it is the same in
+             every process, unlike hash()
+    """
+    parts = []
+    encode(path, parts)
+    encode(value, parts)
+    digest = hashlib.sha256(b"".join(parts)).hexdigest()
+    return int(digest[:fingerprint_bits // 4], 16)
+
+
+def encode(value, parts):
+    """
+    Append an unambiguous byte encoding of value to parts. Types are part of the encoding, so 1, 1.0 and True or lists
+    and tuples are different. Functions and classes are encoded by their names (just like !!python/name), modules by
+    their names as well, other objects by what pickle would store for them (e.g. the attributes of yaml objects).
+    :param value: any value that can be in a config
+    :param parts: list of bytes
+    """
+    value_type = type(value)
+    if value is None:
+        parts.append(b"N")
+    elif value_type is bool:
+        parts.append(b"T" if value else b"F")
+    elif value_type in integer_types:
+        parts.append("i{};".format(value).encode("ascii"))
+    elif value_type is float:
+        parts.append("f{};".format(value.hex()).encode("ascii"))
+    elif value_type is complex:
+        parts.append("c{};{};".format(value.real.hex(), value.imag.hex()).encode("ascii"))
+    elif value_type is text_type:
+        append_sized(b"s", value.encode("utf-8", "surrogatepass"), parts)
+    elif value_type is bytes:
+        append_sized(b"b", value, parts)
+    elif value_type is list or value_type is FrozenList:
+        append_sequence(b"l", value, parts)
+    elif value_type is tuple:
+        append_sequence(b"t", value, parts)
+    elif isinstance(value, Mapping):
+        # the order of the keys does not matter
+        append_sorted(b"d", [encoded(key) + encoded(item) for key, item in value.items()], parts)
+    elif value_type is set or value_type is frozenset:
+        append_sorted(b"S", [encoded(item) for item in value], parts)
+    elif value_type in (datetime, date, time):
+        append_sized(b"D", "{}:{}".format(value_type.__name__, value.isoformat()).encode("ascii"), parts)
+    elif isinstance(value, types.ModuleType):
+        append_sized(b"m", value.__name__.encode("utf-8"), parts)
+    elif isinstance(value, (type, types.FunctionType)) or is_builtin_function(value):
+        name = "{}:{}".format(value.__module__, getattr(value, "__qualname__", value.__name__))
+        append_sized(b"n", name.encode("utf-8"), parts)
+    else:
+        try:
+            reduced = value.__reduce_ex__(2)
+        except Exception:
+            raise TypeError("Can not fingerprint values of type {}".format(value_type))
+        if isinstance(reduced, str):  # a global object, stored by name
+            reduced = (value_type, reduced)
+        else:
+            # (callable, arguments, state, list items, dict items), the items are iterators
+            reduced = reduced[:3] + tuple(None if items is None else list(items) for items in reduced[3:])
+        parts.append(b"o")
+        encode(reduced, parts)
+
+
+def is_builtin_function(value):
+    # builtin methods of objects (e.g. [].append) are encoded with their object
+    return isinstance(value, types.BuiltinFunctionType) and \
+        (value.__self__ is None or isinstance(value.__self__, types.ModuleType))
+
+
+def encoded(value):
+    parts = []
+    encode(value, parts)
+    return b"".join(parts)
+
+
+def append_sized(tag, data, parts):
+    parts.append(tag + "{}:".format(len(data)).encode("ascii"))
+    parts.append(data)
+
+
+def append_sequence(tag, values, parts):
+    parts.append(tag + "{}:".format(len(values)).encode("ascii"))
+    for item in values:
+        encode(item, parts)
+
+
+def append_sorted(tag, encoded_items, parts):
+    parts.append(tag + "{}:".format(len(encoded_items)).encode("ascii"))
+    parts.extend(sorted(encoded_items))
+
+
+# fingerprints are sums of leaf hashes modulo 2 ** fingerprint_bits
+fingerprint_bits = 128
+fingerprint_modulus = 2 ** fingerprint_bits
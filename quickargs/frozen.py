@@ -0,0 +1,197 @@
+try:
+    from collections.abc import Mapping
+except ImportError:  # python2
+    from collections import Mapping
+
+
+class FrozenConfig(Mapping):
+    """
+    Immutable, hashable nested config. Sub-dicts are FrozenConfigs as well, lists are FrozenLists. A FrozenConfig can be
+    handed to other components without copying it and it can be used as a cache key.
+    Derived configs (see set and update) share every sub-config that is not on the path of a changed value with the
+    config they were derived from, and their hash is derived from its hash.
+    base = FrozenConfig({"logging": {"level": 4}, "layers": [...]})
+    debug = base.set(("logging", "level"), 0)   # debug["layers"] is base["layers"]
+    """
+    __slots__ = ["data", "hash_value"]
+
+    def __init__(self, data=None):
+        """
+        :param data: nested dict (or any mapping), it is not modified. Its values are frozen, see freeze
+        """
+        self.data = {key: freeze(value) for key, value in (data or {}).items()}
+        self.hash_value = None
+
+    @classmethod
+    def from_frozen(cls, data, hash_value=None):
+        """
+        :param data: dictionary whose values are frozen already, it is kept by reference and must not be changed
+        :param hash_value: hash of the config if it is known already
+        """
+        config = cls.__new__(cls)
+        config.data = data
+        config.hash_value = hash_value
+        return config
+
+    def __getitem__(self, key):
+        return self.data[key]
+
+    def __iter__(self):
+        return iter(self.data)
+
+    def __len__(self):
+        return len(self.data)
+
+    def __contains__(self, key):
+        return key in self.data
+
+    def __hash__(self):
+        if self.hash_value is None:
+            # combined like frozenset does it: the order of the keys does not matter and single items can be replaced
+            # without hashing all the others again, see update
+            hash_value = 0
+            for item in self.data.items():
+                hash_value ^= hash(item)
+            self.hash_value = hash_value
+        return self.hash_value
+
+    def __eq__(self, other):
+        if self is other:
+            return True
+        if isinstance(other, FrozenConfig):
+            if self.hash_value is not None and other.hash_value is not None and self.hash_value != other.hash_value:
+                return False
+            return self.data == other.data
+        return super(FrozenConfig, self).__eq__(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def set(self, path, value):
+        """
+        :param path: tuple of keys as in flatten_dict
+        :param value: new value, it is frozen, see freeze
+        :return: new FrozenConfig with value at path. Only the sub-configs on the path are copied
+        """
+        return self.update({tuple(path): value})
+
+    def update(self, overrides):
+        """
+        :param overrides: flat dictionary of new values, keys are tuples of keys as in flatten_dict. All but the last key
+                          of a path have to lead to existing sub-configs
+        :return: new FrozenConfig with the new values. Every sub-config on the paths is copied once, all others are
+                 shared with this config
+        """
+        if not overrides:
+            return self
+
+        by_key = {}
+        for path, value in overrides.items():
+            if not path:
+                raise KeyError(path)
+            by_key.setdefault(path[0], {})[path[1:]] = value
+
+        data = dict(self.data)
+        hash_value = self.hash_value
+        for key, nested_overrides in by_key.items():
+            if () in nested_overrides:
+                value = freeze(nested_overrides[()])
+            else:
+                sub_config = self.data[key]
+                if not isinstance(sub_config, FrozenConfig):
+                    raise KeyError(key)
+                value = sub_config.update(nested_overrides)
+            hash_value = updated_hash(hash_value, key, self.data.get(key, missing), value)
+            data[key] = value
+        return FrozenConfig.from_frozen(data, hash_value)
+
+    def thaw(self):
+        """
+        :return: plain nested dict with lists, the opposite of freeze
+        """
+        return thaw(self)
+
+    def __reduce__(self):
+        return FrozenConfig.from_frozen, (self.data,)
+
+    def __repr__(self):
+        return "FrozenConfig({!r})".format(self.data)
+
+
+class FrozenList(tuple):
+    """
+    Immutable list in a FrozenConfig. It is a tuple, but it compares equal to lists with the same items and never to
+    plain tuples, lists and tuples are different types in configs.
+    """
+    __slots__ = []
+
+    def __eq__(self, other):
+        if isinstance(other, list):
+            return list(self) == other
+        if isinstance(other, FrozenList):
+            return tuple.__eq__(self, other)
+        if isinstance(other, tuple):
+            return False
+        return NotImplemented
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        return equal if equal is NotImplemented else not equal
+
+    def __hash__(self):
+        # different from the hash of a tuple with the same items
+        return hash((FrozenList, tuple.__hash__(self)))
+
+    def __repr__(self):
+        return "FrozenList({!r})".format(list(self))
+
+
+def freeze(value):
+    """
+    :return: immutable version of value: mappings become FrozenConfigs, lists FrozenLists and sets frozensets, also
+             inside of tuples. Everything else is returned as it is
+    """
+    if isinstance(value, (FrozenConfig, FrozenList)):
+        return value
+    if isinstance(value, Mapping):
+        return FrozenConfig(value)
+    if isinstance(value, list):
+        return FrozenList(freeze(item) for item in value)
+    if type(value) is tuple:
+        frozen = tuple(freeze(item) for item in value)
+        return value if all(item is original for item, original in zip(frozen, value)) else frozen
+    if isinstance(value, set):
+        return frozenset(value)
+    return value
+
+
+def thaw(value):
+    """
+    :return: mutable version of a frozen value: FrozenConfigs become dicts and FrozenLists lists
+    """
+    if isinstance(value, FrozenConfig):
+        return {key: thaw(item) for key, item in value.data.items()}
+    if isinstance(value, FrozenList):
+        return [thaw(item) for item in value]
+    if type(value) is tuple:
+        return tuple(thaw(item) for item in value)
+    return value
+
+
+def updated_hash(hash_value, key, old_value, new_value):
+    """
+    :return: hash of a FrozenConfig with hash hash_value after old_value at key was replaced with new_value, None if
+             the hash is not known (the hash is then computed when it is needed)
+    """
+    if hash_value is None:
+        return None
+    try:
+        if old_value is not missing:
+            hash_value ^= hash((key, old_value))
+        return hash_value ^ hash((key, new_value))
+    except TypeError:  # unhashable value, hashing the config will report it
+        return None
+
+
+# marker for keys that don't exist
+missing = object()
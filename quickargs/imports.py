@@ -0,0 +1,20 @@
+import importlib
+
+
+class LazyModule(object):
+    """
+    Stands in for a module that is only imported when one of its attributes is used for the first time. yaml and
+    argparse together take longer to import than everything else, and a cached config needs neither of them.
+    """
+    def __init__(self, name):
+        self.__name = name
+
+    def __getattr__(self, attribute):
+        module = importlib.import_module(self.__name)
+        # from now on, attributes are found without going through __getattr__
+        self.__dict__.update(module.__dict__)
+        return getattr(module, attribute)
+
+
+yaml = LazyModule("yaml")
+argparse = LazyModule("argparse")
@@ -0,0 +1,353 @@
+import mmap
+
+try:
+    from collections.abc import MutableMapping
+except ImportError:  # python2
+    from collections import MutableMapping
+
+from .imports import yaml
+from .quickargs import CompiledConfig, value_loader_class, compile_schema, merge_yaml_with_args
+from .stats import MergeStats, stage
+
+YAML_TAG = "tag:yaml.org,2002:"
+
+
+def load_lazy(path, argv=None, engine="argparse", lazy_size=64 * 1024, stats=None):
+    """
+    Load a (very large) yaml config file and merge it with the command line, without constructing its large parts.
+    The file is memory-mapped and only scanned for its mapping keys and scalar values, these are needed for the command
+    line arguments anyway. Sequences that take up at least lazy_size bytes in the file are constructed on first access,
+    straight from the memory-mapped file. Mappings that contain such sequences are returned as LazyMapping.
+    Files that can not be loaded lazily (e.g. because they use aliases) are loaded normally.
+    :param path: path of a utf-8 encoded yaml file
+    :param argv: command line arguments, if argv is None, sys.argv will be used
+    :param engine: "argparse" or "fast", see CompiledConfig.match_arguments
+    :param lazy_size: sequences smaller than this number of bytes are constructed right away
+    :param stats: optional MergeStats that collects timings of the stages
+    :return: merged config. If it contains lazy parts, it is a LazyMapping (that behaves like a dictionary),
+             otherwise a dictionary, just like merge_yaml_with_args would return it.
+    """
+    dump_stats = stats is None
+    if stats is None:
+        stats = MergeStats.from_environment()
+
+    try:
+        with open(path, "rb") as f:
+            # mmap can not map empty files
+            if not f.read(1):
+                yaml_config = yaml.load("", Loader=value_loader_class())
+                return merge_yaml_with_args(yaml_config, argv, stats=stats, engine=engine)
+            source = LazySource(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+        with stage(stats, "yaml scan"):
+            scanned = scan_document(source, lazy_size)
+
+        if scanned is None:
+            with stage(stats, "yaml load"):
+                yaml_config = yaml.load(source.reader(), Loader=value_loader_class())
+            return merge_yaml_with_args(yaml_config, argv, stats=stats, engine=engine)
+
+        config, flat_config = scanned
+        compiled = LazyCompiledConfig(compile_schema(flat_config, stats=stats), config)
+        return compiled.parse(argv, stats=stats, engine=engine)
+    finally:
+        if dump_stats and stats is not None:
+            stats.dump()
+
+
+class LazyCompiledConfig(CompiledConfig):
+    """
+    CompiledConfig for a config with lazy parts, the help message constructs them to show their default values
+    """
+    def defaults(self):
+        defaults = {}
+        stack = [((), self.config)]
+        while stack:
+            key_hierarchy, mapping = stack.pop()
+            for key, value in mapping.items():
+                if isinstance(value, (dict, LazyMapping)):
+                    stack.append((key_hierarchy + (key,), value))
+                else:
+                    defaults[key_hierarchy + (key,)] = value
+        return defaults
+
+
+class LazyMapping(MutableMapping):
+    """
+    Dictionary of which some values are only constructed on first access. Copies share the values that are not yet
+    constructed, so each of them is constructed only once.
+    """
+    def __init__(self, data):
+        """
+        :param data: dictionary, values can be LazyNodes
+        """
+        self.data = data
+
+    def __getitem__(self, key):
+        value = self.data[key]
+        if isinstance(value, LazyNode):
+            value = value.construct()
+            self.data[key] = value
+        return value
+
+    def __setitem__(self, key, value):
+        self.data[key] = value
+
+    def __delitem__(self, key):
+        del self.data[key]
+
+    def __iter__(self):
+        return iter(self.data)
+
+    def __len__(self):
+        return len(self.data)
+
+    def __contains__(self, key):
+        return key in self.data
+
+    def copy(self):
+        return LazyMapping(dict(self.data))
+
+    def is_constructed(self, key):
+        """
+        :return: False if the value of key has not been accessed yet
+        """
+        return not isinstance(self.data[key], LazyNode)
+
+    def __repr__(self):
+        return "LazyMapping({!r})".format(self.data)
+
+
+class LazyNode(object):
+    """
+    A sequence of the yaml file that is constructed on first access
+    """
+    __slots__ = ["source", "start", "end", "value"]
+
+    def __init__(self, source, start, end):
+        """
+        :param source: LazySource of the yaml file
+        :param start: (line, column) of the start of the node
+        :param end: (line, column) of the end of the node
+        """
+        self.source = source
+        self.start = start
+        self.end = end
+        self.value = None
+
+    def construct(self):
+        if self.source is not None:
+            self.value = self.source.construct(self.start, self.end)
+            self.source = None
+        return self.value
+
+    def __repr__(self):
+        return "<not loaded>" if self.source is not None else repr(self.value)
+
+
+class LazySource(object):
+    """
+    Memory-mapped yaml file. Marks of the yaml parser count characters, not bytes, so their line and column are
+    translated into byte offsets.
+    """
+    def __init__(self, data):
+        self.data = data
+        self.line_offsets = {0: 0}
+
+    def reader(self):
+        # mmap objects are file-like, but reading them does not load the whole file into memory at once
+        self.data.seek(0)
+        return self.data
+
+    def index_lines(self, lines):
+        """
+        Find the byte offsets of the given lines in one pass over the file (only newlines are counted)
+        :param lines: line numbers
+        """
+        chunk_size = 1 << 20
+        wanted_lines = sorted(set(lines) - set(self.line_offsets))
+        if not wanted_lines:
+            return
+        # start at the closest line that is already known
+        line, position = max(item for item in self.line_offsets.items() if item[0] < wanted_lines[0])
+        for wanted in wanted_lines:
+            while line < wanted:
+                chunk = self.data[position:position + chunk_size]
+                newlines = chunk.count(b"\n")
+                if line + newlines < wanted:
+                    line += newlines
+                    position += len(chunk)
+                    continue
+                while line < wanted:
+                    position = self.data.find(b"\n", position) + 1
+                    line += 1
+            self.line_offsets[wanted] = position
+
+    def offset(self, mark):
+        line, column = mark
+        if line not in self.line_offsets:
+            self.index_lines([line])
+        start = self.line_offsets[line]
+        # utf-8 characters are up to 4 bytes long
+        prefix = self.data[start:start + 4 * column].decode("utf-8", "ignore")[:column]
+        return start + len(prefix.encode("utf-8"))
+
+    def construct(self, start, end):
+        text = self.data[self.offset(start):self.offset(end)].decode("utf-8")
+        # indent the first line as in the file, so that the following lines of block collections still line up
+        return yaml.load(" " * start[1] + text, Loader=value_loader_class())
+
+
+class NotLazy(Exception):
+    """
+    The yaml file uses features that can not be loaded lazily
+    """
+    pass
+
+
+def scan_document(source, lazy_size):
+    """
+    Scan the events of a yaml file, construct its scalars and keep large sequences as LazyNodes
+    :param source: LazySource of the yaml file
+    :param lazy_size: sequences of at least this many bytes (roughly) are not constructed
+    :return: (nested config, flat config as returned by flatten_dict) or None if the file can not be loaded lazily
+    """
+    loader = value_loader_class()("")
+    events = yaml.parse(source.reader(), Loader=value_loader_class())
+    lazy_nodes = []
+    small_sequences = []  # (dict, key, LazyNode) for every sequence that is constructed right away
+    flat_config = {}
+
+    try:
+        if not isinstance(next(events), yaml.StreamStartEvent):
+            raise NotLazy()
+        document_start = next(events)
+        # %TAG directives would not be known when constructing a lazy node
+        if not isinstance(document_start, yaml.DocumentStartEvent) or document_start.tags:
+            raise NotLazy()
+        root = next(events)
+        if not isinstance(root, yaml.MappingStartEvent) or not is_default_tag(root.tag, "map"):
+            raise NotLazy()
+
+        # each stack entry: [key hierarchy, data, key of the next value or no_key, contains lazy nodes]
+        stack = [[(), {}, no_key, False]]
+        result = None
+        while stack:
+            frame = stack[-1]
+            key_hierarchy, data, key, has_lazy = frame
+            event = next(events)
+
+            if isinstance(event, yaml.AliasEvent):
+                raise NotLazy()
+
+            if isinstance(event, yaml.MappingEndEvent):
+                stack.pop()
+                value = LazyMapping(data) if has_lazy else data
+                if not stack:
+                    result = value
+                    continue
+                parent = stack[-1]
+                parent[1][parent[2]] = value
+                parent[2] = no_key
+                parent[3] = parent[3] or isinstance(value, LazyMapping)
+                continue
+
+            if key is no_key:
+                if not isinstance(event, yaml.ScalarEvent) or resolve_tag(loader, event) == YAML_TAG + "merge":
+                    raise NotLazy()
+                frame[2] = construct_scalar(loader, event)
+                continue
+
+            path = key_hierarchy + (key,)
+            if isinstance(event, yaml.ScalarEvent):
+                value = construct_scalar(loader, event)
+                flat_config[path] = value
+                data[key] = value
+                frame[2] = no_key
+
+            elif isinstance(event, yaml.SequenceStartEvent):
+                if is_default_tag(event.tag, "seq") or event.tag == YAML_TAG + "python/list":
+                    exemplar = []
+                elif event.tag == YAML_TAG + "python/tuple":
+                    exemplar = ()
+                else:
+                    raise NotLazy()
+                end_event = skip_collection(events)
+                node = LazyNode(source, mark(event.start_mark), mark(end_event.end_mark))
+                lazy_nodes.append(node)
+                data[key] = node
+                flat_config[path] = exemplar
+                if is_large(event, end_event, lazy_size):
+                    frame[3] = True
+                else:
+                    small_sequences.append((data, key, node))
+                frame[2] = no_key
+
+            elif isinstance(event, yaml.MappingStartEvent):
+                if not is_default_tag(event.tag, "map"):
+                    raise NotLazy()
+                stack.append([path, {}, no_key, False])
+
+            else:
+                raise NotLazy()
+
+        # a single document only, just like yaml.load
+        if not isinstance(next(events), yaml.DocumentEndEvent) or not isinstance(next(events), yaml.StreamEndEvent):
+            raise NotLazy()
+
+    except (NotLazy, yaml.YAMLError):
+        # yaml.load reports errors as usual
+        return None
+
+    source.index_lines([line for node in lazy_nodes for line, column in [node.start, node.end]])
+
+    # small sequences are constructed right away. large ones are typed by their tag, that is enough for the parser
+    for data, key, node in small_sequences:
+        data[key] = node.construct()
+    return result, flat_config
+
+
+# marker for "the next event is a key"
+no_key = object()
+
+
+def mark(yaml_mark):
+    return yaml_mark.line, yaml_mark.column
+
+
+def is_large(start_event, end_event, lazy_size):
+    # marks count characters, which is close enough to bytes for deciding what is large
+    return end_event.end_mark.index - start_event.start_mark.index >= lazy_size
+
+
+def is_default_tag(tag, kind):
+    return tag is None or tag == "!" or tag == YAML_TAG + kind
+
+
+def skip_collection(events):
+    """
+    Skip all events of a collection whose start event was just read
+    :return: end event of the collection
+    """
+    depth = 1
+    while True:
+        event = next(events)
+        if isinstance(event, yaml.AliasEvent):
+            raise NotLazy()
+        if isinstance(event, yaml.CollectionStartEvent):
+            depth += 1
+        elif isinstance(event, yaml.CollectionEndEvent):
+            depth -= 1
+            if depth == 0:
+                return event
+
+
+def resolve_tag(loader, event):
+    if event.tag is None or event.tag == "!":
+        return loader.resolve(yaml.ScalarNode, event.value, event.implicit)
+    return event.tag
+
+
+def construct_scalar(loader, event):
+    node = yaml.ScalarNode(resolve_tag(loader, event), event.value, style=event.style)
+    return loader.construct_document(node)
@@ -1,60 +1,899 @@
+import re
 import sys
-import inspect
-import argparse
-from datetime import date, time, datetime
+import copy
+import types
+import fnmatch
+import importlib
+import threading
 
-import yaml
+try:
+    from collections.abc import Mapping
+except ImportError:  # python2
+    from collections import Mapping
 
-if sys.version_info[0] < 3:
-    from StringIO import StringIO
-else:
-    from io import StringIO
+from .cache import DiskCache, LRUCache, BuildOnceCache
+from .frozen import FrozenConfig
+from .imports import yaml, argparse
+from .stats import MergeStats, stage, timer
 
 
-class YAMLArgsLoader(yaml.Loader):
+class YAMLArgsMixin(object):
     """
-    Convenience class for loading yaml file and parsing command line arguments in one step
-    with open("config.yaml") as f:
-        config = yaml.load(f, Loader=quickargs.YAMLArgsLoader)
+    Merges the loaded yaml document with the command line arguments. Combine with any yaml loader class.
+    If enabled through the QUICKARGS_CACHE environment variable, compiled configs are cached on disk. This skips
+    yaml parsing and parser construction when the same config file is loaded again.
+    Set engine = "fast" in a subclass to parse the command line without argparse, see CompiledConfig.match_arguments
+
+    With yaml.load_all, documents are composed, merged and returned one at a time. Arguments can be scoped to a single
+    document by its index or by its name (the value of its top-level "name" key), e.g. --stage[2].batch_size=64 or
+    --stage[train].batch_size=64. Numbers always select by index, --stage[name=7].batch_size=64 selects the document
+    named 7. Arguments without scope are applied to every document that has them, an argument that no document has
+    is reported at the end of the stream.
+    Set document_namespace and document_name_key in a subclass to use different names.
+
+    allowed_modules is None for loaders that construct arbitrary python objects, command line values are parsed just
+    as unrestricted. Safe loaders set it to the modules whose names can be used, see SafeYAMLArgsLoader. They never
+    use the disk cache: loading a pickle can run any code, whoever can write the cache directory could bypass the
+    whitelist.
     """
+    engine = "argparse"
+    allowed_modules = None
+    document_namespace = "stage"
+    document_name_key = "name"
+
+    def __init__(self, stream):
+        self.stats = MergeStats.from_environment()
+        self.disk_cache = DiskCache.from_environment() if self.allowed_modules is None else None
+        self.cache_key = None
+        self.cached_config = None
+        self.cached_stream = None
+        self.document_index = 0
+        self.document_arguments = None
+        self.document_names = set()  # names of the documents so far, for the error message about unused selectors
+        self.used_arguments = set()  # names of the arguments without scope that a document has used so far
+
+        if self.disk_cache is not None:
+            with stage(self.stats, "cache load"):
+                if hasattr(stream, "read"):
+                    stream = stream.read()
+                loader_name = "{}.{}".format(type(self).__module__, type(self).__name__)
+                self.cache_key = self.disk_cache.key(stream, cache_loader_name(loader_name))
+                self.cached_config = self.disk_cache.load(self.cache_key)
+            if self.cached_config is not None:
+                self.cached_stream = stream
+                stream = ""  # nothing left to parse, unless load_all is used (see check_data)
+
+        super(YAMLArgsMixin, self).__init__(stream)
+
     def get_single_data(self):
-        data = super(YAMLArgsLoader, self).get_single_data()
-        return merge_yaml_with_args(data)
+        if self.cached_config is not None:
+            compiled = self.cached_config
+        else:
+            with stage(self.stats, "yaml load"):
+                data = super(YAMLArgsMixin, self).get_single_data()
+            compiled = compile_config(data, stats=self.stats, allowed_modules=self.allowed_modules)
+            if self.disk_cache is not None:
+                with stage(self.stats, "cache store"):
+                    self.disk_cache.store(self.cache_key, compiled)
+
+        try:
+            return compiled.parse(stats=self.stats, engine=self.engine)
+        finally:
+            if self.stats is not None:
+                self.stats.dump()
+
+    def check_data(self):
+        # only yaml.load_all ends up here. the disk cache only holds single documents, parse the stream after all
+        if self.cached_stream is not None:
+            stream, self.cached_stream, self.cached_config = self.cached_stream, None, None
+            super(YAMLArgsMixin, self).__init__(stream)
+
+        if super(YAMLArgsMixin, self).check_data():
+            return True
+
+        # end of the stream, all document selectors and arguments on the command line should have been used by now
+        if self.document_arguments is not None:
+            common, scoped = self.document_arguments
+            unused = [name for name, arguments in common if name is not None and name not in self.used_arguments]
+            if unused:
+                parser_class()().error("argument --{}: no document has this argument".format(unused[0]))
+            if scoped:
+                selector = sorted(scoped, key=str)[0]
+                message = "argument --{}[{}]: no document with this index or name".format(
+                    self.document_namespace, selector)
+                if str(selector) in self.document_names:
+                    message += ", numbers select documents by index, use --{}[{}={}] to select by name".format(
+                        self.document_namespace, self.document_name_key, selector)
+                parser_class()().error(message)
+        if self.stats is not None:
+            self.stats.dump()
+        return False
+
+    def get_data(self):
+        # called by yaml.load_all for every document
+        if self.document_arguments is None:
+            common, scoped = split_document_arguments(sys.argv[1:], self.document_namespace, self.document_name_key)
+            self.document_arguments = group_arguments(common), scoped
+        common, scoped = self.document_arguments
+
+        with stage(self.stats, "yaml load"):
+            data = super(YAMLArgsMixin, self).get_data()
+        compiled = compile_config(data, stats=self.stats, allowed_modules=self.allowed_modules)
+
+        # arguments without scope only go to the documents that have them, everything else (e.g. --help) to all
+        argv = []
+        for name, arguments in common:
+            if name is None or compiled.schema.has_argument(name):
+                argv += arguments
+                self.used_arguments.add(name)
+        argv += scoped.pop(self.document_index, [])
+        if isinstance(data, dict) and self.document_name_key in data:
+            name = str(data[self.document_name_key])
+            argv += scoped.pop(name, [])
+            self.document_names.add(name)
+        self.document_index += 1
+
+        return compiled.parse(argv, stats=self.stats, engine=self.engine)
+
+
+def define_loaders():
+    """
+    The loaders derive from the yaml loaders, so they are only defined once they are needed, see __getattr__.
+    This way, yaml is not imported if a config is loaded from the disk cache.
+    """
+    global YAMLArgsLoader, YAMLArgsCLoader, SafeYAMLArgsLoader, ValueLoader, SafeValueLoader, value_loader
+
+    class YAMLArgsLoader(YAMLArgsMixin, yaml.Loader):
+        """
+        Convenience class for loading yaml file and parsing command line arguments in one step
+        with open("config.yaml") as f:
+            config = yaml.load(f, Loader=quickargs.YAMLArgsLoader)
+        """
+        pass
+
+    # libyaml bindings are optional, pyyaml falls back to its pure-python implementation if they are missing
+    if hasattr(yaml, "CLoader"):
+        class YAMLArgsCLoader(YAMLArgsMixin, yaml.CLoader):
+            """
+            Same as YAMLArgsLoader, but uses the (much faster) libyaml parser
+            with open("config.yaml") as f:
+                config = yaml.load(f, Loader=quickargs.YAMLArgsCLoader)
+            """
+            pass
+
+        # loader used for parsing single command line values
+        ValueLoader = yaml.CLoader
+    else:
+        # libyaml is not available -> fall back to the pure-python loader
+        YAMLArgsCLoader = YAMLArgsLoader
+        ValueLoader = yaml.Loader
+
+    class SafeYAMLArgsLoader(YAMLArgsMixin, getattr(yaml, "CSafeLoader", yaml.SafeLoader)):
+        """
+        Same as YAMLArgsCLoader, but neither the yaml file nor the command line values can construct arbitrary python
+        objects. Names (!!python/name) and modules (!!python/module) can only be used from the allowed modules (and
+        their submodules), set allowed_modules in a subclass:
+        class ConfigLoader(quickargs.SafeYAMLArgsLoader):
+            allowed_modules = ["builtins", "myproject.models"]
+        """
+        allowed_modules = ()
+
+    class SafeValueLoader(getattr(yaml, "CSafeLoader", yaml.SafeLoader)):
+        """
+        Loader for parsing single command line values of safe loaders, see safe_value_loader
+        """
+        allowed_modules = ()
+
+    for loader in [SafeYAMLArgsLoader, SafeValueLoader]:
+        add_safe_python_constructors(loader)
+
+    for loader in [YAMLArgsLoader, YAMLArgsCLoader, SafeYAMLArgsLoader, SafeValueLoader]:
+        loader.__qualname__ = loader.__name__
+
+    # loader instance for the fast value parsers
+    value_loader = ValueLoader("")
+
+
+def value_loader_class():
+    """
+    :return: yaml loader class used for parsing single command line values
+    """
+    if "ValueLoader" not in globals():
+        define_loaders()
+    return ValueLoader
+
+
+def safe_value_loader(allowed_modules):
+    """
+    :param allowed_modules: modules whose names can be used in the command line values
+    :return: yaml loader class that parses single command line values without constructing arbitrary objects
+    """
+    if "SafeValueLoader" not in globals():
+        define_loaders()
+    allowed_modules = tuple(allowed_modules)
+    if allowed_modules not in safe_value_loaders:
+        loader = type("SafeValueLoader", (SafeValueLoader,), {"allowed_modules": allowed_modules})
+        safe_value_loaders[allowed_modules] = loader
+    return safe_value_loaders[allowed_modules]
+
+
+# allowed modules -> SafeValueLoader subclass, see safe_value_loader
+safe_value_loaders = {}
 
 
-def merge_yaml_with_args(yaml_config, argv=None):
+def add_safe_python_constructors(loader):
+    """
+    Teach a safe loader the python tags that do not run any code, and names and modules of the allowed modules
+    :param loader: yaml.SafeLoader or yaml.CSafeLoader subclass with an allowed_modules attribute
+    """
+    for tag in ["none", "bool", "str", "unicode", "bytes", "int", "long", "float", "complex", "list", "tuple",
+                "dict"]:
+        tag = "tag:yaml.org,2002:python/" + tag
+        if tag in yaml.FullLoader.yaml_constructors:
+            loader.add_constructor(tag, yaml.FullLoader.yaml_constructors[tag])
+    loader.add_multi_constructor("tag:yaml.org,2002:python/name:", construct_allowed_name)
+    loader.add_multi_constructor("tag:yaml.org,2002:python/module:", construct_allowed_module)
+
+
+def construct_allowed_name(loader, suffix, node):
+    # same as yaml's FullConstructor.construct_python_name, but only for allowed modules
+    if "." in suffix:
+        module_name, object_name = suffix.rsplit(".", 1)
+    else:
+        module_name, object_name = builtins_module, suffix
+    module = import_allowed_module(loader, module_name, node)
+    if not hasattr(module, object_name):
+        raise yaml.constructor.ConstructorError("while constructing a Python object", node.start_mark,
+                                                "cannot find {!r} in the module {!r}".format(object_name, module_name),
+                                                node.start_mark)
+    return getattr(module, object_name)
+
+
+def construct_allowed_module(loader, suffix, node):
+    return import_allowed_module(loader, suffix, node)
+
+
+def import_allowed_module(loader, module_name, node):
+    """
+    :param loader: safe loader instance, knows the allowed modules
+    :param module_name: name of the module to import
+    :param node: yaml node that refers to the module, for error messages
+    :return: the module, modules that were imported before are not imported again
+    """
+    if not is_allowed_module(module_name, loader.allowed_modules):
+        raise yaml.constructor.ConstructorError("while constructing a Python object", node.start_mark,
+                                                "module {!r} is not allowed".format(module_name), node.start_mark)
+    module = imported_modules.get(module_name)
+    if module is None:
+        try:
+            module = importlib.import_module(module_name)
+        except ImportError as e:
+            raise yaml.constructor.ConstructorError("while constructing a Python object", node.start_mark,
+                                                    "cannot find module {!r} ({})".format(module_name, e),
+                                                    node.start_mark)
+        imported_modules[module_name] = module
+    return module
+
+
+def is_allowed_module(module_name, allowed_modules):
+    """
+    :return: True if the module or one of its parent packages is in allowed_modules
+    """
+    return any(module_name == allowed or module_name.startswith(allowed + ".") for allowed in allowed_modules)
+
+
+# module name -> module, for the names and modules used by safe loaders
+imported_modules = {}
+
+# module of names without a module, e.g. !!python/name:zip
+builtins_module = "builtins" if sys.version_info[0] >= 3 else "__builtin__"
+
+
+def get_value_loader():
+    """
+    :return: instance of the value loader for the fast value parsers
+    """
+    if "value_loader" not in globals():
+        define_loaders()
+    return value_loader
+
+
+def merge_yaml_with_args(yaml_config, argv=None, stats=None, engine="argparse", view=False, allowed_modules=None,
+                         frozen=False, fingerprint=False):
     """
     Parse command line arguments based on a supplied yaml config.
     For each parameter in the yaml config, a command line parameter is created. The supplied command line arguments
     are parsed and merged with the yaml config. Command line arguments override yaml arguments.
     :param yaml_config: dictionary as supplied by yaml.load()
     :param argv: command line arguments, if argv is None, sys.argv will be used
-    :return: dictionary with merged arguments, command line arguments override yaml arguments
+    :param stats: MergeStats that collects timings of the stages. If None and the QUICKARGS_STATS environment variable
+                  is set, a summary of the timings is printed to stderr
+    :param engine: "argparse" or "fast", see CompiledConfig.match_arguments for the differences
+    :param view: if True, return a ConfigView that layers the command line arguments over yaml_config, without copying
+    :param allowed_modules: if not None, command line values are parsed safely, see compile_config
+    :param frozen: if True, return an immutable, hashable FrozenConfig instead of a dictionary. This freezes all of
+                   yaml_config on every call, the results of compile_config(yaml_config).parse(frozen=True) share
+                   sub-configs
+    :param fingerprint: if True, return (merged config, fingerprint), see CompiledConfig.fingerprint. This hashes all of
+                        yaml_config on every call, compile_config(yaml_config).parse(fingerprint=True) hashes it once
+    :return: dictionary with merged arguments, command line arguments override yaml arguments. Sub-dicts without
+             overridden arguments are not copied, they are shared with yaml_config
+    """
+    dump_stats = stats is None
+    if stats is None:
+        stats = MergeStats.from_environment()
+
+    try:
+        compiled = compile_config(yaml_config, stats=stats, allowed_modules=allowed_modules)
+        return compiled.parse(argv or None, stats=stats, engine=engine, view=view, frozen=frozen,
+                              fingerprint=fingerprint)
+    finally:
+        if dump_stats and stats is not None:
+            stats.dump()
+
+
+def load_cached(path, argv=None, engine="fast", stats=None):
+    """
+    Load a config file and merge it with the command line arguments, the fastest way to start up. Compiled configs are
+    cached on disk (QUICKARGS_CACHE, see DiskCache, caching is on by default here). When the config file is in the
+    cache, neither yaml nor argparse are imported, unless a value needs yaml for parsing, the command line is invalid
+    or --help is passed.
+    :param path: path of the config file
+    :param argv: command line arguments, if argv is None, sys.argv will be used
+    :param engine: "argparse" or "fast", see CompiledConfig.match_arguments for the differences
+    :param stats: MergeStats that collects timings of the stages. If None and the QUICKARGS_STATS environment variable
+                  is set, a summary of the timings is printed to stderr
+    :return: dictionary with merged arguments, just like merge_yaml_with_args
+    """
+    dump_stats = stats is None
+    if stats is None:
+        stats = MergeStats.from_environment()
+
+    try:
+        with open(path, "rb") as f:
+            content = f.read()
+        compiled = compile_file(content, stats=stats, disk_cache=DiskCache.from_environment(enabled_by_default=True))
+        return compiled.parse(argv, stats=stats, engine=engine)
+    finally:
+        if dump_stats and stats is not None:
+            stats.dump()
+
+
+def compile_file(content, stats=None, allowed_modules=None, disk_cache=None):
+    """
+    Load the content of a config file and compile it, or take the compiled config from the disk cache
+    :param content: content of the config file (bytes)
+    :param stats: optional MergeStats that collects timings of the stages
+    :param allowed_modules: None or modules for safe loading and parsing, see compile_config
+    :param disk_cache: DiskCache or None, it is not used for safe loading (see YAMLArgsMixin)
+    :return: CompiledConfig
+    """
+    if allowed_modules is not None:
+        allowed_modules = tuple(allowed_modules)
+        disk_cache = None
+
+    if disk_cache is not None:
+        with stage(stats, "cache load"):
+            # the name of the loader is enough for the key, its class would import yaml
+            cache_key = disk_cache.key(content, cache_loader_name("quickargs.load_cached"))
+            compiled = disk_cache.load(cache_key)
+        if compiled is not None:
+            return compiled
+
+    loader = value_loader_class() if allowed_modules is None else safe_value_loader(allowed_modules)
+    with stage(stats, "yaml load"):
+        yaml_config = yaml.load(content, Loader=loader)
+    compiled = compile_config(yaml_config, stats=stats, allowed_modules=allowed_modules)
+    if disk_cache is not None:
+        with stage(stats, "cache store"):
+            disk_cache.store(cache_key, compiled)
+    return compiled
+
+
+def cache_loader_name(loader_name):
+    """
+    Cached configs hold their type parsers, so the disk cache key has to cover everything the parsers depend on
+    :param loader_name: name of the way the config file is loaded
+    :return: loader name for DiskCache.key, including the parsers registered with register_type_parser
+    """
+    if registered_type_parsers:
+        from .fingerprint import config_hash, fingerprint_hex
+        try:
+            # by the names of the types and parsers, the same in every process
+            loader_name += " parsers:" + fingerprint_hex(config_hash(registered_type_parsers))
+        except TypeError:
+            loader_name += " parsers:{!r}".format(sorted(registered_type_parsers.items(), key=repr))
+    return loader_name
+
+
+def compile_config(yaml_config, stats=None, allowed_modules=None):
+    """
+    Build a reusable command line parser for a yaml config. Building the parser is the expensive part of merging, so
+    parsers are cached by the structure of the config (key paths and value types). Configs with the same structure
+    share one parser, even if their values differ.
+    :param yaml_config: dictionary as supplied by yaml.load()
+    :param stats: optional MergeStats that collects timings of the stages
+    :param allowed_modules: if None, command line values are parsed with the full yaml loader. Otherwise they are
+                            parsed safely, only names and modules of the allowed modules can be used
+    :return: CompiledConfig, call its parse method to merge command line arguments with the config
     """
     # yaml files can be deeply nested. it is way more convenient to work instead with a flat dictionary
-    yaml_config = flatten_dict(yaml_config)
+    with stage(stats, "flatten"):
+        flat_config = flatten_dict(yaml_config)
+
+    return CompiledConfig(compile_schema(flat_config, stats=stats, allowed_modules=allowed_modules), yaml_config)
+
+
+def compile_schema(flat_config, stats=None, allowed_modules=None):
+    """
+    :param flat_config: flat config dictionary as returned by flatten_dict
+    :param stats: optional MergeStats that collects timings of the stages
+    :param allowed_modules: None or modules for safe parsing, see compile_config
+    :return: ConfigSchema for the structure of the config, shared with all configs of the same structure
+    """
+    if allowed_modules is not None:
+        allowed_modules = tuple(allowed_modules)
+
+    with stage(stats, "compile schema"):
+        # schemas hold the type parsers that were registered when they were built
+        schema_key = (frozenset((key, type(value)) for key, value in flat_config.items()), allowed_modules,
+                      type_parser_generation)
+        return compiled_schemas.get(schema_key, lambda: ConfigSchema(flat_config, allowed_modules))
+
+
+# (structure, allowed modules, type parser generation) -> ConfigSchema, see compile_schema
+# shared by all threads, each schema is built only once even if many threads need it at the same time
+compiled_schemas = BuildOnceCache()
+
+
+class ConfigSchema(object):
+    """
+    The command line arguments for one config structure: argument names, nested keys and type parsers.
+    Holds nothing that is specific to the values of a config, so it can be shared between configs (and threads, the
+    parts that are built on demand are built only once).
+    """
+    def __init__(self, flat_config, allowed_modules=None):
+        """
+        :param flat_config: flat config dictionary as returned by flatten_dict
+        :param allowed_modules: None or modules for safe parsing, see compile_config
+        """
+        # argparse can not deal with nested keys -> convert keys to strings like "key.subkey.subsubkey"
+        # also keep a mapping of the conversion to make it easy to convert back to nested keys
+        self.mapping = {".".join(key): key for key in flat_config}
+
+        # type checking is enforced such that types of user-supplied arguments must be the same as types of
+        # corresponding arguments in the yaml file
+        self.type_parsers = {}
+        for key, nested_key in self.mapping.items():
+            if len(key) == 0:
+                raise ArgumentWithoutNameException()
+            try:
+                self.type_parsers[key] = init_type_parser(flat_config[nested_key])
+            except UnsupportedYAMLTypeException as e:
+                # values are only converted for supplied arguments, a config with such a value is fine otherwise
+                self.type_parsers[key] = UnsupportedTypeParser(str(e))
+            if allowed_modules is not None and is_yaml_value_parser(self.type_parsers[key]):
+                self.type_parsers[key] = SafeValueParser(self.type_parsers[key], allowed_modules)
+
+        self.argparse_parser = None
+        self.actions = None
+        self.trie = None
+        self.lock = threading.Lock()
+
+    @property
+    def parser(self):
+        """
+        argparse parser for the config structure, only built when it is needed for the first time
+        """
+        if self.argparse_parser is None:
+            with self.lock:
+                if self.argparse_parser is None:
+                    # argparse only collects the strings, values are converted later on, see CompiledConfig.parse
+                    # defaults are suppressed, this way argparse only returns the arguments that were actually supplied
+                    parser = parser_class()(argument_default=argparse.SUPPRESS)
+                    self.actions = {key: parser.add_argument("--{}".format(key)) for key in sorted(self.mapping)}
+                    self.argparse_parser = parser
+        return self.argparse_parser
+
+    def __getstate__(self):
+        # the argparse parser can not be pickled, it will be rebuilt when it is needed
+        return {"mapping": self.mapping, "type_parsers": self.type_parsers}
+
+    def __setstate__(self, state):
+        self.mapping = state["mapping"]
+        self.type_parsers = state["type_parsers"]
+        self.argparse_parser = None
+        self.actions = None
+        self.trie = None
+        self.lock = threading.Lock()
+
+    def match_pattern(self, pattern):
+        """
+        Find all arguments that match a glob pattern over the nested keys, e.g. layers.*.dropout
+        * matches exactly one level, ** matches any number of levels (including none), other segments are matched
+        with fnmatch. The pattern is resolved against a trie of the nested keys, so only the parts of the config that
+        can match are visited.
+        :param pattern: dotted pattern
+        :return: sorted list of matching argument names
+        """
+        if self.trie is None:
+            with self.lock:
+                if self.trie is None:
+                    self.trie = KeyTrie(self.mapping)
+
+        segments = pattern.split(".")
+        matches = set()
+        visited = set()
+        stack = [(self.trie, 0)]
+        while stack:
+            node, i = stack.pop()
+            # patterns with ** can reach the same node in several ways, no need to continue twice from there
+            if (id(node), i) in visited:
+                continue
+            visited.add((id(node), i))
+
+            if i == len(segments):
+                if node.key is not None:
+                    matches.add(node.key)
+                continue
+
+            segment = segments[i]
+            if segment == "**":
+                stack.append((node, i + 1))
+                stack.extend((child, i) for child in node.children.values())
+            elif segment == "*":
+                stack.extend((child, i + 1) for child in node.children.values())
+            elif is_pattern(segment):
+                stack.extend((child, i + 1) for name, child in node.children.items()
+                             if fnmatch.fnmatchcase(str(name), segment))
+            elif segment in node.children:
+                stack.append((node.children[segment], i + 1))
+
+        return sorted(matches)
+
+    def has_argument(self, name):
+        """
+        :param name: argument name or glob pattern, see match_pattern
+        :return: True if the config has the argument or arguments that match the pattern
+        """
+        return name in self.mapping or (is_pattern(name) and bool(self.match_pattern(name)))
+
+
+class KeyTrie(object):
+    """
+    Trie of the nested keys of a config, leaves know their argument name
+    """
+    __slots__ = ("children", "key")
+
+    def __init__(self, mapping=None):
+        """
+        :param mapping: argument name -> nested key, as in ConfigSchema
+        """
+        self.children = {}
+        self.key = None
+        for key, nested_key in (mapping or {}).items():
+            node = self
+            for segment in nested_key:
+                child = node.children.get(segment)
+                if child is None:
+                    child = node.children[segment] = KeyTrie()
+                node = child
+            node.key = key
+
+
+def is_pattern(key):
+    """
+    :return: True if the argument name contains glob characters
+    """
+    return "*" in key or "?" in key or "[" in key
+
+
+class CompiledConfig(object):
+    """
+    A yaml config together with the command line parser for it, as returned by compile_config.
+    The config is kept by reference, it is neither copied nor converted.
+    """
+    def __init__(self, schema, yaml_config):
+        """
+        :param schema: ConfigSchema matching the structure of the config
+        :param yaml_config: dictionary as supplied by yaml.load()
+        """
+        self.schema = schema
+        self.config = yaml_config
+        self.frozen_config = None
+        self.defaults_hash = None
+
+    def parse(self, argv=None, stats=None, engine="argparse", exit_on_error=True, view=False, frozen=False,
+              fingerprint=False):
+        """
+        Parse command line arguments and merge them with the config.
+        :param argv: command line arguments, if argv is None, sys.argv will be used
+        :param stats: optional MergeStats that collects timings of the stages
+        :param engine: "argparse" or "fast", see match_arguments for the differences
+        :param exit_on_error: if True, errors are printed and the program exits (just like argparse does it),
+                              otherwise an InvalidCommandLineException is raised. So does -h / --help, with the help
+                              message as message of the exception
+        :param view: if True, nothing is copied, a ConfigView of the config and the arguments is returned instead
+        :param frozen: if True, a FrozenConfig is returned instead. All results of this CompiledConfig share the
+                       sub-configs without overridden arguments with a FrozenConfig of the config, see freeze
+        :param fingerprint: if True, (merged config, fingerprint of the merged config) is returned, see fingerprint
+        :return: dictionary with merged arguments, command line arguments override yaml arguments. Only the
+                 sub-dicts that contain overridden arguments are copied, all others are shared with the config
+        """
+        overrides = self.parse_overrides(argv, stats=stats, engine=engine, exit_on_error=exit_on_error)
+
+        # caller expects the original, nested config dictionary
+        with stage(stats, "merge"):
+            if frozen:
+                merged = self.freeze().update(overrides)
+            elif view:
+                merged = ConfigView(self.config, unflatten_dict(overrides))
+            else:
+                merged = override_dict(self.config, overrides)
+        if not fingerprint:
+            return merged
+        with stage(stats, "fingerprint"):
+            return merged, self.fingerprint(overrides)
+
+    def fingerprint(self, overrides=None):
+        """
+        Stable fingerprint of the merged config, e.g. as a key for caching results computed from it. Equal configs
+        have equal fingerprints, in every process. Values are compared by type and value, functions and classes by
+        their names, modules by their names as well. Fingerprints are not meant to withstand deliberate collisions.
+        The hash of the config is computed once, after that only the overridden values are hashed.
+        :param overrides: flat dictionary of converted arguments as returned by parse_overrides
+        :return: hex string
+        """
+        from .fingerprint import config_hash, override_hash, fingerprint_hex
+
+        # threads might hash the config at the same time, the results are the same
+        if self.defaults_hash is None:
+            self.defaults_hash = config_hash(self.config)
+        return fingerprint_hex(override_hash(self.defaults_hash, self.config, overrides or {}))
+
+    def freeze(self):
+        """
+        :return: FrozenConfig of the config, it is only built once
+        """
+        # threads might freeze the config at the same time, the results are equal and either of them can be kept
+        if self.frozen_config is None:
+            self.frozen_config = FrozenConfig(self.config)
+        return self.frozen_config
+
+    def parse_overrides(self, argv=None, stats=None, engine="argparse", exit_on_error=True):
+        """
+        Same as parse, but only returns the supplied arguments instead of merging them with the config
+        :return: flat dictionary of the converted arguments, keys are tuples of keys as in flatten_dict
+        """
+        if engine not in ["argparse", "fast"]:
+            raise ValueError("Unknown engine {}".format(engine))
+
+        if argv is None:
+            argv = sys.argv[1:]
+
+        # neither argparse nor the fast engine know about patterns, take them out of argv first
+        argv, patterns = self.split_patterns(argv, exit_on_error)
+
+        if engine == "argparse":
+            with stage(stats, "build parser"):
+                parser = self.parser(exit_on_error)
+            with stage(stats, "parse argv"):
+                cmd_config = parser.parse_args(argv)
+                cmd_config = vars(cmd_config)    # vars puts command line arguments into a dict
+        else:
+            with stage(stats, "parse argv"):
+                cmd_config = self.match_arguments(argv, exit_on_error)
+
+        # only the supplied arguments are converted to the correct types, defaults are used as they are
+        # also revert back from string keys to nested keys
+        # pattern matches are applied first, so that explicitly supplied arguments win over them
+        with stage(stats, "convert values"):
+            overrides = {}
+            for pattern, value in patterns:
+                keys = self.schema.match_pattern(pattern)
+                if not keys:
+                    self.parser(exit_on_error).error(
+                        "argument --{}: pattern does not match any argument".format(pattern))
+                for key in keys:
+                    start_time = timer()
+                    overrides[self.schema.mapping[key]] = self.convert_argument(key, value, exit_on_error)
+                    if stats is not None:
+                        stats.add_key_time(key, timer() - start_time)
+
+            for key, value in cmd_config.items():
+                start_time = timer()
+                overrides[self.schema.mapping[key]] = self.convert_argument(key, value, exit_on_error)
+                if stats is not None:
+                    stats.add_key_time(key, timer() - start_time)
+
+        return overrides
+
+    def parser(self, exit_on_error=True):
+        """
+        :param exit_on_error: if False, the parser raises InvalidCommandLineException instead of exiting
+        :return: argparse parser for this config
+        """
+        # the parser is shared, work on a (shallow) copy that knows about this config for printing the help message
+        parser = copy.copy(self.schema.parser)
+        parser.config = self
+        parser.raise_errors = not exit_on_error
+        return parser
+
+    def match_arguments(self, argv, exit_on_error=True):
+        """
+        Alternative to argparse for collecting the command line strings. Arguments are looked up in a hash table
+        instead of scanning the argparse option table, so the cost does not depend on the size of the config.
+        Accepts --key=value and --key value. Unlike argparse, abbreviations of argument names are not accepted
+        (with argparse --log would silently set --logging.file). Errors and help are printed by argparse, so they
+        look exactly the same.
+        :param argv: command line arguments
+        :param exit_on_error: if False, errors raise InvalidCommandLineException instead of exiting
+        :return: dictionary argument name -> command line string, for all supplied arguments
+        """
+        cmd_config = {}
+        extras = []
+        i = 0
+        while i < len(argv):
+            arg = argv[i]
+            i += 1
+
+            # everything after -- is positional, this config has no positional arguments
+            if arg == "--":
+                extras.extend(argv[i - 1:])
+                break
+
+            if not self.looks_like_option(arg):
+                extras.append(arg)
+            elif arg in ["-h", "--help"]:
+                # same as the help action of argparse, raises instead of exiting without exit_on_error
+                parser = self.parser(exit_on_error)
+                parser.print_help()
+                parser.exit()
+            elif arg.startswith("--") and arg[2:].split("=", 1)[0] in self.schema.mapping:
+                key, sep, value = arg[2:].partition("=")
+                if not sep:
+                    if i == len(argv) or argv[i] == "--" or self.looks_like_option(argv[i]):
+                        self.parser(exit_on_error).error("argument --{}: expected one argument".format(key))
+                    value = argv[i]
+                    i += 1
+                cmd_config[key] = value
+            else:
+                extras.append(arg)
+
+        if extras:
+            self.parser(exit_on_error).error("unrecognized arguments: {}".format(" ".join(extras)))
+        return cmd_config
+
+    def split_patterns(self, argv, exit_on_error=True):
+        """
+        Take arguments with glob patterns (--layers.*.dropout=0.1 or --layers.*.dropout 0.1) out of the command line
+        :param argv: command line arguments
+        :param exit_on_error: if False, errors raise InvalidCommandLineException instead of exiting
+        :return: (remaining command line arguments, list of (pattern, command line string))
+        """
+        remaining = []
+        patterns = []
+        i = 0
+        while i < len(argv):
+            arg = argv[i]
+            i += 1
+            if arg == "--":
+                remaining.extend(argv[i - 1:])
+                break
+
+            pattern, sep, value = arg[2:].partition("=")
+            if not arg.startswith("--") or not is_pattern(pattern) or pattern in self.schema.mapping:
+                remaining.append(arg)
+                continue
+
+            if not sep:
+                if i == len(argv) or argv[i] == "--" or self.looks_like_option(argv[i]):
+                    self.parser(exit_on_error).error("argument --{}: expected one argument".format(pattern))
+                value = argv[i]
+                i += 1
+            patterns.append((pattern, value))
+
+        return remaining, patterns
+
+    def looks_like_option(self, arg):
+        """
+        Same rules as argparse uses to decide whether a command line string is an option or a value
+        """
+        if not arg or arg[0] != "-" or len(arg) == 1:
+            return False
+        if arg in ["-h", "--help"] or (arg.startswith("--") and arg[2:].split("=", 1)[0] in self.schema.mapping):
+            return True
+        if negative_number_regexp.match(arg) or " " in arg:
+            return False
+        return True
+
+    def convert_argument(self, key, value, exit_on_error=True):
+        """
+        Convert a command line string using the type parser. Errors are reported just like argparse would report them.
+        :param key: argument name
+        :param value: command line string
+        :param exit_on_error: if False, errors raise InvalidCommandLineException instead of exiting
+        :return: converted value
+        """
+        type_parser = self.schema.type_parsers[key]
+        try:
+            return type_parser(value)
+        except (argparse.ArgumentTypeError, UnsupportedYAMLTypeException) as e:
+            message = str(e)
+        except (TypeError, ValueError):
+            message = "invalid {} value: {!r}".format(getattr(type_parser, "__name__", repr(type_parser)), value)
+
+        parser = self.parser(exit_on_error)
+        parser.error(str(argparse.ArgumentError(self.schema.actions[key], message)))
+
+    def defaults(self):
+        """
+        :return: flat dictionary of the values in the config, keys are tuples of keys as in flatten_dict
+        """
+        return flatten_dict(self.config)
+
+    def help_parser(self):
+        """
+        :return: argparse parser with a help message that lists the default values of this config
+        """
+        defaults = self.defaults()
+        parser = argparse.ArgumentParser()
+        for key, nested_key in sorted(self.schema.mapping.items()):
+            val = defaults[nested_key]
+            parser.add_argument("--{}".format(key), default=val, type=self.schema.type_parsers[key],
+                                help="default: {}".format(val))
+        return parser
+
+
+def define_parser():
+    """
+    The parser derives from argparse.ArgumentParser, so it is only defined once it is needed, see __getattr__
+    """
+    global YAMLArgsParser
+
+    class YAMLArgsParser(argparse.ArgumentParser):
+        """
+        Argument parser that is shared between all configs with the same structure. The help message depends on the
+        values of the config, so it is generated from the config that is currently being parsed.
+        """
+        config = None
+        raise_errors = False
+
+        def format_help(self):
+            if self.config is None:
+                return super(YAMLArgsParser, self).format_help()
+            return self.config.help_parser().format_help()
+
+        def error(self, message):
+            if self.raise_errors:
+                raise InvalidCommandLineException(message)
+            super(YAMLArgsParser, self).error(message)
 
-    # argparse can not deal with nested keys -> convert keys to strings like "key.subkey.subsubkey"
-    # also keep a mapping of the conversion to make it easy to convert back to nested keys
-    mapping = {".".join(key): key for key, value in yaml_config.items()}
-    yaml_config = {".".join(key): value for key, value in yaml_config.items()}
+        def print_help(self, file=None):
+            # -h / --help, the help message is the message of the exception instead of being printed
+            if self.raise_errors:
+                raise InvalidCommandLineException(self.format_help())
+            super(YAMLArgsParser, self).print_help(file)
 
-    # instantiate an argparse parser based on the yaml config, enforce type checking such that types of user-supplied
-    # arguments must be the same as types of corresponding arguments in the yaml file
-    parser = argparse.ArgumentParser()
-    for key, val in sorted(yaml_config.items()):
-        if len(key) == 0:
-            raise ArgumentWithoutNameException()
-        parser.add_argument("--{}".format(key), default=val, type=init_type_parser(val), help="default: {}".format(val))
+        def exit(self, status=0, message=None):
+            if self.raise_errors:
+                raise InvalidCommandLineException(message or "")
+            super(YAMLArgsParser, self).exit(status, message)
+
+    YAMLArgsParser.__qualname__ = YAMLArgsParser.__name__
+
+
+def parser_class():
+    """
+    :return: YAMLArgsParser
+    """
+    if "YAMLArgsParser" not in globals():
+        define_parser()
+    return YAMLArgsParser
 
-    # parse the command line arguments and revert back from string keys to nested keys
-    argv = argv or sys.argv[1:]
-    cmd_config = parser.parse_args(argv)
-    cmd_config = vars(cmd_config)    # vars puts command line arguments into a dict
-    cmd_config = {mapping[key]: value for key, value in cmd_config.items()}
 
-    # caller expects the original, nested config dictionary
-    return unflatten_dict(cmd_config)
+# argparse treats command line strings that look like negative numbers as values, not as options
+negative_number_regexp = re.compile(r"^-\d+$|^-\d*\.\d+$")
 
 
 def init_type_parser(yaml_value):
@@ -64,79 +903,260 @@ def init_type_parser(yaml_value):
     :param yaml_value: Any object. Type parser will be instantiated based on the type of this object
     :return: reference to parser function
     """
+    value_type = type(yaml_value)
+    parser = type_parser_registry.get(value_type)
+    if parser is None:
+        parser = resolved_type_parsers.get(value_type)
+    if parser is None:
+        parser = resolve_type_parser(value_type)
+        resolved_type_parsers[value_type] = parser
 
-    # below are a bunch of functions that can be used to parse strings into specific data types
-    # they are all separated into their own function with short names to get nicer output from argparse
-    def yaml_bool(value):
-        return yaml_parse_value("!!bool", value)
+    if parser is unsupported_type:
+        raise UnsupportedYAMLTypeException("Can not handle type {}".format(value_type))
+    return parser
 
-    def yaml_list(value):
-        return yaml_parse_value("!!python/list", value)
 
-    def yaml_tuple(value):
-        return yaml_parse_value("!!python/tuple", value)
+def resolve_type_parser(value_type):
+    """
+    Find the parser for a type that is not in the registry: the parser of the closest registered base class
+    :param value_type: type of a yaml value
+    :return: parser or unsupported_type
+    """
+    # dates are registered on demand, the datetime module is only imported when it is needed
+    if not datetime_parsers_registered:
+        register_datetime_parsers()
 
-    def yaml_none(value):
-        return yaml_parse_value("!!python/none", value)
+    mro = value_type.__mro__
+    for base in mro:
+        if base in type_parser_registry:
+            return type_parser_registry[base]
 
-    def yaml_timestamp(value):
-        return yaml_parse_value("!!timestamp", value)
+    # everything else that can be called is passed by name, e.g. methods or functools.partial objects
+    if any("__call__" in vars(base) for base in mro):
+        return yaml_python_callable
+    return unsupported_type
 
-    def yaml_bytes(value):
-        return yaml_parse_value("!!python/bytes", value)
 
-    def yaml_python_callable(value):
-        return yaml_parse_value("!!python/name", value)  # for passing module.name (functions or classes)
+def register_datetime_parsers():
+    global datetime_parsers_registered
+    from datetime import date, time, datetime
+    for type_to_parse in [datetime, date, time]:
+        type_parser_registry.setdefault(type_to_parse, yaml_timestamp)
+        immutable_types.add(type_to_parse)
+    datetime_parsers_registered = True
 
-    def yaml_python_module(value):
-        return yaml_parse_value("!!python/module", value)  # for passing package.module
 
-    # tuples of (type_to_parse, parser) for most of the data types that can be in a yaml file
-    # for most simple data types, use built-in methods, if not possible let yaml do the parsing
-    # pairs, dict and bytes data types don't work, bool must be before int because isinstance(True, int) == True
-    type_parsers = [(bool, yaml_bool), (int, int), (float, float), (complex, complex), (str, str), (bytes, yaml_bytes),
-                    (type(None), yaml_none), (list, yaml_list), (tuple, yaml_tuple),
-                    (datetime, yaml_timestamp), (date, yaml_timestamp), (time, yaml_timestamp)]
-    for type_to_parse, parser in type_parsers:
-        if isinstance(yaml_value, type_to_parse):
-            return parser
+def register_type_parser(type_to_parse, parser):
+    """
+    Register the parser for values of a type (and its subclasses). For yaml.YAMLObject subclasses, use
+    register_yaml_object instead.
+    :param type_to_parse: type of the yaml values
+    :param parser: function that turns a command line string into a value, raises ValueError for invalid strings
+    """
+    global type_parser_generation
+    type_parser_registry[type_to_parse] = parser
+    registered_type_parsers[type_to_parse] = parser
+    resolved_type_parsers.clear()
+    # compiled schemas use the parsers that were registered before, they are compiled again when they are needed
+    type_parser_generation += 1
+    compiled_schemas.clear()
 
-    # some of the yaml types are specific to python2, let's be nice and handle those as well
-    if sys.version_info[0] < 3:
-        type_parsers = [(long, long), (unicode, unicode)]
-        for type_to_parse, parser in type_parsers:
-            if isinstance(yaml_value, type_to_parse):
-                return parser
 
-    # some of the types can not be detected using isinstance
-    if inspect.ismodule(yaml_value):
-        return yaml_python_module
-    elif hasattr(type_to_parse, '__call__'):
-        return yaml_python_callable
+def register_yaml_object(yaml_class):
+    """
+    Allow config values of a yaml.YAMLObject subclass. On the command line they are written just like in the yaml file,
+    e.g. --key="{name: test}" for a class with the tag !ClassA
+    :param yaml_class: yaml.YAMLObject subclass
+    """
+    register_type_parser(yaml_class, YAMLObjectParser(yaml_class))
+
 
-    # have not found a parser
-    raise UnsupportedYAMLTypeException("Can not handle type {}".format(type(yaml_value)))
+class YAMLObjectParser(object):
+    """
+    Type parser for values of a yaml.YAMLObject subclass
+    """
+    def __init__(self, yaml_class):
+        self.yaml_class = yaml_class
+        self.__name__ = yaml_class.__name__  # for the error messages
+
+    def __call__(self, value, loader=None):
+        return yaml_parse_value(self.yaml_class.yaml_tag, value, loader=yaml_object_loader(self.yaml_class, loader))
 
 
-def yaml_parse_value(type_to_enforce, value):
+def yaml_object_loader(yaml_class, loader=None):
+    """
+    :param loader: value loader to derive from, ValueLoader if None
+    :return: value loader that knows the tag of the yaml class. yaml classes only register their tag with the
+             loaders in yaml_class.yaml_loader, which usually does not include the libyaml loader
+    """
+    key = (loader or value_loader_class(), yaml_class)
+    if key not in yaml_object_loaders:
+        loader = type("{}Loader".format(yaml_class.__name__), (key[0],), {})
+        loader.add_constructor(yaml_class.yaml_tag, yaml_class.from_yaml)
+        yaml_object_loaders[key] = loader
+    return yaml_object_loaders[key]
+
+
+# below are a bunch of functions that can be used to parse strings into specific data types
+# they are all separated into their own function with short names to get nicer output from argparse
+# loader is the yaml loader class that does the parsing, ValueLoader if None
+def yaml_bool(value, loader=None):
+    return yaml_parse_value("!!bool", value, loader)
+
+
+def yaml_list(value, loader=None):
+    return yaml_parse_value("!!python/list", value, loader)
+
+
+def yaml_tuple(value, loader=None):
+    return yaml_parse_value("!!python/tuple", value, loader)
+
+
+def yaml_none(value, loader=None):
+    return yaml_parse_value("!!python/none", value, loader)
+
+
+def yaml_timestamp(value, loader=None):
+    return yaml_parse_value("!!timestamp", value, loader)
+
+
+def yaml_bytes(value, loader=None):
+    return yaml_parse_value("!!python/bytes", value, loader)
+
+
+def yaml_python_callable(value, loader=None):
+    return yaml_parse_value("!!python/name", value, loader)  # for passing module.name (functions or classes)
+
+
+def yaml_python_module(value, loader=None):
+    return yaml_parse_value("!!python/module", value, loader)  # for passing package.module
+
+
+# type of a yaml value -> parser, see init_type_parser and register_type_parser
+# for most simple data types, use built-in methods, if not possible let yaml do the parsing
+# pairs, dict and sets don't work
+type_parser_registry = {
+    bool: yaml_bool, int: int, float: float, complex: complex, str: str, bytes: yaml_bytes,
+    type(None): yaml_none, list: yaml_list, tuple: yaml_tuple,
+    types.ModuleType: yaml_python_module, types.FunctionType: yaml_python_callable,
+    types.BuiltinFunctionType: yaml_python_callable, type: yaml_python_callable,
+}
+
+# some of the yaml types are specific to python2, let's be nice and handle those as well
+if sys.version_info[0] < 3:
+    type_parser_registry.update({long: long, unicode: unicode})
+
+# parsers that take a value loader, see is_yaml_value_parser
+yaml_value_parsers = {yaml_bool, yaml_list, yaml_tuple, yaml_none, yaml_timestamp, yaml_bytes, yaml_python_callable,
+                      yaml_python_module}
+
+# type -> parser for types that are not in the registry themselves, see resolve_type_parser
+resolved_type_parsers = {}
+
+# type -> parser for the types registered with register_type_parser, part of the disk cache keys, see cache_loader_name
+registered_type_parsers = {}
+
+# number of calls of register_type_parser, part of the keys of compiled_schemas
+type_parser_generation = 0
+
+# dates, times and datetimes are added to the registry when the first unknown type is resolved
+datetime_parsers_registered = False
+
+# parser for types that can not be parsed
+unsupported_type = object()
+
+# (value loader, yaml class) -> value loader with the tag of the class, see yaml_object_loader
+yaml_object_loaders = {}
+
+
+class SafeValueParser(object):
+    """
+    Type parser that parses values with a safe value loader, see compile_config
+    """
+    def __init__(self, parser, allowed_modules):
+        """
+        :param parser: type parser that takes the value loader as second argument, see is_yaml_value_parser
+        :param allowed_modules: modules whose names can be used in the values
+        """
+        self.parser = parser
+        self.allowed_modules = allowed_modules
+        self.__name__ = parser.__name__  # for the error messages
+
+    def __call__(self, value):
+        return self.parser(value, safe_value_loader(self.allowed_modules))
+
+
+class UnsupportedTypeParser(object):
+    """
+    Type parser for values of types that can not be parsed, it raises UnsupportedYAMLTypeException when it is used
+    """
+    __name__ = "unsupported"
+
+    def __init__(self, message):
+        self.message = message
+
+    def __call__(self, value):
+        raise UnsupportedYAMLTypeException(self.message)
+
+
+def is_yaml_value_parser(parser):
+    """
+    :return: True if the parser lets yaml do the parsing, i.e. it can be called with a value loader
+    """
+    return parser in yaml_value_parsers or isinstance(parser, YAMLObjectParser)
+
+
+def yaml_parse_value(type_to_enforce, value, loader=None):
     """
     Load off the parsing of a string into some type to yaml. This ensures that parsing is consistent between yaml
     parameters and command line parameters.
+    Results are remembered in parsed_values, programs that merge the same command line strings over and over only
+    parse each of them once.
     :param type_to_enforce:
     :param value:
+    :param loader: yaml loader class that does the parsing, ValueLoader if None
     :return:
     """
+    if loader is None:
+        loader = value_loader_class()
+    key = (type_to_enforce, value, loader)
+    cached = parsed_values.get(key)
+    if cached is not None:
+        parsed, copy_value = cached
+        return parsed if copy_value is None else copy_value(parsed)
+
+    parsed = parse_value_uncached(type_to_enforce, value, loader)
+    if is_immutable(parsed):
+        parsed_values.put(key, (parsed, None))
+    elif isinstance(parsed, list) and all(is_immutable(item) for item in parsed):
+        # the caller may change the list, so the cached list itself is never handed out
+        parsed_values.put(key, (list(parsed), list))
+    elif is_plain_data(parsed):
+        parsed_values.put(key, (copy.deepcopy(parsed), copy.deepcopy))
+    return parsed
+
+
+def parse_value_uncached(type_to_enforce, value, loader):
+    # most values are simple enough to skip the full yaml pipeline
+    fast_parser = fast_value_parsers.get(type_to_enforce)
+    if fast_parser is not None:
+        parsed = fast_parser(value)
+        if parsed is not unhandled:
+            return parsed
+
     try:
         if type_to_enforce in ["!!python/name", "!!python/module"]:
             yaml_data = "{}:{}".format(type_to_enforce, value)
         else:
             yaml_data = "{} {}".format(type_to_enforce, value)
-        parsed = yaml.load(StringIO(yaml_data))
+        parsed = yaml.load(yaml_data, Loader=loader)
         return parsed
     # catch some typical errors that can happen during parsing
     # raise a ValueError instead to get nicely formatted output from argparse
     except KeyError as e:
         raise ValueError(str(e))
+    except yaml.scanner.ScannerError as e:
+        raise ValueError(str(e))
     except yaml.parser.ParserError as e:
         raise ValueError(str(e))
     except yaml.constructor.ConstructorError as e:
@@ -145,6 +1165,178 @@ def yaml_parse_value(type_to_enforce, value):
         raise ValueError(str(e))
 
 
+def is_immutable(value):
+    """
+    :return: True if value can be handed out to several callers, i.e. it can not be changed in place. Functions, classes
+             and modules are references, every caller is meant to get the same object.
+    """
+    if isinstance(value, tuple):
+        return all(is_immutable(item) for item in value)
+    return type(value) in immutable_types or isinstance(value, reference_types)
+
+
+def is_plain_data(value):
+    """
+    :return: True if value is made of lists, dicts and immutable values only, so that copy.deepcopy can copy it
+    """
+    if isinstance(value, (list, tuple)):
+        return all(is_plain_data(item) for item in value)
+    if isinstance(value, dict):
+        return all(is_plain_data(key) and is_plain_data(item) for key, item in value.items())
+    # deepcopy keeps functions and classes, but it can not copy modules
+    return is_immutable(value) and not isinstance(value, types.ModuleType)
+
+
+# parsed command line values, (yaml tag, string, loader class) -> (parsed value, function that copies it or None)
+parsed_values = LRUCache(maxsize=1024)
+
+# types whose values can not be changed, dates are added when their parsers are registered
+immutable_types = {bool, int, float, complex, str, bytes, type(None)}
+reference_types = (types.ModuleType, types.FunctionType, types.BuiltinFunctionType, type)
+
+if sys.version_info[0] < 3:
+    immutable_types.update([long, unicode])
+
+
+# the fast parsers below build yaml nodes directly instead of letting yaml scan, parse and compose a document
+# resolving and constructing is still done by yaml, so the results are exactly the same as with the full pipeline
+# they only accept values that are unambiguous plain scalars, everything else is handed back to the full pipeline
+unhandled = object()
+
+# same as SafeConstructor.bool_values, so that booleans can be parsed without importing yaml
+bool_values = {"yes": True, "no": False, "true": True, "false": False, "on": True, "off": False}
+
+plain_word = r"(?:[A-Za-z0-9_.+~]|-[A-Za-z0-9_.+~])[A-Za-z0-9_.+~-]*"
+plain_scalar_regexp = re.compile(r"^{0}\Z".format(plain_word))
+flow_sequence_regexp = re.compile(r"^\[ *(?:{0}(?: {0})*(?: *, *{0}(?: {0})*)*)? *\]\Z".format(plain_word))
+
+
+def fast_parse_bool(value):
+    if plain_scalar_regexp.match(value):
+        return bool_values.get(value.lower(), unhandled)
+    return unhandled
+
+
+def fast_parse_none(value):
+    # yaml ignores the value of !!python/none, as long as it is a scalar
+    if value == "" or plain_scalar_regexp.match(value):
+        return None
+    return unhandled
+
+
+def fast_parse_timestamp(value):
+    value_loader = get_value_loader()
+    if "\t" in value or value != value.strip() or not value_loader.timestamp_regexp.match(value):
+        return unhandled
+    return value_loader.construct_yaml_timestamp(yaml.ScalarNode("tag:yaml.org,2002:timestamp", value))
+
+
+def fast_parse_list(value):
+    # only flat sequences of plain scalars, e.g. [a, 1, 2.0, True]
+    if not flow_sequence_regexp.match(value):
+        return unhandled
+    items = value.strip()[1:-1].strip()
+    if not items:
+        return []
+    value_loader = get_value_loader()
+    parsed = []
+    for item in items.split(","):
+        item = item.strip()
+        tag = value_loader.resolve(yaml.ScalarNode, item, (True, False))
+        parsed.append(value_loader.yaml_constructors[tag](value_loader, yaml.ScalarNode(tag, item)))
+    return parsed
+
+
+def fast_parse_tuple(value):
+    parsed = fast_parse_list(value)
+    if parsed is unhandled:
+        return unhandled
+    return tuple(parsed)
+
+
+fast_value_parsers = {"!!bool": fast_parse_bool, "!!python/none": fast_parse_none,
+                      "!!timestamp": fast_parse_timestamp, "!!python/list": fast_parse_list,
+                      "!!python/tuple": fast_parse_tuple}
+
+
+def split_document_arguments(argv, namespace, name_key="name"):
+    """
+    Take arguments that are scoped to a single document (--stage[2].key=value, --stage[train].key value) out of the
+    command line and turn them into normal arguments (--key=value). Selectors that are numbers are indices, names that
+    are numbers are selected with the name key (--stage[name=7].key=value)
+    :param argv: command line arguments
+    :param namespace: name that introduces a scoped argument ("stage" in the examples above)
+    :param name_key: key of the document names ("name" in the examples above)
+    :return: (arguments for every document, dictionary document index (int) or name (str) -> arguments)
+    """
+    prefix = "--{}[".format(namespace)
+    common = []
+    scoped = {}
+    i = 0
+    while i < len(argv):
+        arg = argv[i]
+        i += 1
+        if arg == "--":
+            common.extend(argv[i - 1:])
+            break
+
+        selector, bracket, key = arg[len(prefix):].partition("].")
+        if not arg.startswith(prefix) or not bracket:
+            common.append(arg)
+            continue
+
+        if selector.startswith(name_key + "="):
+            selector = selector[len(name_key) + 1:]
+        elif selector.isdigit():
+            selector = int(selector)
+        arguments = scoped.setdefault(selector, [])
+        arguments.append("--" + key)
+        # --stage[2].key value, the value belongs to the scoped argument as well
+        if "=" not in key and i < len(argv) and is_option_value(argv[i]):
+            arguments.append(argv[i])
+            i += 1
+
+    return common, scoped
+
+
+def group_arguments(argv):
+    """
+    Group the command line into arguments with their values (--key=value, --key value) and everything else
+    :param argv: command line arguments
+    :return: list of (argument name, command line strings). The name is None for everything that is not an argument
+             with a name, such as -h or everything after --
+    """
+    groups = []
+    i = 0
+    while i < len(argv):
+        arg = argv[i]
+        i += 1
+        if arg == "--":
+            groups.append((None, argv[i - 1:]))
+            break
+
+        if not arg.startswith("--") or arg == "--help":
+            groups.append((None, [arg]))
+            continue
+
+        name, sep, value = arg[2:].partition("=")
+        arguments = [arg]
+        if not sep and i < len(argv) and is_option_value(argv[i]):
+            arguments.append(argv[i])
+            i += 1
+        groups.append((name, arguments))
+
+    return groups
+
+
+def is_option_value(arg):
+    """
+    :return: True if a command line string that follows --key (without =) is the value of the argument
+    """
+    return not arg.startswith("--") and (not arg.startswith("-") or bool(negative_number_regexp.match(arg)) or
+                                         " " in arg)
+
+
 def flatten_dict(dict_to_flatten):
     """
     Takes an arbitrarily nested dict and returns a flat dict.
@@ -154,17 +1346,24 @@ def flatten_dict(dict_to_flatten):
     :param dict_to_flatten:
     :return:
     """
-    def merge_dicts(dicts_to_merge):
-        return {key: value for to_merge in dicts_to_merge for key, value in to_merge.items()}
+    if not isinstance(dict_to_flatten, dict):
+        return {(): dict_to_flatten}
 
-    def recursive_flatten(current_key_hierarchy, value):
-        if isinstance(value, dict):
-            sub_dicts = [recursive_flatten(current_key_hierarchy + [key], val) for key, val in value.items()]
-            return merge_dicts(sub_dicts)
+    # depth-first walk with an explicit stack instead of recursion, this way deep configs don't hit the recursion
+    # limit. each stack entry holds the key hierarchy of a (sub-)dict and an iterator over its items
+    flattened = {}
+    stack = [((), iter(dict_to_flatten.items()))]
+    while stack:
+        key_hierarchy, items = stack[-1]
+        for key, value in items:
+            if isinstance(value, dict):
+                stack.append((key_hierarchy + (key,), iter(value.items())))
+                break
+            flattened[key_hierarchy + (key,)] = value
         else:
-            return {tuple(current_key_hierarchy): value}
+            stack.pop()
 
-    return recursive_flatten([], dict_to_flatten)
+    return flattened
 
 
 def unflatten_dict(dict_to_unflatten):
@@ -173,24 +1372,119 @@ def unflatten_dict(dict_to_unflatten):
     :param dict_to_unflatten:
     :return:
     """
-    def recursive_set_value(sub_dict, keys, value):
-        if len(keys) == 1:
-            sub_dict[keys[0]] = value
-        else:
-            if keys[0] not in sub_dict:
-                sub_dict[keys[0]] = {}
-            recursive_set_value(sub_dict[keys[0]], keys[1:], value)
-
     unflattened = {}
     for key_hierarchy, value in dict_to_unflatten.items():
-        recursive_set_value(unflattened, key_hierarchy, value)
+        sub_dict = unflattened
+        for i in range(len(key_hierarchy) - 1):
+            key = key_hierarchy[i]
+            if key not in sub_dict:
+                sub_dict[key] = {}
+            sub_dict = sub_dict[key]
+        sub_dict[key_hierarchy[-1]] = value
 
     return unflattened
 
 
+def override_dict(dict_to_override, overrides):
+    """
+    Returns a copy of a nested dict in which some values are replaced. Only the dicts on the paths to the replaced
+    values are copied, all other sub-dicts are shared with dict_to_override.
+    E.g. input = {"key1": {"key1_1": "val11"}, "key2": {"key2_1": "val21"}}, {("key1", "key1_1"): "new"}
+         output = {"key1": {"key1_1": "new"}, "key2": <the same dict as in the input>}
+    :param dict_to_override: nested dict, it is not modified. Any mapping with a copy method works (e.g. LazyMapping)
+    :param overrides: flat dict of new values, keys are tuples of keys as in flatten_dict
+    :return:
+    """
+    overridden = dict_to_override.copy()
+
+    # ids of the dicts that were already copied, no need to copy them again for the next value
+    # (comparing by id is safe, all dicts involved stay alive until the function returns)
+    copied = {id(overridden)}
+    for key_hierarchy, value in overrides.items():
+        sub_dict = overridden
+        for i in range(len(key_hierarchy) - 1):
+            key = key_hierarchy[i]
+            next_sub_dict = sub_dict[key]
+            if id(next_sub_dict) not in copied:
+                next_sub_dict = next_sub_dict.copy()
+                sub_dict[key] = next_sub_dict
+                copied.add(id(next_sub_dict))
+            sub_dict = next_sub_dict
+        sub_dict[key_hierarchy[-1]] = value
+
+    return overridden
+
+
+class ConfigView(Mapping):
+    """
+    Read-only view of a nested config with command line arguments layered on top. Neither is copied, sub-dicts of the
+    config are wrapped in a ConfigView only if they contain overridden arguments.
+    E.g. ConfigView({"key1": {"key1_1": "val11"}, "key2": {...}}, {"key1": {"key1_1": "new"}})["key1"]["key1_1"] == "new"
+    """
+    def __init__(self, config, overrides):
+        """
+        :param config: nested dict, it is not modified
+        :param overrides: nested dict of new values as returned by unflatten_dict. Values of arguments are never dicts
+                          (dicts in the config are always flattened), so every dict is another level of overrides
+        """
+        self.config = config
+        self.overrides = overrides
+
+    def __getitem__(self, key):
+        if key not in self.overrides:
+            return self.config[key]
+        value = self.overrides[key]
+        if isinstance(value, dict):
+            return type(self)(self.config[key], value)
+        return value
+
+    def __iter__(self):
+        # command line arguments can only override existing keys
+        return iter(self.config)
+
+    def __len__(self):
+        return len(self.config)
+
+    def __contains__(self, key):
+        return key in self.config
+
+    def materialize(self):
+        """
+        :return: plain nested dict, see override_dict
+        """
+        return override_dict(self.config, flatten_dict(self.overrides))
+
+    def __repr__(self):
+        return "ConfigView({!r}, {!r})".format(self.config, self.overrides)
+
+
 class UnsupportedYAMLTypeException(Exception):
     pass
 
 
 class ArgumentWithoutNameException(Exception):
     pass
+
+
+class InvalidCommandLineException(Exception):
+    pass
+
+
+# classes that derive from yaml or argparse classes -> function that defines them
+lazy_definitions = {"YAMLArgsLoader": define_loaders, "YAMLArgsCLoader": define_loaders, "ValueLoader": define_loaders,
+                    "SafeYAMLArgsLoader": define_loaders, "SafeValueLoader": define_loaders,
+                    "value_loader": define_loaders, "YAMLArgsParser": define_parser}
+
+
+def __getattr__(name):
+    # only called for names that are not defined (yet), python 3.7+
+    if name in lazy_definitions:
+        lazy_definitions[name]()
+        return globals()[name]
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+
+
+if sys.version_info < (3, 7):
+    # no module __getattr__, define everything right away
+    define_loaders()
+    define_parser()
@@ -0,0 +1,80 @@
+import copy
+import threading
+from contextlib import contextmanager
+
+from .quickargs import compile_config, unflatten_dict, ConfigView, is_plain_data
+
+
+class SharedConfig(object):
+    """
+    A config that many threads merge with their own command line arguments at the same time, e.g. a base config with
+    per-tenant overrides in a server. The config is compiled once (the schema comes from the process-wide, thread-safe
+    compiled_schemas), parse only converts the arguments and returns a read-only SharedView that layers them over the
+    shared defaults. Neither the defaults nor the views of other threads can be changed through a view.
+    shared = SharedConfig(yaml_config)
+    with shared.overlay(["--tenant.name=acme"]):
+        handle_request(shared.config)   # the overlay of this thread
+    """
+    def __init__(self, yaml_config, engine="fast", allowed_modules=None):
+        """
+        :param yaml_config: dictionary as supplied by yaml.load(), it is kept by reference and must not be changed
+        :param engine: "argparse" or "fast", see CompiledConfig.match_arguments
+        :param allowed_modules: None or modules for safe parsing, see compile_config
+        """
+        self.compiled = compile_config(yaml_config, allowed_modules=allowed_modules)
+        self.defaults = SharedView(yaml_config, {})
+        self.engine = engine
+        self.local = threading.local()
+
+    def parse(self, argv, exit_on_error=False):
+        """
+        :param argv: command line arguments
+        :param exit_on_error: if False, invalid arguments raise InvalidCommandLineException instead of exiting
+        :return: SharedView of the defaults with the arguments layered on top
+        """
+        overrides = self.compiled.parse_overrides(argv, engine=self.engine, exit_on_error=exit_on_error)
+        return SharedView(self.compiled.config, unflatten_dict(overrides))
+
+    @contextmanager
+    def overlay(self, argv, exit_on_error=False):
+        """
+        Layer the arguments over the defaults for the current thread only, until the with-block ends
+        :return: SharedView of the overlay, the same as self.config inside the with-block
+        """
+        previous = getattr(self.local, "view", None)
+        self.local.view = self.parse(argv, exit_on_error=exit_on_error)
+        try:
+            yield self.local.view
+        finally:
+            self.local.view = previous
+
+    @property
+    def config(self):
+        """
+        SharedView for the current thread: its overlay or the plain defaults outside of overlay
+        """
+        view = getattr(self.local, "view", None)
+        return self.defaults if view is None else view
+
+
+class SharedView(ConfigView):
+    """
+    ConfigView that does not hand out anything that would change the shared config: sub-dicts are wrapped in a
+    SharedView as well and lists are copied. Values of the arguments belong to the view, they are returned as they are.
+    """
+    def __getitem__(self, key):
+        value = super(SharedView, self).__getitem__(key)
+        if isinstance(value, dict):
+            return SharedView(value, {})
+        if isinstance(value, list) and key not in self.overrides:
+            return copy.deepcopy(value) if is_plain_data(value) else list(value)
+        return value
+
+    def materialize(self):
+        """
+        :return: plain nested dict that does not share any dicts or lists with the shared config
+        """
+        return {key: value.materialize() if isinstance(value, SharedView) else value for key, value in self.items()}
+
+    def __repr__(self):
+        return "SharedView({!r}, {!r})".format(self.config, self.overrides)
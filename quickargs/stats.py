@@ -0,0 +1,83 @@
+import os
+import sys
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+# perf_counter and getallocatedblocks are not available in python2
+timer = getattr(time, "perf_counter", time.time)
+allocated_blocks = getattr(sys, "getallocatedblocks", lambda: 0)
+
+
+class MergeStats(object):
+    """
+    Collects wall time and allocations for the stages of loading a config and merging it with the command line.
+    Pass an instance to merge_yaml_with_args, compile_config or CompiledConfig.parse, or set the QUICKARGS_STATS
+    environment variable to get a summary on stderr for every merge.
+    Allocations are the net change in the number of memory blocks allocated by the interpreter during a stage.
+    """
+    def __init__(self):
+        self.stages = OrderedDict()  # stage name -> [seconds, allocated blocks]
+        self.key_times = OrderedDict()  # argument name -> seconds spent converting its value
+
+    @classmethod
+    def from_environment(cls):
+        """
+        :return: MergeStats if the QUICKARGS_STATS environment variable is set, None otherwise
+        """
+        if os.environ.get("QUICKARGS_STATS", "") in ["", "0"]:
+            return None
+        return cls()
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Measure the code inside the with-block, times of stages that run more than once are added up
+        :param name: name of the stage
+        """
+        start_time = timer()
+        start_blocks = allocated_blocks()
+        try:
+            yield
+        finally:
+            totals = self.stages.setdefault(name, [0.0, 0])
+            totals[0] += timer() - start_time
+            totals[1] += allocated_blocks() - start_blocks
+
+    def add_key_time(self, key, seconds):
+        self.key_times[key] = self.key_times.get(key, 0.0) + seconds
+
+    def summary(self, slowest_keys=10):
+        """
+        :param slowest_keys: number of keys to list in the per-key section
+        :return: human readable summary of all stages
+        """
+        lines = ["{:<20} {:>12} {:>18}".format("stage", "time [ms]", "allocated blocks")]
+        for name, (seconds, blocks) in self.stages.items():
+            lines.append("{:<20} {:>12.3f} {:>18}".format(name, seconds * 1000, blocks))
+        if self.key_times:
+            lines.append("slowest keys to convert:")
+            for key, seconds in sorted(self.key_times.items(), key=lambda item: -item[1])[:slowest_keys]:
+                lines.append("  {:<30} {:>12.3f} ms".format(key, seconds * 1000))
+        return "\n".join(lines)
+
+    def dump(self, stream=None):
+        """
+        Print the summary, by default to stderr
+        """
+        stream = stream or sys.stderr
+        stream.write("quickargs stats\n{}\n".format(self.summary()))
+
+
+@contextmanager
+def no_stage():
+    yield
+
+
+def stage(stats, name):
+    """
+    :return: context manager that measures a stage, or does nothing if stats is None
+    """
+    if stats is None:
+        return no_stage()
+    return stats.stage(name)
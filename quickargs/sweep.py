@@ -0,0 +1,198 @@
+import io
+import sys
+import pickle
+import itertools
+
+from .cache import ModulePickler, ModuleUnpickler
+from .imports import yaml
+from .quickargs import compile_config, override_dict, value_loader_class, InvalidCommandLineException
+
+
+def merge_many(yaml_config, argvs, engine="argparse", workers=None, chunksize=None):
+    """
+    Merge a yaml config with several command lines. The parser is only built once, and the results share all
+    sub-dicts without overridden arguments with yaml_config (and therefore with each other).
+    Command lines are checked one by one, if any of them is invalid, InvalidTrialsException is raised that lists
+    all invalid command lines.
+    :param yaml_config: dictionary as supplied by yaml.load()
+    :param argvs: list of command lines, each a list of command line arguments
+    :param engine: "argparse" or "fast", see CompiledConfig.match_arguments
+    :param workers: number of worker processes for parsing the command lines, None or 1 parses in this process
+    :param chunksize: number of command lines that are sent to a worker at once, by default the command lines are
+                      split into four chunks per worker
+    :return: list of merged dictionaries, one for every command line, in the order of argvs
+    """
+    compiled = compile_config(yaml_config)
+    argvs = list(argvs)
+
+    if workers is None or workers <= 1 or len(argvs) <= 1:
+        results = [parse_trial(compiled, index, argv, engine) for index, argv in enumerate(argvs)]
+    else:
+        results = parse_trials_parallel(compiled, argvs, engine, workers, chunksize)
+
+    errors = [(index, argv, error) for (index, overrides, error), argv in zip(results, argvs) if error is not None]
+    if errors:
+        raise InvalidTrialsException(errors)
+
+    # merging happens here, so that all results share the unchanged sub-dicts with yaml_config
+    return [override_dict(yaml_config, overrides) for index, overrides, error in results]
+
+
+def merge_sweep(yaml_config, argv=None, engine="argparse", workers=None, chunksize=None):
+    """
+    Merge a yaml config with every trial of a sweep, see expand_sweep for the command line syntax
+    E.g. --sweep lr=[0.1,0.01] --sweep layers=[2,4] gives four merged configs
+    :param yaml_config: dictionary as supplied by yaml.load()
+    :param argv: command line arguments, if argv is None, sys.argv will be used
+    :param engine: "argparse" or "fast", see CompiledConfig.match_arguments
+    :param workers: number of worker processes, see merge_many
+    :param chunksize: number of trials that are sent to a worker at once, see merge_many
+    :return: list of merged dictionaries, one for every trial
+    """
+    if argv is None:
+        argv = sys.argv[1:]
+    return merge_many(yaml_config, expand_sweep(argv), engine=engine, workers=workers, chunksize=chunksize)
+
+
+def parse_trial(compiled, index, argv, engine):
+    """
+    :return: (index, flat dictionary of overrides or None, error message or None)
+    """
+    try:
+        return index, compiled.parse_overrides(argv, engine=engine, exit_on_error=False), None
+    except InvalidCommandLineException as e:
+        return index, None, str(e)
+
+
+def parse_trials_parallel(compiled, argvs, engine, workers, chunksize):
+    """
+    Parse command lines in worker processes. Every worker unpickles the compiled config once and then parses whole
+    chunks of command lines, only the overrides are sent back.
+    :return: list of parse_trial results, in the order of argvs
+    """
+    # python3 only (or the futures backport), import it only when it is actually needed
+    from concurrent.futures import ProcessPoolExecutor
+
+    if chunksize is None:
+        chunksize = max(1, -(-len(argvs) // (workers * 4)))
+    trials = list(enumerate(argvs))
+    chunks = [trials[start:start + chunksize] for start in range(0, len(trials), chunksize)]
+
+    results = []
+    executor = ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                                   initargs=(dumps(compiled), engine))
+    with executor:
+        # map keeps the order of the chunks, no matter which worker finishes first
+        for chunk_results in executor.map(parse_chunk, chunks):
+            results.extend(loads(chunk_results))
+    return results
+
+
+# state of a worker process, set up once by init_worker
+worker_state = {}
+
+
+def init_worker(compiled_data, engine):
+    worker_state["compiled"] = loads(compiled_data)
+    worker_state["engine"] = engine
+
+
+def parse_chunk(chunk):
+    compiled = worker_state["compiled"]
+    engine = worker_state["engine"]
+    return dumps([parse_trial(compiled, index, argv, engine) for index, argv in chunk])
+
+
+def dumps(obj):
+    # overrides can contain modules, which the default pickler of the process pool can not handle
+    stream = io.BytesIO()
+    ModulePickler(stream, pickle.HIGHEST_PROTOCOL).dump(obj)
+    return stream.getvalue()
+
+
+def loads(data):
+    return ModuleUnpickler(io.BytesIO(data)).load()
+
+
+def expand_sweep(argv):
+    """
+    Expand a command line with sweep arguments into one command line per trial.
+    --sweep key=[v1,v2]  every value of the key is combined with every value of all other --sweep keys
+    --zip key=[v1,v2]    all --zip keys change together (the lists must have the same length), each step of the zipped
+                         keys is again combined with every value of the --sweep keys
+    Both also accept the --sweep=key=[v1,v2] form. All other arguments are passed on to every trial.
+    E.g. --sweep a=[1,2] --sweep b=[x,y] -> [--a=1 --b=x], [--a=1 --b=y], [--a=2 --b=x], [--a=2 --b=y]
+         --zip a=[1,2] --zip b=[x,y] -> [--a=1 --b=x], [--a=2 --b=y]
+    :param argv: command line arguments
+    :return: list of command lines
+    """
+    common = []
+    sweeps = []
+    zips = []
+    i = 0
+    while i < len(argv):
+        arg = argv[i]
+        i += 1
+        option, sep, spec = arg.partition("=")
+        if option not in ["--sweep", "--zip"]:
+            common.append(arg)
+            continue
+        if not sep:
+            if i == len(argv):
+                raise InvalidSweepException("{} expects key=[values]".format(option))
+            spec = argv[i]
+            i += 1
+        (sweeps if option == "--sweep" else zips).append(parse_sweep_spec(spec))
+
+    zip_lengths = set(len(values) for key, values in zips)
+    if len(zip_lengths) > 1:
+        raise InvalidSweepException("all --zip arguments need the same number of values")
+
+    # one list of (key, value) pairs for each zipped step, and one such list per value of each swept key
+    zipped_steps = [list(zip([key for key, values in zips], step)) for step in zip(*[values for key, values in zips])]
+    dimensions = [[[(key, value)] for value in values] for key, values in sweeps]
+    if zips:
+        dimensions.insert(0, zipped_steps)
+
+    argvs = []
+    for trial in itertools.product(*dimensions):
+        argvs.append(common + ["--{}={}".format(key, value) for pairs in trial for key, value in pairs])
+    return argvs
+
+
+def parse_sweep_spec(spec):
+    """
+    Split key=[v1, v2, ...] into the key and the command line strings of the values. Values are sliced out of the
+    spec as they were written, e.g. key=[[1, 2], 'a b'] gives the values "[1, 2]" and "a b"
+    :param spec: sweep specification
+    :return: (key, list of values)
+    """
+    key, sep, values = spec.partition("=")
+    if not key or not sep:
+        raise InvalidSweepException("invalid sweep {!r}, expected key=[values]".format(spec))
+    try:
+        node = yaml.compose(values, Loader=value_loader_class())
+    except yaml.YAMLError as e:
+        raise InvalidSweepException("invalid sweep {!r}: {}".format(spec, e))
+    if not isinstance(node, yaml.SequenceNode) or not node.value:
+        raise InvalidSweepException("invalid sweep {!r}, expected a non-empty list of values".format(spec))
+
+    # unquoted values of scalars, source text of lists and dicts
+    return key, [item.value if isinstance(item, yaml.ScalarNode) else values[item.start_mark.index:item.end_mark.index]
+                 for item in node.value]
+
+
+class InvalidSweepException(Exception):
+    pass
+
+
+class InvalidTrialsException(Exception):
+    """
+    Raised by merge_many if some of the command lines are invalid
+    errors: list of (index, command line, error message), for every invalid command line
+    """
+    def __init__(self, errors):
+        self.errors = errors
+        lines = ["{} of the command lines are invalid:".format(len(errors))]
+        lines += ["  [{}] {}: {}".format(index, " ".join(argv), message) for index, argv, message in errors]
+        super(InvalidTrialsException, self).__init__("\n".join(lines))
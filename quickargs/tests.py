@@ -1,5 +1,11 @@
-from tempfile import NamedTemporaryFile
+from tempfile import NamedTemporaryFile, mkdtemp
+import os
 import sys
+import random
+import shutil
+import subprocess
+import time
+import threading
 from datetime import datetime, timedelta
 from contextlib import contextmanager
 from functools import wraps
@@ -7,8 +13,15 @@ from functools import wraps
 import yaml
 from nose.tools import assert_dict_equal, raises, nottest
 
-from quickargs import YAMLArgsLoader
-from .quickargs import merge_yaml_with_args, flatten_dict, unflatten_dict, ArgumentWithoutNameException
+from quickargs import YAMLArgsLoader, YAMLArgsCLoader, MergeStats, merge_many, merge_sweep, expand_sweep, \
+    load_cached, SafeYAMLArgsLoader
+from . import quickargs, cache
+from .sweep import InvalidSweepException, InvalidTrialsException
+from .lazy import load_lazy, LazyMapping
+from .watch import ConfigWatcher, split_chunks
+from .quickargs import merge_yaml_with_args, compile_config, yaml_parse_value, flatten_dict, unflatten_dict, \
+    override_dict, split_document_arguments, ConfigView, init_type_parser, register_yaml_object, register_type_parser, \
+    UnsupportedYAMLTypeException, ArgumentWithoutNameException, InvalidCommandLineException
 
 if sys.version_info[0] < 3:
     from StringIO import StringIO
@@ -31,6 +44,39 @@ def temp_yaml_file(yaml_config):
         yield temp_file.name
 
 
+@contextmanager
+def capture_stdout():
+    original = sys.stdout
+    sys.stdout = StringIO()
+    try:
+        yield sys.stdout
+    finally:
+        sys.stdout = original
+
+
+@contextmanager
+def capture_stderr():
+    original = sys.stderr
+    sys.stderr = StringIO()
+    try:
+        yield sys.stderr
+    finally:
+        sys.stderr = original
+
+
+@contextmanager
+def set_environ(name, value):
+    original = os.environ.get(name)
+    os.environ[name] = value
+    try:
+        yield
+    finally:
+        if original is None:
+            del os.environ[name]
+        else:
+            os.environ[name] = original
+
+
 @contextmanager
 def set_sys_argv(command_line_params):
     """
@@ -47,7 +93,7 @@ def create_yaml_and_parse_arguments(yaml_config, command_line_params):
     # dumping and loading just to make sure to pass it through yaml once
     with temp_yaml_file(yaml_config) as temp_file:
         with open(temp_file) as f:
-            yaml_config = yaml.load(f)
+            yaml_config = yaml.load(f, Loader=yaml.Loader)
 
     with set_sys_argv(command_line_params):
         config = merge_yaml_with_args(yaml_config)
@@ -524,14 +570,98 @@ def test_module_not_exist():
     create_yaml_and_parse_arguments(yaml_params, command_line_params)
 
 
-"""
+@raises(SystemExit)
 def test_instantiate():
-    # warning, this should fail but does not
-    # instantiation of classes is not supported but no errors will be thrown
-    yaml_params = "key1: !ClassA\n name: test"
-    command_line_params = ["--key1=quickargs.tests.ClassB"]
-    create_yaml_and_parse_arguments(yaml_params, command_line_params)
-"""
+    # instances of yaml classes are only supported after registering them
+    try:
+        with capture_stderr() as stderr:
+            merge_yaml_with_args({"key1": ClassC("test")}, ["--key1=quickargs.tests.ClassB"])
+    finally:
+        assert "argument --key1: Can not handle type" in stderr.getvalue()
+
+
+def test_unsupported_type_not_on_command_line():
+    # only supplied arguments are converted, other values can have any type
+    actual = merge_yaml_with_args({"a": set(["x", "y"]), "key1": ClassC("test"), "b": 1}, ["--b=2"])
+    assert actual["a"] == set(["x", "y"]) and actual["b"] == 2
+
+
+def test_unsupported_type_on_command_line():
+    for engine in ["argparse", "fast"]:
+        try:
+            compile_config({"a": set(["x", "y"]), "b": 1}).parse(["--a={z}"], engine=engine, exit_on_error=False)
+            raise AssertionError("the set was parsed")
+        except InvalidCommandLineException as e:
+            assert "argument --a: Can not handle type" in str(e)
+
+
+def test_instantiate_registered():
+    register_yaml_object(ClassD)
+    try:
+        actual = merge_yaml_with_args({"key1": ClassD("test"), "key2": ClassD("other")}, ["--key1={name: new}"])
+        assert isinstance(actual["key1"], ClassD) and actual["key1"].name == "new"
+        assert actual["key2"].name == "other"
+    finally:
+        del quickargs.type_parser_registry[ClassD]
+
+
+@raises(SystemExit)
+def test_instantiate_registered_type_wrong():
+    register_yaml_object(ClassD)
+    try:
+        with capture_stderr() as stderr:
+            merge_yaml_with_args({"key1": ClassD("test")}, ["--key1=[1, 2]"])
+    finally:
+        del quickargs.type_parser_registry[ClassD]
+        assert "invalid ClassD value" in stderr.getvalue()
+
+
+@contextmanager
+def set_parser_registered():
+    register_type_parser(set, parse_set)
+    try:
+        yield
+    finally:
+        del quickargs.type_parser_registry[set]
+        del quickargs.registered_type_parsers[set]
+        quickargs.compiled_schemas.clear()
+
+
+def test_register_type_parser_after_compiling():
+    config = {"tags": set(["x"]), "b": 1}
+    compile_config(config)
+    with set_parser_registered():
+        assert compile_config(config).parse(["--tags=x,y"])["tags"] == set(["x", "y"])
+
+
+def test_register_type_parser_after_disk_caching():
+    conf = "tags: !!set {x: null}\nb: 1"
+    with disk_cache_enabled() as cache_dir:
+        load_with(YAMLArgsLoader, conf, [])
+        with set_parser_registered():
+            assert load_with(YAMLArgsLoader, conf, ["--tags=x,y"])["tags"] == set(["x", "y"])
+            with compile_config_disabled():
+                assert load_with(YAMLArgsLoader, conf, ["--tags=z"])["tags"] == set(["z"])
+        assert len(os.listdir(cache_dir)) == 2
+
+
+def test_init_type_parser_subclasses():
+    class Text(str):
+        pass
+
+    assert init_type_parser(Text("a")) is str
+    assert init_type_parser(True) is quickargs.yaml_bool
+    assert init_type_parser(datetime(2017, 1, 1)) is quickargs.yaml_timestamp
+    assert init_type_parser(functionA) is quickargs.yaml_python_callable
+    assert init_type_parser(ClassA) is quickargs.yaml_python_callable
+    assert init_type_parser("abc".upper) is quickargs.yaml_python_callable
+    assert init_type_parser(yaml) is quickargs.yaml_python_module
+    assert Text in quickargs.resolved_type_parsers
+
+
+@raises(UnsupportedYAMLTypeException)
+def test_init_type_parser_unsupported():
+    init_type_parser(set([1, 2]))
 
 #############################################
 # test integration with yaml
@@ -547,7 +677,7 @@ def test_with_supplied_arguments():
     # dumping and loading just to make sure to pass it through yaml once
     with temp_yaml_file(yaml_params) as temp_file:
         with open(temp_file) as f:
-            yaml_params = yaml.load(f)
+            yaml_params = yaml.load(f, Loader=yaml.Loader)
 
     actual = merge_yaml_with_args(yaml_params, command_line_params)
     assert_dict_equal(expected, actual)
@@ -580,6 +710,1543 @@ def test_loader_from_stringio():
     assert_dict_equal(expected, actual)
 
 
+#############################################
+# Tests for compiled configs
+############################################
+
+
+def test_compiled_config_parse():
+    yaml_params = {"key1": "yaml_value_key1", "key2": {"key2_1": 21, "key2_2": 22}}
+    expected = {"key1": "yaml_value_key1", "key2": {"key2_1": 21, "key2_2": 7}}
+
+    compiled = compile_config(yaml_params)
+    assert_dict_equal(expected, compiled.parse(["--key2.key2_2=7"]))
+    assert_dict_equal(yaml_params, compiled.parse(["--key1=yaml_value_key1"]))
+
+
+def test_compiled_config_same_structure_shares_schema():
+    compiled1 = compile_config({"key1": "a", "key2": {"key2_1": 1}})
+    compiled2 = compile_config({"key1": "b", "key2": {"key2_1": 2}})
+    assert compiled1.schema is compiled2.schema
+
+    assert_dict_equal({"key1": "a", "key2": {"key2_1": 3}}, compiled1.parse(["--key2.key2_1=3"]))
+    assert_dict_equal({"key1": "c", "key2": {"key2_1": 2}}, compiled2.parse(["--key1=c"]))
+
+
+def test_compiled_config_different_types_different_schema():
+    compiled1 = compile_config({"key1": 1})
+    compiled2 = compile_config({"key1": 1.0})
+    compiled3 = compile_config({"key1": True})
+    assert compiled1.schema is not compiled2.schema
+    assert compiled1.schema is not compiled3.schema
+
+    assert_dict_equal({"key1": 2.5}, compiled2.parse(["--key1=2.5"]))
+    assert_dict_equal({"key1": False}, compiled3.parse(["--key1=no"]))
+
+
+def test_compiled_config_parse_empty_argv():
+    yaml_params = {"key1": "yaml_value_key1"}
+    with set_sys_argv(["--key1=cmd_value_key1"]):
+        actual = compile_config(yaml_params).parse([])
+    assert_dict_equal(yaml_params, actual)
+
+
+def test_compiled_config_shares_unchanged_sub_dicts():
+    yaml_params = {"key1": {"key1_1": 11, "key1_2": {"key1_2_1": 121}}, "key2": {"key2_1": 21}}
+    expected = {"key1": {"key1_1": 12, "key1_2": {"key1_2_1": 121}}, "key2": {"key2_1": 21}}
+
+    actual = compile_config(yaml_params).parse(["--key1.key1_1=12"])
+    assert_dict_equal(expected, actual)
+    assert actual["key2"] is yaml_params["key2"]
+    assert actual["key1"]["key1_2"] is yaml_params["key1"]["key1_2"]
+    assert yaml_params["key1"]["key1_1"] == 11
+
+
+def test_compiled_config_converts_supplied_arguments_only():
+    yaml_params = {"key1": "2016-12-11", "key2": True, "key3": [1, 2]}
+    stats = MergeStats()
+
+    actual = compile_config(yaml_params).parse(["--key2=no"], stats=stats)
+    assert list(stats.key_times) == ["key2"]
+    assert actual["key3"] is yaml_params["key3"]
+
+
+@raises(SystemExit)
+def test_compiled_config_type_wrong():
+    compile_config({"key1": 1}).parse(["--key1=hallo"])
+
+
+def test_compiled_config_help_shows_own_defaults():
+    compile_config({"key1": "first_default"})
+    compiled = compile_config({"key1": "second_default"})
+
+    with capture_stdout() as stdout:
+        try:
+            compiled.parse(["-h"])
+        except SystemExit:
+            pass
+    assert "default: second_default" in stdout.getvalue()
+    assert "first_default" not in stdout.getvalue()
+
+
+#############################################
+# Tests for the on-disk cache
+############################################
+
+
+@contextmanager
+def disk_cache_enabled():
+    cache_dir = mkdtemp()
+    try:
+        with set_environ("QUICKARGS_CACHE", cache_dir):
+            yield cache_dir
+    finally:
+        shutil.rmtree(cache_dir)
+
+
+@contextmanager
+def compile_config_disabled():
+    def fail(yaml_config):
+        raise AssertionError("config was compiled although it should have been loaded from the cache")
+
+    original = quickargs.compile_config
+    quickargs.compile_config = fail
+    try:
+        yield
+    finally:
+        quickargs.compile_config = original
+
+
+def test_disk_cache_hit():
+    with disk_cache_enabled() as cache_dir:
+        for loader in [YAMLArgsLoader, YAMLArgsCLoader]:
+            expected = load_with(loader, all_types_conf, ["--an_int=5"])
+            with compile_config_disabled():
+                actual = load_with(loader, all_types_conf, ["--an_int=5"])
+                assert_dict_equal(expected, actual)
+
+                actual = load_with(loader, all_types_conf, ["--sequences.a_tuple=[c]"])
+                assert actual["sequences"]["a_tuple"] == ("c",)
+                assert actual["an_int"] == 3
+        assert len(os.listdir(cache_dir)) == 2
+
+
+def test_disk_cache_changed_file():
+    with disk_cache_enabled() as cache_dir:
+        load_with(YAMLArgsLoader, simple_conf, [])
+        actual = load_with(YAMLArgsLoader, simple_conf.replace("level: 4", "level: 5"), [])
+        assert actual["logging"]["level"] == 5
+        assert len(os.listdir(cache_dir)) == 2
+
+
+def test_disk_cache_format_is_part_of_key():
+    with disk_cache_enabled() as cache_dir:
+        load_with(YAMLArgsLoader, simple_conf, [])
+        original = cache.cache_format
+        cache.cache_format = original + 1
+        try:
+            load_with(YAMLArgsLoader, simple_conf, [])
+        finally:
+            cache.cache_format = original
+        assert len(os.listdir(cache_dir)) == 2
+
+
+def test_disk_cache_corrupt_entry():
+    with disk_cache_enabled() as cache_dir:
+        expected = load_with(YAMLArgsLoader, simple_conf, [])
+        for name in os.listdir(cache_dir):
+            with open(os.path.join(cache_dir, name), "wb") as f:
+                f.write(b"corrupt")
+
+        actual = load_with(YAMLArgsLoader, simple_conf, [])
+        assert_dict_equal(expected, actual)
+        with compile_config_disabled():
+            actual = load_with(YAMLArgsLoader, simple_conf, [])
+        assert_dict_equal(expected, actual)
+
+
+def test_disk_cache_from_file():
+    with disk_cache_enabled():
+        with temp_yaml_file(simple_conf) as temp_file:
+            for _ in range(2):
+                with open(temp_file) as f:
+                    with set_sys_argv(["--logging.level=0"]):
+                        actual = yaml.load(f, Loader=YAMLArgsLoader)
+                assert actual["logging"]["level"] == 0
+
+
+#############################################
+# Tests for startup time
+############################################
+
+
+def run_python(code, environ=None):
+    """
+    Run code in a fresh interpreter, so that the modules imported by previous tests do not count
+    :return: stdout and stderr of the interpreter
+    """
+    env = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    env.update(environ or {})
+    process = subprocess.Popen([sys.executable, "-X", "importtime", "-c", code], env=env,
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    stdout, stderr = process.communicate()
+    assert process.returncode == 0, stderr.decode("utf-8")
+    return stdout.decode("utf-8"), stderr.decode("utf-8")
+
+
+def imported_modules(importtime_output):
+    """
+    :return: {module name: cumulative import time in microseconds}
+    """
+    modules = {}
+    for line in importtime_output.splitlines():
+        if line.startswith("import time:") and "imported package" not in line:
+            _, cumulative, name = line[len("import time:"):].split("|")
+            modules[name.strip()] = int(cumulative)
+    return modules
+
+
+def test_import_does_not_load_yaml_and_argparse_py3_only():
+    # -X importtime and module __getattr__ are python 3.7+
+    if sys.version_info < (3, 7):
+        return
+
+    stdout, stderr = run_python("import quickargs.quickargs")
+    modules = imported_modules(stderr)
+    for slow_module in ["yaml", "argparse", "inspect", "datetime", "tempfile"]:
+        assert slow_module not in modules, slow_module
+    # generous budget, a cold import takes about 35ms, with yaml and argparse it took 86ms
+    assert modules["quickargs.quickargs"] < 100 * 1000
+
+
+def test_load_cached_does_not_load_yaml_and_argparse_py3_only():
+    if sys.version_info < (3, 7):
+        return
+
+    cache_dir = mkdtemp()
+    try:
+        with temp_yaml_file(simple_conf) as temp_file:
+            code = "\n".join([
+                "import sys, quickargs",
+                "config = quickargs.load_cached({!r}, ['--logging.level=0'])".format(temp_file),
+                "assert config['logging']['level'] == 0, config",
+                "print(' '.join(name for name in ['yaml', 'argparse'] if name in sys.modules))",
+            ])
+            stdout, stderr = run_python(code, {"QUICKARGS_CACHE": cache_dir})
+            # the first run loads the yaml file, the fast engine does not need argparse either way
+            assert stdout.split() == ["yaml"]
+            stdout, stderr = run_python(code, {"QUICKARGS_CACHE": cache_dir})
+            assert stdout.split() == []
+    finally:
+        shutil.rmtree(cache_dir)
+
+
+def test_load_cached():
+    expected = load_with(YAMLArgsLoader, simple_conf, ["--logging.level=0"])
+    with disk_cache_enabled() as cache_dir:
+        with temp_yaml_file(simple_conf) as temp_file:
+            assert_dict_equal(expected, load_cached(temp_file, ["--logging.level=0"]))
+            with compile_config_disabled():
+                assert_dict_equal(expected, load_cached(temp_file, ["--logging.level=0"]))
+        assert len(os.listdir(cache_dir)) == 1
+
+
+#############################################
+# Tests for the fast command line engine
+############################################
+
+
+def parse_with_engine(compiled, argv, engine):
+    """
+    :return: merged config or exit code, together with everything that was printed
+    """
+    with capture_stdout() as stdout:
+        with capture_stderr() as stderr:
+            try:
+                result = compiled.parse(argv, engine=engine)
+            except SystemExit as e:
+                result = e.code
+    return result, stdout.getvalue(), stderr.getvalue()
+
+
+def test_fast_engine_same_as_argparse():
+    compiled = compile_config({"input_dir": "data", "logging": {"file": "output.log", "level": 4},
+                               "flag": True, "values": [1, 2], "negative": -1.5})
+    tokens = ["--input_dir=x", "--input_dir", "--logging.file", "--logging.level=3", "--logging.level", "--flag=no",
+              "--flag", "--values=[3, 4]", "--values", "--negative", "--negative=-2", "--input_dir=a b", "x", "3",
+              "-1", "-.5", "-x", "-", "--", "a b", "- a", "[5]", "--bogus", "--bogus=1", "--bogus=a b", "--flag=hallo",
+              "--logging.level=WARNING", "-h", "--help", ""]
+    rng = random.Random(0)
+    for _ in range(2000):
+        argv = [rng.choice(tokens) for _ in range(rng.randint(0, 6))]
+        expected = parse_with_engine(compiled, argv, "argparse")
+        actual = parse_with_engine(compiled, argv, "fast")
+        assert expected == actual, (argv, expected, actual)
+
+
+def test_fast_engine_no_abbreviations():
+    compiled = compile_config({"logging": {"file": "output.log"}})
+    assert compiled.parse(["--logging.f=x.log"])["logging"]["file"] == "x.log"
+
+    result, stdout, stderr = parse_with_engine(compiled, ["--logging.f=x.log"], "fast")
+    assert result == 2
+    assert "unrecognized arguments: --logging.f=x.log" in stderr
+
+
+def test_fast_engine_merge_and_loader():
+    yaml_params = {"key1": "yaml_value_key1", "key2": {"key2_1": 21}}
+    expected = {"key1": "cmd_value_key1", "key2": {"key2_1": 7}}
+    actual = merge_yaml_with_args(yaml_params, ["--key1", "cmd_value_key1", "--key2.key2_1=7"], engine="fast")
+    assert_dict_equal(expected, actual)
+
+    class FastLoader(YAMLArgsLoader):
+        engine = "fast"
+
+    actual = load_with(FastLoader, simple_conf, ["--logging.level", "0"])
+    assert actual["logging"]["level"] == 0
+
+
+@raises(ValueError)
+def test_unknown_engine():
+    compile_config({"key1": 1}).parse([], engine="bogus")
+
+
+#############################################
+# Tests for pattern overrides
+############################################
+
+layers_config = {"layers": {"layer1": {"dropout": 0.5, "size": 10},
+                            "layer2": {"dropout": 0.5, "size": 20},
+                            "block": {"layer3": {"dropout": 0.5, "size": 30}}},
+                 "dropout": 0.2}
+
+
+def test_pattern_one_level():
+    for engine in ["argparse", "fast"]:
+        actual = compile_config(layers_config).parse(["--layers.*.dropout=0.1"], engine=engine)
+        assert actual["layers"]["layer1"]["dropout"] == 0.1
+        assert actual["layers"]["layer2"]["dropout"] == 0.1
+        assert actual["layers"]["block"]["layer3"]["dropout"] == 0.5
+        assert actual["dropout"] == 0.2
+        assert layers_config["layers"]["layer1"]["dropout"] == 0.5
+
+
+def test_pattern_any_depth():
+    for engine in ["argparse", "fast"]:
+        actual = compile_config(layers_config).parse(["--**.dropout", "0.1"], engine=engine)
+        assert actual["layers"]["layer1"]["dropout"] == 0.1
+        assert actual["layers"]["block"]["layer3"]["dropout"] == 0.1
+        assert actual["dropout"] == 0.1
+
+
+def test_pattern_fnmatch_segment():
+    actual = compile_config(layers_config).parse(["--layers.layer[12].size=5"])
+    assert actual["layers"]["layer1"]["size"] == 5
+    assert actual["layers"]["layer2"]["size"] == 5
+    assert actual["layers"]["block"]["layer3"]["size"] == 30
+
+
+def test_pattern_explicit_argument_wins():
+    actual = compile_config(layers_config).parse(["--layers.layer1.size=1", "--layers.*.size=2"])
+    assert actual["layers"]["layer1"]["size"] == 1
+    assert actual["layers"]["layer2"]["size"] == 2
+
+
+def test_pattern_match_pattern():
+    schema = compile_config(layers_config).schema
+    assert schema.match_pattern("layers.*.dropout") == ["layers.layer1.dropout", "layers.layer2.dropout"]
+    assert schema.match_pattern("layers.**") == ["layers.block.layer3.dropout", "layers.block.layer3.size",
+                                                 "layers.layer1.dropout", "layers.layer1.size",
+                                                 "layers.layer2.dropout", "layers.layer2.size"]
+    assert schema.match_pattern("**.**.size") == ["layers.block.layer3.size", "layers.layer1.size",
+                                                  "layers.layer2.size"]
+    assert schema.match_pattern("layers.*") == []
+
+
+@raises(SystemExit)
+def test_pattern_type_enforced():
+    compile_config(layers_config).parse(["--layers.*.size=hallo"])
+
+
+@raises(SystemExit)
+def test_pattern_no_match():
+    compile_config(layers_config).parse(["--layers.*.bogus=1"])
+
+
+@raises(SystemExit)
+def test_pattern_missing_value():
+    compile_config(layers_config).parse(["--layers.*.size"])
+
+
+#############################################
+# Tests for sweeps
+############################################
+
+
+def test_merge_many():
+    yaml_params = {"key1": "yaml_value_key1", "key2": {"key2_1": 21}, "key3": {"key3_1": [1, 2]}}
+    argvs = [[], ["--key1=a"], ["--key2.key2_1=7", "--key1=b"]]
+    expected = [yaml_params,
+                {"key1": "a", "key2": {"key2_1": 21}, "key3": {"key3_1": [1, 2]}},
+                {"key1": "b", "key2": {"key2_1": 7}, "key3": {"key3_1": [1, 2]}}]
+
+    actual = merge_many(yaml_params, argvs)
+    assert actual == expected
+    # unchanged sub-dicts are shared with the base config
+    assert all(merged["key3"] is yaml_params["key3"] for merged in actual)
+
+
+def test_expand_sweep_product():
+    argv = ["--c=1", "--sweep", "a=[1, 2]", "--sweep=b=[x, 'y z']"]
+    expected = [["--c=1", "--a=1", "--b=x"], ["--c=1", "--a=1", "--b=y z"],
+                ["--c=1", "--a=2", "--b=x"], ["--c=1", "--a=2", "--b=y z"]]
+    assert expand_sweep(argv) == expected
+
+
+def test_expand_sweep_zip():
+    argv = ["--zip", "a=[1, 2]", "--zip", "b=[[x, y], [z]]", "--sweep", "c=[p, q]"]
+    expected = [["--a=1", "--b=[x, y]", "--c=p"], ["--a=1", "--b=[x, y]", "--c=q"],
+                ["--a=2", "--b=[z]", "--c=p"], ["--a=2", "--b=[z]", "--c=q"]]
+    assert expand_sweep(argv) == expected
+
+
+def test_expand_sweep_nothing_to_sweep():
+    assert expand_sweep(["--a=1"]) == [["--a=1"]]
+
+
+@raises(InvalidSweepException)
+def test_expand_sweep_zip_different_lengths():
+    expand_sweep(["--zip", "a=[1, 2]", "--zip", "b=[1]"])
+
+
+@raises(InvalidSweepException)
+def test_expand_sweep_not_a_list():
+    expand_sweep(["--sweep", "a=1"])
+
+
+@raises(InvalidSweepException)
+def test_expand_sweep_no_key():
+    expand_sweep(["--sweep", "[1, 2]"])
+
+
+def test_merge_sweep():
+    actual = merge_sweep(layers_config, ["--sweep", "layers.*.dropout=[0.1, 0.2]", "--sweep", "dropout=[0.3, 0.4]"],
+                         engine="fast")
+    assert [(merged["layers"]["layer2"]["dropout"], merged["dropout"]) for merged in actual] == \
+        [(0.1, 0.3), (0.1, 0.4), (0.2, 0.3), (0.2, 0.4)]
+    assert all(merged["layers"]["block"] is layers_config["layers"]["block"] for merged in actual)
+
+
+@raises(InvalidTrialsException)
+def test_merge_sweep_type_wrong():
+    merge_sweep(layers_config, ["--sweep", "dropout=[0.3, hallo]"])
+
+
+def test_merge_many_reports_every_invalid_trial():
+    argvs = [["--dropout=hallo"], ["--dropout=0.1"], ["--unknown=1"], ["--layers.*.dropout=[1]"]]
+    try:
+        merge_many(layers_config, argvs, engine="fast")
+        assert False
+    except InvalidTrialsException as e:
+        assert [(index, argv) for index, argv, message in e.errors] == [(0, argvs[0]), (2, argvs[2]), (3, argvs[3])]
+        assert e.errors[0][2] == "argument --dropout: invalid float value: 'hallo'"
+        assert e.errors[1][2] == "unrecognized arguments: --unknown=1"
+        assert "--dropout=hallo" in str(e)
+
+
+def test_merge_many_parallel():
+    argvs = [["--dropout={}".format(i / 10.0), "--layers.*.size={}".format(i)] for i in range(11)]
+    expected = merge_many(layers_config, argvs)
+
+    actual = merge_many(layers_config, argvs, workers=2, chunksize=3)
+    assert actual == expected
+    assert all(merged["layers"]["block"] is layers_config["layers"]["block"] for merged in actual)
+
+
+def test_merge_sweep_parallel_type_wrong():
+    try:
+        merge_sweep(layers_config, ["--sweep", "dropout=[0.3, hallo, 0.5, world]"], workers=2)
+        assert False
+    except InvalidTrialsException as e:
+        assert [(index, argv) for index, argv, message in e.errors] == [(1, ["--dropout=hallo"]),
+                                                                        (3, ["--dropout=world"])]
+
+
+def test_merge_many_parallel_modules():
+    yaml_params = {"module": yaml.load("!!python/module:os", Loader=yaml.UnsafeLoader), "other": {"a": 1}}
+    actual = merge_many(yaml_params, [["--module=sys"], []], workers=2)
+    assert actual[0]["module"] is sys
+    assert actual[1]["module"] is os
+
+
+def test_merge_many_help_is_an_invalid_trial():
+    for engine in ["argparse", "fast"]:
+        for workers in [None, 2]:
+            with capture_stdout() as stdout:
+                try:
+                    merge_many(layers_config, [["--dropout=0.5"], ["--help"], ["--hel"]], engine=engine,
+                               workers=workers)
+                    raise AssertionError("help was accepted")
+                except InvalidTrialsException as e:
+                    # argparse takes --hel for --help, the fast engine does not know it
+                    assert [index for index, argv, message in e.errors] == [1, 2]
+                    assert "--dropout" in e.errors[0][2]
+            assert stdout.getvalue() == ""
+
+
+def test_merge_many_unsupported_type_is_an_invalid_trial():
+    for workers in [None, 2]:
+        try:
+            merge_many({"a": set([1, 2]), "b": 1}, [["--b=2"], ["--a=x"]], workers=workers)
+            raise AssertionError("the set was parsed")
+        except InvalidTrialsException as e:
+            assert [index for index, argv, message in e.errors] == [1]
+
+
+def test_parse_help_raises_without_exit_on_error():
+    for engine in ["argparse", "fast"]:
+        try:
+            compile_config(layers_config).parse(["-h"], engine=engine, exit_on_error=False)
+            raise AssertionError("no help")
+        except InvalidCommandLineException as e:
+            assert "--dropout" in str(e)
+
+
+@raises(InvalidCommandLineException)
+def test_parse_raise_errors():
+    compile_config(layers_config).parse(["--dropout=hallo"], exit_on_error=False)
+
+
+#############################################
+# Tests for multi-document loading
+############################################
+
+
+stages_yaml = """
+name: prep
+batch_size: 8
+lr: 0.1
+---
+name: train
+batch_size: 16
+lr: 0.1
+---
+batch_size: 32
+lr: 0.1
+"""
+
+
+def load_all_with(loader, yaml_config, command_line_params):
+    with set_sys_argv(command_line_params):
+        return list(yaml.load_all(yaml_config, Loader=loader))
+
+
+def test_load_all_scoped_by_index_and_name():
+    for loader in [YAMLArgsLoader, YAMLArgsCLoader]:
+        actual = load_all_with(loader, stages_yaml, ["--lr=0.5", "--stage[2].batch_size", "64",
+                                                     "--stage[train].batch_size=-1"])
+        assert [(doc["batch_size"], doc["lr"]) for doc in actual] == [(8, 0.5), (-1, 0.5), (64, 0.5)]
+
+
+def test_load_all_is_a_generator():
+    with set_sys_argv(["--stage[0].batch_size=1"]):
+        documents = yaml.load_all(stages_yaml, Loader=YAMLArgsCLoader)
+        assert next(documents)["batch_size"] == 1
+        assert next(documents)["batch_size"] == 16
+
+
+@raises(SystemExit)
+def test_load_all_unknown_document():
+    with capture_stderr():
+        load_all_with(YAMLArgsCLoader, stages_yaml, ["--stage[eval].batch_size=1"])
+
+
+@raises(SystemExit)
+def test_load_all_type_wrong():
+    with capture_stderr():
+        load_all_with(YAMLArgsCLoader, stages_yaml, ["--stage[1].batch_size=hallo"])
+
+
+def test_load_all_with_disk_cache():
+    with disk_cache_enabled():
+        load_with(YAMLArgsCLoader, "batch_size: 8", [])
+        # same content, but the cached single document is of no use here
+        assert load_all_with(YAMLArgsCLoader, "batch_size: 8", ["--stage[0].batch_size=2"]) == [{"batch_size": 2}]
+
+
+def test_load_all_numeric_names():
+    numbered_yaml = stages_yaml.replace("name: train", "name: 7")
+    actual = load_all_with(YAMLArgsCLoader, numbered_yaml, ["--stage[name=7].batch_size=64", "--stage[0].lr=0.5"])
+    assert [(doc["batch_size"], doc["lr"]) for doc in actual] == [(8, 0.5), (64, 0.1), (32, 0.1)]
+
+    # numbers are indices, the error message tells how to select by name
+    with capture_stderr() as stderr:
+        try:
+            load_all_with(YAMLArgsCLoader, numbered_yaml, ["--stage[7].batch_size=64"])
+            raise AssertionError("--stage[7] was accepted")
+        except SystemExit:
+            pass
+    assert "--stage[name=7]" in stderr.getvalue()
+
+
+def test_load_all_arguments_of_some_documents():
+    epochs_yaml = stages_yaml.replace("name: train", "name: train\nepochs: 1\nlayers: {a: {dropout: 0.1}}")
+    for engine in ["argparse", "fast"]:
+        loader = type("EngineLoader", (YAMLArgsCLoader,), {"engine": engine})
+        actual = load_all_with(loader, epochs_yaml, ["--epochs", "10", "--lr=0.5", "--layers.*.dropout=0.2"])
+        assert [doc.get("epochs") for doc in actual] == [None, 10, None]
+        assert actual[1]["layers"]["a"]["dropout"] == 0.2
+        assert [doc["lr"] for doc in actual] == [0.5, 0.5, 0.5]
+
+    # only reported when no document has the argument, after all documents were loaded
+    with set_sys_argv(["--epochs=10", "--epoch=10"]):
+        documents = yaml.load_all(epochs_yaml, Loader=YAMLArgsCLoader)
+        assert [next(documents).get("epochs") for _ in range(3)] == [None, 10, None]
+        with capture_stderr() as stderr:
+            try:
+                next(documents)
+                raise AssertionError("--epoch was accepted")
+            except SystemExit:
+                pass
+    assert "argument --epoch: no document has this argument" in stderr.getvalue()
+
+
+def test_group_arguments():
+    argv = ["--a=1", "--b", "2", "-h", "--c", "--d", "-1", "x", "--", "--e=3"]
+    assert quickargs.group_arguments(argv) == [("a", ["--a=1"]), ("b", ["--b", "2"]), (None, ["-h"]), ("c", ["--c"]),
+                                               ("d", ["--d", "-1"]), (None, ["x"]), (None, ["--", "--e=3"])]
+
+
+def test_split_document_arguments():
+    argv = ["--a=1", "--stage[0].b", "2", "--stage[x].c=3", "--stage[0].d", "--e", "--stage[name=0].g=5", "--",
+            "--stage[1].f=4"]
+    common, scoped = split_document_arguments(argv, "stage")
+    assert common == ["--a=1", "--e", "--", "--stage[1].f=4"]
+    assert scoped == {0: ["--b", "2", "--d"], "x": ["--c=3"], "0": ["--g=5"]}
+
+
+#############################################
+# Tests for lazy loading
+############################################
+
+
+lazy_yaml = u"""
+name: 'h\u00e4h'
+lr: 0.1
+tables:
+  ids:
+    - 1
+    - 2
+    - 3
+  flow: [1, 2,
+    3, '\u00f6']
+  pair: !!python/tuple
+    - 1
+    - \u00fc
+other:
+  x: 1
+  small: [a, b]
+"""
+
+
+def load_lazy_from(yaml_config, command_line_params, lazy_size=10):
+    with NamedTemporaryFile("wb") as temp_file:
+        temp_file.write(yaml_config.encode("utf-8"))
+        temp_file.flush()
+        return load_lazy(temp_file.name, command_line_params, lazy_size=lazy_size)
+
+
+def test_load_lazy_same_as_load():
+    expected = yaml.load(lazy_yaml, Loader=yaml.Loader)
+    expected["lr"] = 0.5
+    expected["tables"]["flow"] = [9]
+
+    actual = load_lazy_from(lazy_yaml, ["--lr=0.5", "--tables.flow=[9]"])
+    assert isinstance(actual, LazyMapping)
+    assert not actual["tables"].is_constructed("ids")
+    assert isinstance(actual["other"], dict)
+    assert actual == expected
+    assert actual["tables"].is_constructed("ids")
+
+
+def test_load_lazy_small_lists():
+    actual = load_lazy_from(lazy_yaml, [], lazy_size=1000)
+    assert type(actual) == dict
+    assert actual == yaml.load(lazy_yaml, Loader=yaml.Loader)
+
+
+@raises(SystemExit)
+def test_load_lazy_type_wrong():
+    with capture_stderr():
+        load_lazy_from(lazy_yaml, ["--tables.ids=hallo"])
+
+
+def test_load_lazy_copies_share_lazy_nodes():
+    config = load_lazy_from(lazy_yaml, ["--tables.flow=[9]"])
+    copy = override_dict(config, {("lr",): 1.0})
+    assert copy["tables"] is config["tables"]
+    assert copy["tables"]["ids"] is config["tables"]["ids"]
+
+
+def test_load_lazy_fallback():
+    # aliases can not be loaded lazily
+    yaml_config = "a: &list [1, 2, 3, 4, 5, 6]\nb: *list\n"
+    actual = load_lazy_from(yaml_config, ["--b=[1]"])
+    assert actual == {"a": [1, 2, 3, 4, 5, 6], "b": [1]}
+
+
+#############################################
+# Tests for hot reloading
+############################################
+
+
+watched_conf = """
+model:
+    layers: 4
+    activation: relu
+training:
+    lr: 0.1
+    epochs: 10
+data:
+- a
+- b
+"""
+
+
+def write_config(path, text):
+    # make sure that the change is noticed even if the file system has a coarse modification time
+    mtime = os.stat(path).st_mtime + 1 if os.path.exists(path) else None
+    with open(path, "w") as f:
+        f.write(text)
+    if mtime is not None:
+        os.utime(path, (mtime, mtime))
+
+
+@contextmanager
+def watched_file(text):
+    directory = mkdtemp()
+    try:
+        path = os.path.join(directory, "config.yaml")
+        write_config(path, text)
+        yield path
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_watcher_reload():
+    with watched_file(watched_conf) as path:
+        watcher = ConfigWatcher(path, ["--training.epochs=20"])
+        notifications = []
+        watcher.subscribe(lambda config, changed: notifications.append((config, changed)))
+
+        write_config(path, watched_conf.replace("lr: 0.1", "lr: 0.01"))
+        assert watcher.check() == {("training", "lr")}
+        assert notifications == [(watcher.config, {("training", "lr")})]
+        assert watcher.config["training"] == {"lr": 0.01, "epochs": 20}
+        assert watcher.check() == set()
+
+
+def test_watcher_overridden_value_changed():
+    with watched_file(watched_conf) as path:
+        watcher = ConfigWatcher(path, ["--training.epochs=20"])
+        write_config(path, watched_conf.replace("epochs: 10", "epochs: 30") + "# comment\n")
+        assert watcher.check() == set()
+        assert watcher.config["training"]["epochs"] == 20
+
+
+def test_watcher_structure_changed():
+    with watched_file(watched_conf) as path:
+        watcher = ConfigWatcher(path, ["--model.layers=2"])
+        text = watched_conf.replace("lr: 0.1", "lr: 1").replace("activation: relu", "dropout: 0.5")
+        write_config(path, text + "seed: 3\n")
+        assert watcher.check() == {("training", "lr"), ("model", "activation"), ("model", "dropout"), ("seed",)}
+        assert watcher.config["model"] == {"layers": 2, "dropout": 0.5}
+        assert watcher.config["training"]["lr"] == 1
+
+
+def test_watcher_invalid_version_keeps_config():
+    with watched_file(watched_conf) as path:
+        watcher = ConfigWatcher(path, ["--model.layers=2"])
+        config = watcher.config
+        # invalid yaml, and a config without the key that is set on the command line
+        for text in ["model: [", watched_conf.replace("    layers: 4\n", "")]:
+            write_config(path, text)
+            assert watcher.check() == set()
+            assert watcher.error is not None
+            assert watcher.config is config
+        write_config(path, watched_conf.replace("relu", "tanh"))
+        assert watcher.check() == {("model", "activation")}
+        assert watcher.error is None
+
+
+def test_watcher_anchors():
+    text = "defaults: &defaults\n    lr: 0.1\ntraining:\n    <<: *defaults\n    epochs: 10\n"
+    with watched_file(text) as path:
+        watcher = ConfigWatcher(path, [])
+        assert watcher.chunks is None
+        write_config(path, text.replace("0.1", "0.2"))
+        assert watcher.check() == {("defaults", "lr"), ("training", "lr")}
+
+
+def test_watcher_split_chunks():
+    text = "# comment\n---\na: 1\nb:\n- x\n- y\n\n# comment\nc: {d: 1}\n"
+    chunks = split_chunks(text)
+    assert "".join(chunks) == text
+    for chunk in chunks:
+        assert isinstance(yaml.load(chunk, Loader=yaml.Loader) or {}, dict)
+    assert split_chunks("a: 1\n---\nb: 2\n") is None
+    assert split_chunks("%YAML 1.1\n---\na: 1\n") is None
+
+
+def test_watcher_many_chunks():
+    text = "".join("key_{}:\n    value: {}\n".format(i, i) for i in range(1000))
+    with watched_file(text) as path:
+        watcher = ConfigWatcher(path, [], engine="fast")
+        assert len(watcher.chunks) > 10
+        previous_chunks = watcher.chunks
+        unchanged = watcher.config["key_1"]
+        write_config(path, text.replace("key_500:\n    value: 500\n", "key_500:\n    value: -1\n    new: 1\n"))
+        assert watcher.check() == {("key_500", "value"), ("key_500", "new")}
+        # only one chunk was loaded again, the other keys were not loaded again
+        assert len(set(watcher.chunks) - set(previous_chunks)) == 1
+        assert watcher.config["key_1"] is unchanged
+
+
+def test_watcher_thread():
+    with watched_file(watched_conf) as path:
+        changed = []
+        with ConfigWatcher(path, [], interval=0.01) as watcher:
+            watcher.subscribe(lambda config, paths: changed.append(paths))
+            write_config(path, watched_conf.replace("relu", "tanh"))
+            for _ in range(500):
+                if changed:
+                    break
+                time.sleep(0.01)
+        assert changed == [{("model", "activation")}]
+        assert watcher.thread is None
+
+
+#############################################
+# Tests for asyncio loading
+############################################
+
+
+def run_coroutines(*coroutines):
+    import asyncio
+    loop = asyncio.new_event_loop()
+    try:
+        tasks = [loop.create_task(coroutine) for coroutine in coroutines]
+        loop.run_until_complete(asyncio.wait(tasks))
+        return [task.result() for task in tasks]
+    finally:
+        loop.close()
+
+
+@contextmanager
+def counted_compile_file():
+    from . import aio
+    threads = []
+
+    def compile_file(*args, **kwargs):
+        threads.append(threading.current_thread())
+        return original(*args, **kwargs)
+
+    original = aio.compile_file
+    aio.compile_file = compile_file
+    try:
+        yield threads
+    finally:
+        aio.compile_file = original
+
+
+def test_load_config_py3_only():
+    if sys.version_info < (3, 5):
+        return
+    from quickargs import load_config
+
+    expected = load_with(YAMLArgsLoader, simple_conf, ["--logging.level=0"])
+    with temp_yaml_file(simple_conf) as temp_file:
+        with counted_compile_file() as threads:
+            actual, = run_coroutines(load_config(temp_file, ["--logging.level=0"]))
+    assert_dict_equal(expected, actual)
+    # loading is not done in the thread of the event loop
+    assert threads and threading.current_thread() not in threads
+
+
+def test_load_config_coalesces_concurrent_loads_py3_only():
+    if sys.version_info < (3, 5):
+        return
+    from quickargs import load_config
+
+    with temp_yaml_file(simple_conf) as temp_file:
+        with counted_compile_file() as threads:
+            configs = run_coroutines(*[load_config(temp_file, ["--logging.level={}".format(level)])
+                                       for level in range(5)])
+            assert len(threads) == 1
+            assert [config["logging"]["level"] for config in configs] == list(range(5))
+
+            # the load is over, the next call loads the file again
+            run_coroutines(load_config(temp_file, []))
+            assert len(threads) == 2
+
+
+@raises(InvalidCommandLineException)
+def test_load_config_invalid_argument_py3_only():
+    if sys.version_info < (3, 5):
+        raise InvalidCommandLineException()
+    from quickargs import load_config
+
+    with temp_yaml_file(simple_conf) as temp_file:
+        run_coroutines(load_config(temp_file, ["--logging.level=WARNING"]))
+
+
+def test_load_config_help_does_not_exit_py3_only():
+    if sys.version_info < (3, 5):
+        return
+    from quickargs import load_config
+
+    with temp_yaml_file(simple_conf) as temp_file:
+        # argparse takes abbreviations of --help as well
+        for engine, argv in [("argparse", ["--help"]), ("argparse", ["--hel"]), ("fast", ["-h"])]:
+            with capture_stdout() as stdout:
+                try:
+                    run_coroutines(load_config(temp_file, argv, engine=engine))
+                    raise AssertionError("no help")
+                except InvalidCommandLineException as e:
+                    assert "--logging.level" in str(e)
+            assert stdout.getvalue() == ""
+
+
+#############################################
+# Tests for thread safety
+############################################
+
+
+def run_threads(target, count):
+    """
+    Run target(index) in count threads that all start at the same time
+    :return: list of the exceptions raised in the threads
+    """
+    start = threading.Event()
+    errors = []
+
+    def run(index):
+        start.wait()
+        try:
+            target(index)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=run, args=(index,)) for index in range(count)]
+    for thread in threads:
+        thread.start()
+    start.set()
+    for thread in threads:
+        thread.join()
+    return errors
+
+
+def tenant_conf():
+    # a structure that no other test uses, so that its schema is not compiled yet
+    return {"tenant_{}".format(random.getrandbits(64)): {"name": "default", "limit": 10},
+            "layers": [1, 2, 3],
+            "database": {"host": "localhost", "port": 5432}}
+
+
+def test_build_once_cache_builds_once():
+    from .cache import BuildOnceCache
+    cache = BuildOnceCache()
+    built = []
+
+    def build():
+        built.append(threading.current_thread())
+        time.sleep(0.05)  # all other threads have to wait for it
+        return object()
+
+    values = []
+    errors = run_threads(lambda index: values.append(cache.get("key", build)), 8)
+    assert not errors
+    assert len(built) == 1 and cache.builds == 1
+    assert len(values) == 8 and all(value is values[0] for value in values)
+    assert not cache.key_locks
+
+
+def test_compiled_schema_is_built_once_for_all_threads():
+    config = tenant_conf()
+    tenant = [key for key in config if key.startswith("tenant_")][0]
+    builds = quickargs.compiled_schemas.builds
+    parsers = []
+
+    def counting_parser_class():
+        parsers.append(threading.current_thread())
+        return original()
+
+    def parse(index):
+        compiled = compile_config(config)
+        for request in range(20):
+            argv = ["--{}.name=t{}".format(tenant, index), "--{}.limit={}".format(tenant, request)]
+            actual = compiled.parse(argv, engine="argparse", exit_on_error=False)
+            assert actual[tenant] == {"name": "t{}".format(index), "limit": request}
+            assert actual["database"] == config["database"]
+
+    original = quickargs.parser_class
+    quickargs.parser_class = counting_parser_class
+    try:
+        errors = run_threads(parse, 8)
+    finally:
+        quickargs.parser_class = original
+    assert not errors
+    assert quickargs.compiled_schemas.builds == builds + 1
+    assert len(parsers) == 1
+
+
+def test_shared_config_overlays():
+    from quickargs import SharedConfig
+    config = tenant_conf()
+    tenant = [key for key in config if key.startswith("tenant_")][0]
+    shared = SharedConfig(config)
+
+    def handle(index):
+        for request in range(50):
+            argv = ["--{}.name=t{}".format(tenant, index), "--layers=[{}]".format(request)]
+            with shared.overlay(argv):
+                view = shared.config
+                assert view[tenant]["name"] == "t{}".format(index)
+                assert view[tenant]["limit"] == 10
+                assert view["layers"] == [request]
+                # sub-dicts are read-only views as well
+                assert not hasattr(view["database"], "__setitem__")
+            assert shared.config[tenant]["name"] == "default"
+
+    errors = run_threads(handle, 8)
+    assert not errors
+    assert shared.config.materialize() == config
+
+
+def test_shared_config_help_does_not_exit():
+    from quickargs import SharedConfig
+    for engine in ["fast", "argparse"]:
+        shared = SharedConfig(tenant_conf(), engine=engine)
+        for argv in [["-h"], ["--help"]]:
+            with capture_stdout() as stdout:
+                try:
+                    shared.parse(argv)
+                    raise AssertionError("no help")
+                except InvalidCommandLineException as e:
+                    assert "--database.port" in str(e)
+            assert stdout.getvalue() == ""
+
+
+def test_shared_config_copies_default_lists():
+    from quickargs import SharedConfig
+    config = tenant_conf()
+    shared = SharedConfig(config)
+    view = shared.parse([])
+    view["layers"].append(4)
+    view.materialize()["database"]["port"] = 1
+    assert config["layers"] == [1, 2, 3]
+    assert config["database"]["port"] == 5432
+    assert shared.config["layers"] == [1, 2, 3]
+
+
+def test_shared_config_threads_throughput():
+    from quickargs import SharedConfig
+    config = tenant_conf()
+    tenant = [key for key in config if key.startswith("tenant_")][0]
+    shared = SharedConfig(config)
+    requests = 400
+
+    def handle(count):
+        for request in range(count):
+            assert shared.parse(["--{}.limit={}".format(tenant, request)])[tenant]["limit"] == request
+
+    def throughput(thread_count):
+        start = time.time()
+        assert not run_threads(lambda index: handle(requests // thread_count), thread_count)
+        return requests / (time.time() - start)
+
+    throughput(1)  # warm up
+    single = throughput(1)
+    # parsing holds the GIL, so more threads can not be faster. but they must not be much slower, i.e. threads do
+    # not wait for each other on locks
+    assert throughput(4) > single / 3
+
+
+#############################################
+# Tests for frozen configs
+############################################
+
+
+def test_merge_frozen():
+    from quickargs import FrozenConfig
+    yaml_config = yaml.load(all_types_conf, Loader=yaml.Loader)
+    argv = ["--an_int=4", "--sequences.a_list=[c,b,c]", "--python.a_module=yaml"]
+    expected = merge_yaml_with_args(yaml_config, argv)
+
+    actual = merge_yaml_with_args(yaml_config, argv, frozen=True)
+    assert isinstance(actual, FrozenConfig) and isinstance(actual["python"], FrozenConfig)
+    assert actual == expected
+    assert actual.thaw() == expected
+    assert type(actual.thaw()["sequences"]["a_list"]) is list
+    assert hash(actual) == hash(merge_yaml_with_args(yaml_config, argv, frozen=True))
+
+
+@raises(TypeError)
+def test_frozen_config_is_immutable():
+    config = merge_yaml_with_args(yaml.load(simple_conf, Loader=yaml.Loader), [], frozen=True)
+    config["logging"]["level"] = 0
+
+
+def test_frozen_results_share_unchanged_sub_configs():
+    compiled = compile_config(yaml.load(all_types_conf, Loader=yaml.Loader))
+    config1 = compiled.parse(["--sequences.a_list=[a]"], frozen=True)
+    config2 = compiled.parse(["--sequences.a_list=[b]"], frozen=True)
+    assert config1["python"] is config2["python"] is compiled.freeze()["python"]
+    assert config1["sequences"] is not config2["sequences"]
+    assert config1["sequences"]["a_list"] == ["a"] and config2["sequences"]["a_list"] == ["b"]
+    assert config1 != config2
+
+
+def test_frozen_config_set():
+    from quickargs import FrozenConfig
+    base = FrozenConfig({"logging": {"file": "output.log", "level": 4}, "layers": [{"units": 10}, {"units": 20}]})
+    hash(base)
+
+    derived = base.set(("logging", "level"), 0)
+    assert base["logging"]["level"] == 4
+    assert derived["logging"]["level"] == 0
+    assert derived["layers"] is base["layers"]
+    # the hash is derived from the hash of base, it has to be the same as for a config that is frozen from scratch
+    assert derived.hash_value is not None
+    assert hash(derived) == hash(FrozenConfig(derived.thaw()))
+    assert derived.set(("logging", "level"), 4) == base
+    assert hash(derived.set(("logging", "level"), 4)) == hash(base)
+
+    assert base.set(("logging", "new"), [1, 2])["logging"]["new"] == [1, 2]
+    assert base.update({}) is base
+
+
+def test_frozen_lists_and_tuples_are_different():
+    from quickargs import FrozenConfig
+    with_list, with_tuple = FrozenConfig({"x": [1, 2]}), FrozenConfig({"x": (1, 2)})
+    assert with_list != with_tuple and with_tuple != with_list
+    assert hash(with_list) != hash(with_tuple)
+    cache = {with_list: "list"}
+    assert with_tuple not in cache
+    assert with_list["x"] == [1, 2] and with_list["x"] != (1, 2)
+    assert with_list == FrozenConfig({"x": [1, 2]}) and hash(with_list) == hash(FrozenConfig({"x": [1, 2]}))
+
+
+@raises(KeyError)
+def test_frozen_config_set_below_value():
+    from quickargs import FrozenConfig
+    FrozenConfig({"logging": {"level": 4}}).set(("logging", "level", "x"), 0)
+
+
+#############################################
+# Tests for fingerprints
+############################################
+
+all_types_argv = ["--an_int=4", "--a_float=2.0", "--a_bool=False", "--a_complex_number=42-111j",
+                  "--a_date=2017-01-01", "--sequences.a_list=[c,b,c]", "--sequences.a_tuple=[b,a]",
+                  "--python.a_function=enumerate", "--python.a_class=yaml.parser.Parser", "--python.a_module=yaml",
+                  "--python.a_none=1234"]
+
+
+def test_fingerprint_of_overrides_equals_fingerprint_from_scratch():
+    from .fingerprint import config_hash, fingerprint_hex
+    compiled = compile_config(yaml.load(all_types_conf, Loader=yaml.Loader))
+    for argv in [[], all_types_argv[:1], all_types_argv]:
+        merged, fingerprint = compiled.parse(argv, fingerprint=True)
+        assert fingerprint == fingerprint_hex(config_hash(merged))
+        assert fingerprint == compile_config(merged).fingerprint()
+
+
+def test_merge_with_fingerprint():
+    yaml_config = yaml.load(all_types_conf, Loader=yaml.Loader)
+    expected = merge_yaml_with_args(yaml_config, all_types_argv)
+    merged, fingerprint = merge_yaml_with_args(yaml_config, all_types_argv, fingerprint=True)
+    assert_dict_equal(expected, merged)
+    # every overridden value changes the fingerprint (a_none stays None whatever is passed)
+    changing_argv = all_types_argv[:-1]
+    fingerprints = {merge_yaml_with_args(yaml_config, [], fingerprint=True)[1], fingerprint}
+    fingerprints.update(merge_yaml_with_args(yaml_config, [arg], fingerprint=True)[1] for arg in changing_argv)
+    assert len(fingerprints) == len(changing_argv) + 2
+    # frozen configs and views have the same fingerprint
+    assert merge_yaml_with_args(yaml_config, all_types_argv, frozen=True, fingerprint=True)[1] == fingerprint
+    assert merge_yaml_with_args(yaml_config, all_types_argv, view=True, fingerprint=True)[1] == fingerprint
+
+
+def test_fingerprint_types_are_distinguished():
+    fingerprints = {compile_config({"key": value}).fingerprint()
+                    for value in [1, 1.0, True, "1", b"1", [1], (1,), None, {}, [], ()]}
+    assert len(fingerprints) == 11
+    assert compile_config({"a": {"b": 1}, "c": 2}).fingerprint() == compile_config({"c": 2, "a": {"b": 1}}).fingerprint()
+    assert compile_config({"a": {"b": 1}}).fingerprint() != compile_config({"a": {"c": 1}}).fingerprint()
+
+
+def test_fingerprint_is_computed_from_the_overrides():
+    from . import fingerprint
+    compiled = compile_config(yaml.load(all_types_conf, Loader=yaml.Loader))
+    compiled.fingerprint()
+    hashed = []
+
+    def leaf_hash(path, value):
+        hashed.append(path)
+        return original(path, value)
+
+    original = fingerprint.leaf_hash
+    fingerprint.leaf_hash = leaf_hash
+    try:
+        compiled.parse(["--an_int=5", "--python.a_module=yaml"], fingerprint=True)
+    finally:
+        fingerprint.leaf_hash = original
+    # the default and the new value of each override
+    assert sorted(hashed) == sorted([("an_int",), ("an_int",), ("python", "a_module"), ("python", "a_module")])
+
+
+def test_fingerprint_is_stable_across_processes_py3_only():
+    if sys.version_info < (3, 7):
+        return
+    code = ("import sys, yaml\n"
+            "from quickargs.quickargs import merge_yaml_with_args\n"
+            "config = yaml.load(sys.argv[1], Loader=yaml.Loader)\n"
+            "print(merge_yaml_with_args(config, sys.argv[2:], fingerprint=True)[1])")
+    package_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    fingerprints = set()
+    # hash() of strings is different with every hash seed, fingerprints must not be
+    for seed in ["1", "2"]:
+        environ = dict(os.environ, PYTHONHASHSEED=seed, PYTHONPATH=package_dir)
+        output = subprocess.check_output([sys.executable, "-c", code, all_types_conf] + all_types_argv, env=environ)
+        fingerprints.add(output.decode("utf-8").strip())
+    assert fingerprints == {merge_yaml_with_args(yaml.load(all_types_conf, Loader=yaml.Loader), all_types_argv,
+                                                 fingerprint=True)[1]}
+
+
+#############################################
+# Tests for merge stats
+############################################
+
+
+def test_stats_stages():
+    yaml_params = {"key1": "yaml_value_key1", "key2": {"key2_1": 21, "key2_2": True}}
+    stats = MergeStats()
+    merge_yaml_with_args(yaml_params, ["--key2.key2_1=7", "--key2.key2_2=no"], stats=stats)
+
+    assert list(stats.stages) == ["flatten", "compile schema", "build parser", "parse argv", "convert values",
+                                  "merge"]
+    assert all(seconds >= 0 for seconds, blocks in stats.stages.values())
+    assert sorted(stats.key_times) == ["key2.key2_1", "key2.key2_2"]
+    assert "key2.key2_2" in stats.summary()
+
+
+def test_stats_from_environment():
+    with set_environ("QUICKARGS_STATS", "1"):
+        with capture_stderr() as stderr:
+            actual = load_with(YAMLArgsLoader, simple_conf, ["--logging.level=0"])
+    assert actual["logging"]["level"] == 0
+    assert "yaml load" in stderr.getvalue()
+    assert "logging.level" in stderr.getvalue()
+
+
+def test_stats_disabled():
+    with capture_stderr() as stderr:
+        load_with(YAMLArgsLoader, simple_conf, ["--logging.level=0"])
+    assert stderr.getvalue() == ""
+
+
+#############################################
+# Tests for safe loading
+############################################
+
+
+class OsLoader(SafeYAMLArgsLoader):
+    allowed_modules = ["os"]
+
+
+safe_conf = """
+function: !!python/name:os.path.join
+module: !!python/module:os.path
+a_tuple: !!python/tuple [1, 2]
+a_list: [1, 2]
+nothing: !!python/none
+"""
+
+
+def test_safe_loader():
+    actual = load_with(OsLoader, safe_conf, ["--function=os.getcwd", "--module=os", "--a_tuple=[3, a]",
+                                             "--a_list=[1, [2]]"])
+    expected = {"function": os.getcwd, "module": os, "a_tuple": (3, "a"), "a_list": [1, [2]], "nothing": None}
+    assert_dict_equal(expected, actual)
+
+
+@raises(yaml.constructor.ConstructorError)
+def test_safe_loader_module_not_allowed_in_yaml():
+    load_with(SafeYAMLArgsLoader, safe_conf, [])
+
+
+@raises(yaml.constructor.ConstructorError)
+def test_safe_loader_no_objects_in_yaml():
+    load_with(OsLoader, "key: !!python/object/apply:os.getcwd []", [])
+
+
+def test_safe_loader_not_allowed_on_command_line():
+    for argv in [["--function=sys.exit"], ["--module=sys"], ["--function=zip"],
+                 ["--a_list=[!!python/object/apply:os.getcwd []]"], ["--a_tuple=[!!python/name:sys.exit]"]]:
+        with capture_stderr():
+            try:
+                load_with(OsLoader, safe_conf, argv)
+                raise AssertionError("{} was accepted".format(argv))
+            except SystemExit:
+                pass
+
+
+def test_safe_loader_parent_package_allowed():
+    assert quickargs.is_allowed_module("os.path", ["os"])
+    assert not quickargs.is_allowed_module("os2", ["os"])
+    assert not quickargs.is_allowed_module("os", ["os.path"])
+
+
+def test_safe_compile_config():
+    compiled = compile_config({"function": os.getcwd}, allowed_modules=["os"])
+    assert compiled.parse(["--function=os.getpid"])["function"] is os.getpid
+    assert compile_config({"function": zip}).schema is not compiled.schema
+    with capture_stderr():
+        try:
+            compiled.parse(["--function=zip"])
+            raise AssertionError("zip was accepted")
+        except SystemExit:
+            pass
+
+
+def test_safe_loader_does_not_use_disk_cache():
+    with disk_cache_enabled() as cache_dir:
+        load_with(OsLoader, safe_conf, [])
+        quickargs.compile_file(safe_conf.encode("utf-8"), allowed_modules=["os"],
+                               disk_cache=quickargs.DiskCache(cache_dir))
+        assert os.listdir(cache_dir) == []
+
+
+def test_safe_loader_imports_cached():
+    imports = []
+
+    def import_module(name):
+        imports.append(name)
+        return original(name)
+
+    original = quickargs.importlib.import_module
+    quickargs.importlib.import_module = import_module
+    quickargs.imported_modules.clear()
+    try:
+        for _ in range(3):
+            load_with(OsLoader, "function: !!python/name:os.path.join", ["--function=os.path.split"])
+    finally:
+        quickargs.importlib.import_module = original
+    assert imports == ["os.path"]
+
+
+#############################################
+# Tests for parity between libyaml and pure-python loading
+############################################
+
+
+@contextmanager
+def use_value_loader(loader):
+    original = quickargs.ValueLoader
+    quickargs.ValueLoader = loader
+    try:
+        yield
+    finally:
+        quickargs.ValueLoader = original
+
+
+def load_with(loader, yaml_config, command_line_params):
+    with set_sys_argv(command_line_params):
+        return yaml.load(yaml_config, Loader=loader)
+
+
+def parse_value_with(loader, type_to_enforce, value):
+    with use_value_loader(loader):
+        try:
+            return yaml_parse_value(type_to_enforce, value)
+        except ValueError:
+            return ValueError
+
+
+def test_cloader_fallback():
+    if yaml.__with_libyaml__:
+        assert issubclass(YAMLArgsCLoader, yaml.CLoader)
+    else:
+        assert YAMLArgsCLoader is YAMLArgsLoader
+
+
+def test_cloader_parity_configs():
+    configs = [(simple_conf, ["--logging.file=other_log.txt", "--logging.level=0"]),
+               (nested_conf, ["--key1.key2.key3.key4=other_value"]),
+               (sequence_conf, ["--thresholds=[0.0, 0.5, 1.0]"]),
+               (function_conf, ["--function_to_call=zip"]),
+               (all_types_conf, []),
+               (all_types_conf, "--an_int=4 --a_float=2.0 --a_bool=False --a_complex_number=42-111j "
+                                "--a_date=2017-01-01 --sequences.a_list=[c,b,c] --sequences.a_tuple=[b,a] "
+                                "--python.a_function=enumerate --python.a_class=yaml.parser.Parser "
+                                "--python.a_module=yaml --python.a_none=1234".split())]
+    for config, command_line_params in configs:
+        expected = load_with(YAMLArgsLoader, config, command_line_params)
+        actual = load_with(YAMLArgsCLoader, config, command_line_params)
+        assert_dict_equal(expected, actual)
+
+
+def test_cloader_parity_values():
+    values = [("!!bool", "yes"), ("!!bool", "False"), ("!!bool", "hallo"), ("!!bool", ""),
+              ("!!python/none", "None"), ("!!python/none", "value"), ("!!python/none", "a: b"),
+              ("!!timestamp", "2016-12-11"), ("!!timestamp", "2001-12-14 21:59:43.10 -5"), ("!!timestamp", "hallo"),
+              ("!!python/list", "[a, 1, 2.0, True, ~, 2016-12-11]"), ("!!python/list", "[]"),
+              ("!!python/list", "[a, [b, c], {d: e}]"), ("!!python/list", "[a"), ("!!python/list", "'abc"),
+              ("!!python/list", "a\tb"), ("!!python/list", "hallo"),
+              ("!!python/tuple", "[0, 'd']"), ("!!python/tuple", "hallo"),
+              ("!!python/name", "zip"), ("!!python/name", "yaml.load"), ("!!python/name", "yaml"),
+              ("!!python/name", "yaml.not_existing"), ("!!python/module", "yaml.composer"),
+              ("!!python/module", "yaml.blabla")]
+    for type_to_enforce, value in values:
+        expected = parse_value_with(yaml.Loader, type_to_enforce, value)
+        actual = parse_value_with(quickargs.ValueLoader, type_to_enforce, value)
+        assert expected == actual, (type_to_enforce, value, expected, actual)
+
+
+#############################################
+# Tests for the fast value parsers
+############################################
+
+
+@contextmanager
+def without_parsed_value_cache():
+    original_maxsize = quickargs.parsed_values.maxsize
+    quickargs.parsed_values.clear()
+    quickargs.parsed_values.maxsize = 0
+    try:
+        yield
+    finally:
+        quickargs.parsed_values.maxsize = original_maxsize
+
+
+@contextmanager
+def without_fast_parsers():
+    # cached results would hide the difference between the fast parsers and yaml
+    original = dict(quickargs.fast_value_parsers)
+    quickargs.fast_value_parsers.clear()
+    try:
+        with without_parsed_value_cache():
+            yield
+    finally:
+        quickargs.fast_value_parsers.update(original)
+
+
+def assert_fast_parse_same_as_yaml(type_to_enforce, values):
+    for value in values:
+        with without_fast_parsers():
+            expected = parse_value_with(quickargs.ValueLoader, type_to_enforce, value)
+        actual = parse_value_with(quickargs.ValueLoader, type_to_enforce, value)
+        assert type(expected) == type(actual) and expected == actual, (type_to_enforce, value, expected, actual)
+
+
+def test_fast_parse_bool():
+    spellings = ["yes", "no", "true", "false", "on", "off", "y", "n", "1", "0", "hallo", "", " yes", "yes ",
+                 "'yes'", "yes\n", "-yes", "~"]
+    values = [variant for spelling in spellings
+              for variant in [spelling, spelling.upper(), spelling.capitalize(), spelling.swapcase()]]
+    assert_fast_parse_same_as_yaml("!!bool", values)
+
+
+def test_fast_parse_none():
+    values = ["~", "null", "Null", "NULL", "None", "", "value", "1234", "-1", "a b", "a: b", "[a]", "{a: b}", "'a'",
+              "#", "- a", "-", "a\tb"]
+    assert_fast_parse_same_as_yaml("!!python/none", values)
+
+
+def test_fast_parse_timestamp():
+    values = ["2016-12-11", "2016-1-1", "2001-12-14t21:59:43.10-05:00", "2001-12-14 21:59:43.10 -5",
+              "2001-12-14T21:59:43Z", "2001-12-14 21:59:43.1234567", "2001-12-15 2:59:43.10", str(datetime.now()),
+              "2016-13-45", "2016-12-11 ", " 2016-12-11", "2016-12-11\t10:00:00", "2016-12-11\n", "hallo", "",
+              "'2016-12-11'"]
+    assert_fast_parse_same_as_yaml("!!timestamp", values)
+
+
+def test_fast_parse_sequences():
+    values = ["[]", "[ ]", "[a, b, c]", "['x', 'y', 'z']", "[0, 1, 2]", "[b, 4, True]", "[a b, c]", "[ a ,b ]",
+              "[1_000, 0x1F, 0o17, 0b11, 017, -1, +1, 1.5e+3, 1e3, .inf, -.inf, .NaN, ., ~, null, yes, Off]",
+              "[2016-12-11, 2001-12-14 21:59:43.10 -5, 12:30, 1:20:30]", "[-, -a, a-]", "[a,]", "[a, [b]]",
+              "[a, {b: c}]", "[a", "a, b", "hallo", "", "[a]x", "[a  b]", "[a\tb]"]
+    assert_fast_parse_same_as_yaml("!!python/list", values)
+    assert_fast_parse_same_as_yaml("!!python/tuple", values)
+
+
+def test_fast_parse_falls_back_to_yaml():
+    assert yaml_parse_value("!!python/list", "[a, [b, c]]") == ["a", ["b", "c"]]
+    assert yaml_parse_value("!!bool", "'yes'") is True
+    assert quickargs.fast_parse_list("[a, [b, c]]") is quickargs.unhandled
+
+
+#############################################
+# Tests for the parsed value cache
+############################################
+
+
+@contextmanager
+def parsed_value_cache(maxsize):
+    original_maxsize = quickargs.parsed_values.maxsize
+    quickargs.parsed_values.clear()
+    quickargs.parsed_values.maxsize = maxsize
+    try:
+        yield quickargs.parsed_values
+    finally:
+        quickargs.parsed_values.clear()
+        quickargs.parsed_values.maxsize = original_maxsize
+
+
+def test_parsed_value_cache_hits():
+    with parsed_value_cache(16) as cache:
+        for _ in range(3):
+            assert yaml_parse_value("!!python/name", "os.path.join") is os.path.join
+            assert yaml_parse_value("!!python/tuple", "[1, a]") == (1, "a")
+        assert (cache.hits, cache.misses) == (4, 2)
+
+
+def test_parsed_value_cache_lists_are_copies():
+    with parsed_value_cache(16):
+        for value in ["[1, a]", "[[1], {a: b}]"]:
+            first = yaml_parse_value("!!python/list", value)
+            first.append("changed")
+            second = yaml_parse_value("!!python/list", value)
+            third = yaml_parse_value("!!python/list", value)
+            assert "changed" not in second
+            assert second == third and second is not third
+        second[0].append("changed")
+        assert yaml_parse_value("!!python/list", "[[1], {a: b}]") == [[1], {"a": "b"}]
+
+
+def test_parsed_value_cache_least_recently_used_dropped():
+    with parsed_value_cache(2) as cache:
+        yaml_parse_value("!!bool", "yes")
+        yaml_parse_value("!!bool", "no")
+        yaml_parse_value("!!bool", "yes")
+        yaml_parse_value("!!bool", "on")  # drops "no"
+        assert len(cache) == 2
+        misses = cache.misses
+        yaml_parse_value("!!bool", "yes")
+        assert cache.misses == misses
+        yaml_parse_value("!!bool", "no")
+        assert cache.misses == misses + 1
+
+
+def test_parsed_value_cache_not_for_objects():
+    register_yaml_object(ClassC)
+    with parsed_value_cache(16) as cache:
+        first = init_type_parser(ClassC(1))("{name: test}")
+        second = init_type_parser(ClassC(1))("{name: test}")
+        assert first is not second
+        assert len(cache) == 0
+
+
 #############################################
 # Tests for some of the utility functions
 ############################################
@@ -644,6 +2311,81 @@ def test_unflatten_dict_nested():
     assert_dict_equal(expected, actual)
 
 
+def test_flatten_dict_empty_sub_dict():
+    dict_to_flatten = {"key1": {}, "key2": "val2"}
+    expected = {("key2",): "val2"}
+
+    actual = flatten_dict(dict_to_flatten)
+    assert_dict_equal(expected, actual)
+
+
+def test_flatten_dict_not_a_dict():
+    expected = {(): ["123"]}
+
+    actual = flatten_dict(["123"])
+    assert_dict_equal(expected, actual)
+
+
+def test_flatten_unflatten_very_deep():
+    depth = sys.getrecursionlimit() * 2
+    nested = leaf = {}
+    for i in range(depth):
+        leaf["key{}".format(i)] = {}
+        leaf = leaf["key{}".format(i)]
+    leaf["last"] = "val"
+    key_hierarchy = tuple("key{}".format(i) for i in range(depth)) + ("last",)
+
+    flattened = flatten_dict(nested)
+    assert flattened == {key_hierarchy: "val"}
+    # comparing the nested dicts directly would hit the recursion limit
+    assert flatten_dict(unflatten_dict(flattened)) == flattened
+
+
+def test_override_dict():
+    dict_to_override = {"key1": {"key1_1": "val11", "key1_2": {"key1_2_1": "val121"}}, "key2": "val2"}
+    overrides = {("key1", "key1_2", "key1_2_1"): "new121", ("key2",): "new2"}
+    expected = {"key1": {"key1_1": "val11", "key1_2": {"key1_2_1": "new121"}}, "key2": "new2"}
+
+    actual = override_dict(dict_to_override, overrides)
+    assert_dict_equal(expected, actual)
+    assert dict_to_override["key1"]["key1_2"]["key1_2_1"] == "val121"
+    assert dict_to_override["key2"] == "val2"
+
+
+def test_override_dict_shared_sub_dict():
+    # yaml anchors and aliases put the same dict in several places
+    shared = {"key": "val"}
+    dict_to_override = {"key1": shared, "key2": shared}
+    expected = {"key1": {"key": "new"}, "key2": {"key": "val"}}
+
+    actual = override_dict(dict_to_override, {("key1", "key"): "new"})
+    assert_dict_equal(expected, actual)
+    assert actual["key2"] is shared
+
+
+def test_config_view():
+    yaml_params = {"key1": {"key1_1": "val11", "key1_2": {"key1_2_1": "val121"}}, "key2": "val2", "key3": {"a": 1}}
+    expected = {"key1": {"key1_1": "val11", "key1_2": {"key1_2_1": "new121"}}, "key2": "val2", "key3": {"a": 1}}
+
+    view = merge_yaml_with_args(yaml_params, ["--key1.key1_2.key1_2_1=new121"], view=True)
+    assert isinstance(view, ConfigView)
+    assert view == expected
+    assert view["key3"] is yaml_params["key3"]
+    assert view["key1"]["key1_2"]["key1_2_1"] == "new121"
+    assert sorted(view) == ["key1", "key2", "key3"] and len(view) == 3
+    assert yaml_params["key1"]["key1_2"]["key1_2_1"] == "val121"
+
+
+def test_config_view_materialize():
+    yaml_params = {"key1": {"key1_1": "val11"}, "key2": {"key2_1": 21}}
+    view = compile_config(yaml_params).parse(["--key1.key1_1=new"], view=True)
+
+    actual = view.materialize()
+    assert type(actual) == dict and type(actual["key1"]) == dict
+    assert_dict_equal({"key1": {"key1_1": "new"}, "key2": {"key2_1": 21}}, actual)
+    assert actual["key2"] is yaml_params["key2"]
+
+
 ##########################################################
 # References that are needed for some of the tests
 #########################################################
@@ -663,10 +2405,28 @@ class ClassB(yaml.YAMLObject):
         self.name = name
 
 
+class ClassC(yaml.YAMLObject):
+    yaml_tag = u'!ClassC'
+
+    def __init__(self, name):
+        self.name = name
+
+
+class ClassD(yaml.YAMLObject):
+    yaml_tag = u'!ClassD'
+
+    def __init__(self, name):
+        self.name = name
+
+
 def functionA():
     pass
 
 
+def parse_set(value):
+    return set(value.split(","))
+
+
 def functionB():
     pass
 
@@ -0,0 +1,318 @@
+import os
+import re
+import sys
+import zlib
+import threading
+
+from .imports import yaml
+from .quickargs import CompiledConfig, compile_config, value_loader_class, safe_value_loader, flatten_dict, \
+    override_dict, InvalidCommandLineException, UnsupportedYAMLTypeException, ArgumentWithoutNameException
+
+
+class ConfigWatcher(object):
+    """
+    Keeps a merged config up to date with its yaml file. The file is polled for changes, on every change it is loaded
+    again, the command line arguments are applied again and the subscribers are told which key paths have changed.
+    Reloading is incremental: the file is split into chunks of top-level keys, only the chunks that were edited are
+    loaded again and only their keys are compared with the previous version. As long as no keys are added or removed
+    and no types change, the command line parser and the converted arguments are reused as well.
+    with ConfigWatcher("config.yaml") as watcher:
+        watcher.subscribe(lambda config, changed: print(changed))
+        run(watcher)  # watcher.config is always the latest merged config
+    """
+    def __init__(self, path, argv=None, engine="argparse", allowed_modules=None, interval=1.0):
+        """
+        Loads the config right away. Errors are reported as usual (e.g. invalid command line arguments exit).
+        :param path: path of the yaml file
+        :param argv: command line arguments, if argv is None, sys.argv will be used
+        :param engine: "argparse" or "fast", see CompiledConfig.match_arguments
+        :param allowed_modules: if not None, the file and the command line are loaded safely, see compile_config
+        :param interval: seconds between two checks of the file, see start
+        """
+        self.path = path
+        self.argv = sys.argv[1:] if argv is None else list(argv)
+        self.engine = engine
+        self.allowed_modules = allowed_modules
+        self.interval = interval
+        self.subscribers = []
+        self.error = None  # exception of the last reload that failed, None if it worked
+
+        self.file_stat = None
+        self.text = None
+        self.chunks = None  # chunk text -> loaded chunk, None if the file can not be split into chunks
+        self.yaml_config = None
+        self.compiled = None
+        self.overrides = None
+        self.config = None
+
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = None
+
+        with self.lock:
+            self.file_stat = file_stat(self.path)
+            self.update(read_text(self.path), exit_on_error=True)
+
+    def subscribe(self, callback):
+        """
+        :param callback: called as callback(config, changed) after every reload that changed the merged config.
+                         changed is a set of key paths (tuples of keys as in flatten_dict) whose values were changed,
+                         added or removed
+        :return: callback, so that subscribe can be used as a decorator
+        """
+        self.subscribers.append(callback)
+        return callback
+
+    def unsubscribe(self, callback):
+        self.subscribers.remove(callback)
+
+    def check(self):
+        """
+        Reload the file if it was changed since the last check and notify the subscribers.
+        If the new version can not be loaded or the command line arguments don't fit it any more, the previous config
+        is kept and the exception is stored in self.error.
+        :return: set of changed key paths, empty if nothing changed
+        """
+        with self.lock:
+            current_stat = file_stat(self.path)
+            if current_stat == self.file_stat:
+                return set()
+            self.file_stat = current_stat
+
+            text = read_text(self.path)
+            if text == self.text:
+                return set()
+
+            try:
+                changed = self.update(text, exit_on_error=False)
+            except (yaml.YAMLError, InvalidCommandLineException, UnsupportedYAMLTypeException,
+                    ArgumentWithoutNameException, TypeError) as e:
+                self.text = text  # don't try again before the file is changed again
+                self.error = e
+                return set()
+            self.error = None
+            config = self.config
+
+        if changed:
+            for callback in list(self.subscribers):
+                callback(config, changed)
+        return changed
+
+    def update(self, text, exit_on_error):
+        """
+        Load a new version of the file and merge it with the command line arguments
+        :return: set of changed key paths
+        """
+        loader = value_loader_class() if self.allowed_modules is None else safe_value_loader(self.allowed_modules)
+        chunks = load_chunks(text, loader, self.chunks or {})
+        if chunks is None:
+            yaml_config = yaml.load(text, Loader=loader)
+            touched = None
+        else:
+            yaml_config = {}
+            for loaded in chunks.values():
+                yaml_config.update(loaded)
+            # top-level keys of the edited chunks, all others have exactly the same values as before
+            previous_chunks = self.chunks or {}
+            touched = set()
+            for chunk in set(chunks).symmetric_difference(previous_chunks):
+                touched.update(chunks[chunk] if chunk in chunks else previous_chunks[chunk])
+
+        if self.config is None:
+            previous_flat, flat = {}, {}
+        elif touched is None or self.chunks is None:
+            previous_flat, flat = flatten_dict(self.yaml_config), flatten_dict(yaml_config)
+        else:
+            previous_flat = flatten_dict({key: self.yaml_config[key] for key in touched if key in self.yaml_config})
+            flat = flatten_dict({key: yaml_config[key] for key in touched if key in yaml_config})
+        yaml_changed = changed_paths(previous_flat, flat)
+
+        same_structure = self.config is not None and all(
+            path in previous_flat and path in flat and type(previous_flat[path]) is type(flat[path])
+            for path in yaml_changed)
+        if same_structure:
+            # same parser, same converted arguments. only the values of the config itself have changed
+            compiled = CompiledConfig(self.compiled.schema, yaml_config)
+            overrides = self.overrides
+        else:
+            compiled = compile_config(yaml_config, allowed_modules=self.allowed_modules)
+            overrides = compiled.parse_overrides(self.argv, engine=self.engine, exit_on_error=exit_on_error)
+        config = override_dict(yaml_config, overrides)
+
+        # overridden values stay the same, unless the arguments themselves were converted differently
+        candidates = set(yaml_changed)
+        if self.overrides is not None and overrides is not self.overrides:
+            candidates.update(changed_paths(self.overrides, overrides))
+        changed = set()
+        if self.config is not None:
+            changed = {path for path in candidates
+                       if not same_value(lookup(self.config, path), lookup(config, path))}
+
+        self.text = text
+        self.chunks = chunks
+        self.yaml_config = yaml_config
+        self.compiled = compiled
+        self.overrides = overrides
+        self.config = config
+        return changed
+
+    def start(self):
+        """
+        Check the file every self.interval seconds in a background thread, until stop is called
+        """
+        if self.thread is not None:
+            return
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.run, name="quickargs-watcher")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            try:
+                self.check()
+            except (IOError, OSError) as e:  # e.g. the file is replaced right now, try again next time
+                self.error = e
+
+    def stop(self):
+        if self.thread is None:
+            return
+        self.stop_event.set()
+        self.thread.join()
+        self.thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+
+def file_stat(path):
+    # inode changes when editors replace the file instead of writing to it
+    stat = os.stat(path)
+    return stat.st_mtime, stat.st_size, stat.st_ino
+
+
+def read_text(path):
+    with open(path, "rb") as f:
+        return f.read().decode("utf-8")
+
+
+def load_chunks(text, loader, previous_chunks):
+    """
+    Load the file chunk by chunk, chunks that did not change are taken from previous_chunks
+    :param text: content of the yaml file
+    :param loader: yaml loader class for the chunks
+    :param previous_chunks: chunk text -> loaded chunk, as returned for the previous version of the file
+    :return: chunk text -> loaded chunk (a dictionary), in the order of the file. None if the file has to be loaded as
+             a whole
+    """
+    chunks = split_chunks(text)
+    if chunks is None:
+        return None
+
+    loaded_chunks = {}
+    for chunk in chunks:
+        loaded = previous_chunks.get(chunk)
+        if loaded is None:
+            # the chunks of the previous version had no anchors, so new chunks can only use their own anchors
+            if anchor_regexp.search(chunk):
+                return None
+            try:
+                loaded = yaml.load(chunk, Loader=loader)
+            except yaml.YAMLError:
+                return None  # let yaml report the error for the whole file
+            if loaded is None:
+                loaded = {}  # only comments
+            if not isinstance(loaded, dict):
+                return None
+        loaded_chunks[chunk] = loaded
+    if len(loaded_chunks) != len(chunks):
+        return None  # the same chunk twice, the order of the keys would be lost
+    return loaded_chunks
+
+
+def split_chunks(text):
+    """
+    Split a yaml file whose root is a block mapping into chunks of top-level keys that can be loaded independently.
+    Chunks end at content-defined positions (after long top-level values or at some of the keys), so inserting or
+    removing lines only changes the chunk that contains them.
+    :param text: content of the yaml file
+    :return: list of chunk texts or None if the file can not be split, e.g. because it uses directives
+    """
+    chunks = []
+    chunk_start = 0
+    key_start = None
+    for match in top_level_regexp.finditer(text):
+        line = match.group()
+        if not line:
+            continue  # end of the file
+        if line.startswith("---"):
+            if key_start is not None or line[3:].strip() != "":
+                return None  # more than one document or a tagged root
+            continue
+        if line.startswith(("%", "...", "? ", "{", "[", "!", "&", "|", ">")):
+            return None
+
+        # a top-level key, a chunk may start here
+        position = match.start()
+        if key_start is not None and (text.count("\n", key_start, position) >= long_value_lines or
+                                      zlib.crc32(line.encode("utf-8")) % chunk_keys == 0):
+            chunks.append(text[chunk_start:position])
+            chunk_start = position
+        key_start = position
+
+    if chunk_start < len(text):
+        chunks.append(text[chunk_start:])
+    return chunks
+
+
+# lines at the top level of the file, i.e. everything but empty lines, comments, indented lines and sequence entries
+# (top-level values can be sequences without indentation: "key:\n- a\n- b")
+top_level_regexp = re.compile(r"^(?![ \t#\r\n]|-(?:[ \t\r\n]|$)).*$", re.MULTILINE)
+
+# anchors (&name) and aliases (*name) can connect chunks, files that (might) use them are loaded as a whole
+anchor_regexp = re.compile(r"(?<![^\s\[\]{},:])[&*][^\s\[\]{},]")
+
+# a top-level key whose value spans at least this many lines gets a chunk of its own
+long_value_lines = 32
+
+# on average, every chunk_keys-th top-level key starts a new chunk
+chunk_keys = 16
+
+
+def changed_paths(previous_flat, flat):
+    """
+    :return: set of the key paths that are only in one of the flat dicts or have different values
+    """
+    changed = set(previous_flat).symmetric_difference(flat)
+    changed.update(path for path in flat if path in previous_flat and not same_value(previous_flat[path], flat[path]))
+    return changed
+
+
+def same_value(value1, value2):
+    # 1, 1.0 and True are equal, but they are different config values
+    if type(value1) is not type(value2):
+        return False
+    try:
+        return bool(value1 == value2)
+    except Exception:
+        return value1 is value2
+
+
+def lookup(config, path):
+    """
+    :return: value at the key path in a nested config, missing if there is no such value
+    """
+    value = config
+    for key in path:
+        if not isinstance(value, dict) or key not in value:
+            return missing
+        value = value[key]
+    return value
+
+
+# marker for key paths that don't exist
+missing = object()